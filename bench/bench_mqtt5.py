@@ -0,0 +1,156 @@
+#!/usr/bin/python3
+
+"""Bytes-on-wire and CPU benchmark: MQTT 3.1.1 against MQTT v5 mode.
+
+Publishes the per-reading topic mix of a node with the default publish
+policies, once over 3.1.1 and once over v5 with message expiry, the unit
+user property and topic aliases (topicalias.TopicAliases). A small TCP
+proxy between client and broker counts the bytes sent to the broker, CPU
+is the process time spent until the broker acknowledged everything.
+
+Needs paho-mqtt and a broker, e.g. a local mosquitto (max_topic_alias
+defaults to 10 there):
+Usage: python3 bench/bench_mqtt5.py [host] [port] [readings]
+"""
+
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import paho.mqtt.client as mqtt
+from paho.mqtt.properties import Properties
+from paho.mqtt.packettypes import PacketTypes
+
+import pubpolicy
+import topicalias
+
+NODE = "67161707004B1200"
+# (topic, payload, unit) published per reading of a power plug and a combo sensor
+READING_TOPICS = [
+    ("smarthome/node/%s/sensor/power/1027/timestamp/power", "18.10.2026 12:00:00", None),
+    ("smarthome/node/%s/sensor/power/1027/value/power", "123.45", "W"),
+    ("smarthome/node/%s/sensor/temperature/1026/timestamp/actual", "18.10.2026 12:00:00", None),
+    ("smarthome/node/%s/sensor/temperature/1026/value/actual", "21.5", "oC"),
+    ("smarthome/node/%s/sensor/humidity/1029/timestamp/actual", "18.10.2026 12:00:00", None),
+    ("smarthome/node/%s/sensor/humidity/1029/value/actual", "45.2", "%"),
+]
+
+
+class CountingProxy(object):
+    """Forwards one client connection to the broker, counts client -> broker bytes."""
+
+    def __init__(self, host, port):
+        self.upstream = (host, port)
+        self.sent = 0
+        self._listener = socket.socket()
+        self._listener.bind(("127.0.0.1", 0))
+        self._listener.listen(1)
+        self.port = self._listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        client, address = self._listener.accept()
+        broker = socket.create_connection(self.upstream)
+        threading.Thread(target=self._pipe, args=(client, broker, True), daemon=True).start()
+        threading.Thread(target=self._pipe, args=(broker, client, False), daemon=True).start()
+
+    def _pipe(self, source, destination, count):
+        while True:
+            data = source.recv(65536)
+            if not data:
+                destination.close()
+                return
+            if count:
+                self.sent += len(data)
+            destination.sendall(data)
+
+
+class Counter(object):
+    def __init__(self, expected):
+        self.done = 0
+        self.expected = expected
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+
+    def on_publish(self, client, userdata, mid):
+        with self.lock:
+            self.done += 1
+            if self.done >= self.expected:
+                self.event.set()
+
+
+def run(host, port, messages, protocol):
+    """messages: list of (topic, payload, qos, retain, expiry, unit) -> (bytes sent, cpu s, wall s)."""
+    proxy = CountingProxy(host, port)
+    counter = Counter(len(messages))
+    connected = threading.Event()
+    client = mqtt.Client(protocol=protocol)
+    client.max_inflight_messages_set(100)
+    client.max_queued_messages_set(0)
+    client.on_publish = counter.on_publish
+    aliases = topicalias.TopicAliases(client) if protocol == mqtt.MQTTv5 else None
+
+    def on_connect(client, userdata, flags, rc, properties=None):
+        if aliases is not None:
+            aliases.reset(getattr(properties, "TopicAliasMaximum", 0))
+        connected.set()
+
+    client.on_connect = on_connect
+    client.connect("127.0.0.1", proxy.port)
+    client.loop_start()
+    connected.wait(10)
+    before = proxy.sent
+
+    cpu = time.process_time()
+    start = time.monotonic()
+    for topic, payload, qos, retain, expiry, unit in messages:
+        if aliases is None:
+            client.publish(topic, payload, qos, retain)
+            continue
+        properties = Properties(PacketTypes.PUBLISH)
+        if expiry is not None:
+            properties.MessageExpiryInterval = expiry
+        if unit is not None:
+            properties.UserProperty = ("unit", unit)
+        aliases.publish(topic, payload, qos, retain, properties)
+    counter.event.wait(120)
+    wall = time.monotonic() - start
+    cpu = time.process_time() - cpu
+    sent = proxy.sent - before
+
+    client.loop_stop()
+    client.disconnect()
+    if aliases is not None:
+        print("aliases: " + str(aliases.stats()))
+    return sent, cpu, wall
+
+
+def main(argv):
+    host = argv[0] if len(argv) > 0 else "localhost"
+    port = int(argv[1]) if len(argv) > 1 else 1883
+    readings = int(argv[2]) if len(argv) > 2 else 5000
+
+    table = pubpolicy.PolicyTable()
+    messages = []
+    for i in range(readings):
+        for topic, payload, unit in READING_TOPICS:
+            policy = table.lookup(topic % NODE)[1]
+            messages.append((topic % NODE, payload, policy.qos, policy.retain, policy.expiry, unit))
+
+    results = {}
+    for name, protocol in (("3.1.1", mqtt.MQTTv311), ("v5", mqtt.MQTTv5)):
+        sent, cpu, wall = run(host, port, messages, protocol)
+        results[name] = (sent, cpu)
+        print("%-6s %7d msgs %10d bytes %6.1f bytes/msg %7.3f s cpu %7.3f s wall"
+              % (name, len(messages), sent, float(sent) / len(messages), cpu, wall))
+
+    print("bytes  %+6.1f%%" % ((results["v5"][0] - results["3.1.1"][0]) * 100.0 / results["3.1.1"][0]))
+    print("cpu    %+6.1f%%" % ((results["v5"][1] - results["3.1.1"][1]) * 100.0 / results["3.1.1"][1]))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
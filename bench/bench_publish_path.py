@@ -0,0 +1,77 @@
+#!/usr/bin/python3
+
+"""Micro-benchmark: per-publish CPU time of mqtt_msg_publish_x().
+
+Compares the previous body (debug string always built, per-character
+string.printable filter, str() of topic and payload) with the current one
+(debug string only at debug level, pubfilter.printable(), no filtering of
+gateway formatted values). Logging is at info level and the mqtt client
+publish() does nothing, so only the gateway's own work is measured.
+
+Usage: python3 bench/bench_publish_path.py [iterations]
+"""
+
+import os
+import string
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import pubfilter
+
+SYSLOG_DBG = 0
+SYSLOG_INF = 1
+SYSLOG_SEVERITY = SYSLOG_INF
+
+# topic, payload and whether the gateway formatted the payload
+MESSAGES = [
+    ("smarthome/node/67161707004B1200/sensor/temperature/1026/timestamp/actual", "18.10.2026 12:00:00", True),
+    ("smarthome/node/67161707004B1200/sensor/temperature/1026/value/actual", "21.5", True),
+    ("smarthome/node/67161707004B1200/sensor/power/1027/value/power", "123.45", True),
+    ("smarthome/node/67161707004B1200/hw/serial", "SN-0042-A", False),
+]
+
+
+def LOG(severity, message):
+    if severity >= SYSLOG_SEVERITY:
+        print(message)
+
+
+def client_publish(topic, payload, qos, retain, properties):
+    pass
+
+
+def legacy_publish_x(topic, payload, qos, retain, clean=False):
+    LOG(SYSLOG_DBG, "mqtt_msg_publish: " + topic + "<" + payload + ">; qos=" + str(qos) + " retain=" + str(retain))
+    spayload = "".join(filter(lambda x: x in string.printable, str(payload)))
+    client_publish(str(topic), str(spayload), qos, retain, None)
+
+
+def fast_publish_x(topic, payload, qos, retain, clean=False):
+    if SYSLOG_SEVERITY <= SYSLOG_DBG:
+        LOG(SYSLOG_DBG, "mqtt_msg_publish: " + topic + "<" + payload + ">; qos=" + str(qos) + " retain=" + str(retain))
+    client_publish(topic, payload if clean else pubfilter.printable(payload), qos, retain, None)
+
+
+def run(publish, iterations):
+    for i in range(iterations):
+        for topic, payload, clean in MESSAGES:
+            publish(topic, payload, 1, 1, clean)
+
+
+def main(argv):
+    iterations = int(argv[0]) if argv else 50000
+
+    publishes = iterations * len(MESSAGES)
+    results = []
+    for name, publish in (("legacy", legacy_publish_x), ("fast", fast_publish_x)):
+        best = min(timeit.repeat(lambda: run(publish, iterations), number=1, repeat=5))
+        results.append(best)
+        print("%-8s %8.3f us/publish" % (name, best * 1e6 / publishes))
+
+    print("speedup  %8.2fx" % (results[0] / results[1]))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+
+"""Throughput benchmark: publish policies against a real broker.
+
+Publishes the same readings with every QoS/retain combination used by the
+tuned pubpolicy profile, then the typical per-reading topic mix once with
+the default fixed QoS 1/retain policy and once with pubpolicy.TUNED_POLICIES.
+Reports messages per second until the broker acknowledged everything
+(PUBACK/PUBCOMP for QoS > 0).
+
+Needs paho-mqtt and a broker, e.g. a local mosquitto:
+Usage: python3 bench/bench_publish_policy.py [host] [port] [readings]
+"""
+
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import paho.mqtt.client as mqtt
+
+import pubpolicy
+
+NODE = "bench0000000000"
+# topics published per reading of a power plug and a combo sensor
+READING_TOPICS = [
+    ("smarthome/node/%s/sensor/power/1027/timestamp/power", "18.10.2026 12:00:00"),
+    ("smarthome/node/%s/sensor/power/1027/value/power", "123.45"),
+    ("smarthome/node/%s/sensor/temperature/1026/timestamp/actual", "18.10.2026 12:00:00"),
+    ("smarthome/node/%s/sensor/temperature/1026/value/actual", "21.5"),
+]
+
+
+class Counter(object):
+    def __init__(self):
+        self.done = 0
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.expected = 0
+
+    def on_publish(self, client, userdata, mid):
+        with self.lock:
+            self.done += 1
+            if self.done >= self.expected:
+                self.event.set()
+
+
+def run(host, port, messages):
+    """messages: list of (topic, payload, qos, retain), returns seconds until all acked."""
+    counter = Counter()
+    counter.expected = len(messages)
+    client = mqtt.Client()
+    client.max_inflight_messages_set(100)
+    client.max_queued_messages_set(0)
+    client.on_publish = counter.on_publish
+    client.connect(host, port)
+    client.loop_start()
+
+    start = time.monotonic()
+    for topic, payload, qos, retain in messages:
+        client.publish(topic, payload, qos, retain)
+    counter.event.wait(120)
+    elapsed = time.monotonic() - start
+
+    client.loop_stop()
+    client.disconnect()
+    return elapsed
+
+
+def report(name, count, elapsed):
+    print("%-24s %7d msgs %8.3f s %10.0f msgs/s" % (name, count, elapsed, count / elapsed))
+
+
+def main(argv):
+    host = argv[0] if len(argv) > 0 else "localhost"
+    port = int(argv[1]) if len(argv) > 1 else 1883
+    readings = int(argv[2]) if len(argv) > 2 else 2000
+
+    topics = [(topic % NODE, payload) for topic, payload in READING_TOPICS]
+
+    combos = sorted(set((policy.qos, policy.retain) for policy in pubpolicy.TUNED_POLICIES.values()))
+    for qos, retain in combos:
+        messages = [(topic, payload, qos, retain) for i in range(readings) for topic, payload in topics]
+        report("qos=%d retain=%d" % (qos, retain), len(messages), run(host, port, messages))
+
+    legacy = [(topic, payload, 1, 1) for i in range(readings) for topic, payload in topics]
+    report("mix, default qos1", len(legacy), run(host, port, legacy))
+
+    table = pubpolicy.PolicyTable(pubpolicy.TUNED_POLICIES)
+    policy = [(topic, payload) + tuple(table.lookup(topic)[1][:2]) for topic, payload in topics]
+    mixed = [message for i in range(readings) for message in policy]
+    report("mix, tuned policies", len(mixed), run(host, port, mixed))
+    print("classes: " + ", ".join(sorted(set(table.lookup(topic)[0] for topic, payload in topics))))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+
+"""Micro-benchmark: inbound serial line parsing.
+
+Compares the previous process_serial_message() parsing path (decode,
+uncompiled regex split, 8-group regex MAC conversion) with
+serframe.split_line() + serframe.mac_to_nid().
+
+Usage: python3 bench/bench_serial_parse.py [iterations]
+"""
+
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import serframe
+
+LINES = [
+    b"12:4b:0:7:16:17:61:67/t/1026/act/2150\r\n",
+    b"12:4b:0:7:16:17:61:67/h/1029/act/4520\r\n",
+    b"12:4b:0:7:16:f8:cc:1/p/1027/p/12345\r\n",
+    b"12:4b:0:7:16:f8:cc:1/p/1027/e/987\r\n",
+    b"12:4b:0:1b:b9:9a:29:0/bat/0/v/290\r\n",
+]
+
+
+def legacy_convert_mac_to_nid(mac):
+    match = re.search("^([0-9A-Fa-f]{1,2}):([0-9A-Fa-f]{1,2}):([0-9A-Fa-f]{1,2}):([0-9A-Fa-f]{1,2}):([0-9A-Fa-f]{1,2}):([0-9A-Fa-f]{1,2}):([0-9A-Fa-f]{1,2}):([0-9A-Fa-f]{1,2})$", mac)
+
+    if match:
+        nid = match.group(1).zfill(2) + \
+              match.group(2).zfill(2) + \
+              match.group(3).zfill(2) + \
+              match.group(4).zfill(2) + \
+              match.group(5).zfill(2) + \
+              match.group(6).zfill(2) + \
+              match.group(7).zfill(2) + \
+              match.group(8).zfill(2)
+    else:
+        nid = None
+
+    return nid
+
+
+def legacy_parse(message_bytes):
+    message = message_bytes.rstrip().decode('ascii')
+    if message == '':
+        return None
+
+    match = re.search("([^/]+)/([^/]+)/([^/]+)/([^/]+)/([^/]+)", message)
+    if match is None:
+        return None
+
+    node_id = legacy_convert_mac_to_nid(match.group(1))
+    if node_id is None:
+        return None
+    return (node_id, match.group(2), match.group(3), match.group(4), match.group(5))
+
+
+def fast_parse(message_bytes):
+    fields = serframe.split_line(message_bytes)
+    if fields is None:
+        return None
+    node_id = serframe.mac_to_nid(fields[0])
+    if node_id is None:
+        return None
+    return (node_id,) + fields[1:]
+
+
+def run(parse, iterations):
+    for i in range(iterations):
+        for line in LINES:
+            parse(line)
+
+
+def main(argv):
+    iterations = int(argv[0]) if argv else 20000
+
+    for line in LINES:
+        assert legacy_parse(line) == fast_parse(line), line
+
+    lines = iterations * len(LINES)
+    results = []
+    for name, parse in (("legacy", legacy_parse), ("fast", fast_parse)):
+        best = min(timeit.repeat(lambda: run(parse, iterations), number=1, repeat=5))
+        results.append(best)
+        print("%-8s %8.3f us/line" % (name, best * 1e6 / lines))
+
+    print("speedup  %8.2fx" % (results[0] / results[1]))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
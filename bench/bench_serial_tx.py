@@ -0,0 +1,137 @@
+#!/usr/bin/python3
+
+"""Simulation benchmark: UART command pacing.
+
+Runs sertx.TxScheduler against a simulated coordinator on a virtual
+clock, once configured like the previous fixed 0.5 s sleep after every
+frame and once with the adaptive defaults. The coordinator handles one
+frame at a time (random service time), answers from the addressed node
+when done and can buffer COORD_BUFFER frames, more are lost. Readings from
+random nodes arrive at READINGS_PER_S, they only count as answers when they
+come from the node that was written to.
+
+Two workloads for NODES nodes: a backlog of all commands queued at once
+(maximum commands/s) and bursts of BURST commands (slider drags, scenes)
+every BURST_INTERVAL seconds on average, the bursts also with latest-wins
+coalescing. Reports commands/s, queue -> UART latency percentiles, lost
+and coalesced frames.
+
+Usage: python3 bench/bench_serial_tx.py [commands] [seed]
+"""
+
+import heapq
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import sertx
+
+NODES = 12
+BURST = 10
+BURST_INTERVAL = 4.0
+SERVICE_MIN = 0.02
+SERVICE_MAX = 0.08
+COORD_BUFFER = 4
+READINGS_PER_S = 5.0
+
+
+def node(index):
+    return "12:4b:0:7:16:17:61:%x" % index
+
+
+def workload(commands, rng, backlog):
+    """[(arrival time, message)] in bursts of BURST commands or all at once."""
+    arrivals = []
+    t = 0.0
+    while len(arrivals) < commands:
+        if not backlog:
+            t += rng.expovariate(1.0 / BURST_INTERVAL)
+        for i in range(BURST):
+            arrivals.append((t if backlog else t + i * 0.01, node(rng.randrange(NODES)) + "/cblb/1026/lv/" + str(rng.randrange(101))))
+    return arrivals[:commands]
+
+
+def simulate(scheduler, arrivals, rng, coalesce=False):
+    arrivals = list(arrivals)
+    events = []
+    t = 0.0
+    horizon = arrivals[-1][0] + 600
+    while t < horizon:
+        t += rng.expovariate(READINGS_PER_S)
+        heapq.heappush(events, (t, node(rng.randrange(NODES))))
+
+    now = 0.0
+    index = 0
+    coord_free = 0.0
+    in_coordinator = []
+    latencies = []
+    lost = 0
+    first_write = None
+    last_write = 0.0
+
+    while len(latencies) + lost + scheduler.coalesced < len(arrivals):
+        while index < len(arrivals) and arrivals[index][0] <= now:
+            scheduler.put(arrivals[index][1], rx=arrivals[index][0], now=arrivals[index][0], coalesce=coalesce)
+            index += 1
+        while events and events[0][0] <= now:
+            scheduler.responded(*heapq.heappop(events))
+        while in_coordinator and in_coordinator[0] <= now:
+            heapq.heappop(in_coordinator)
+
+        frame, wait = scheduler.take(now)
+        if frame is not None:
+            message, rx = frame
+            if first_write is None:
+                first_write = now
+            last_write = now
+            if len(in_coordinator) >= COORD_BUFFER:
+                lost += 1
+                continue
+            coord_free = max(now, coord_free) + rng.uniform(SERVICE_MIN, SERVICE_MAX)
+            heapq.heappush(in_coordinator, coord_free)
+            heapq.heappush(events, (coord_free, sertx.destination(message)))
+            latencies.append(now - rx)
+            continue
+
+        candidates = [events[0][0]] if events else []
+        if index < len(arrivals):
+            candidates.append(arrivals[index][0])
+        if wait is not None:
+            candidates.append(now + wait)
+        if in_coordinator:
+            candidates.append(in_coordinator[0])
+        now = max(now, min(candidates))
+
+    return latencies, lost, last_write - first_write
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def main(argv):
+    commands = int(argv[0]) if len(argv) > 0 else 1000
+    seed = int(argv[1]) if len(argv) > 1 else 1
+
+    print("%-8s %-9s %9s %8s %8s %8s %8s %6s %9s" % ("load", "pacing", "cmds/s", "p50 ms", "p90 ms", "p99 ms", "max ms",
+                                                     "lost", "coalesced"))
+    for load, backlog, variants in (("backlog", True, ("fixed", "adaptive")),
+                                    ("bursts", False, ("fixed", "adaptive", "coalesced"))):
+        arrivals = workload(commands, random.Random(seed), backlog)
+        for name in variants:
+            if name == "fixed":
+                scheduler = sertx.TxScheduler(sertx.SER_TX_MAX_GAP, sertx.SER_TX_MAX_GAP, 0)
+            else:
+                scheduler = sertx.TxScheduler()
+            latencies, lost, busy = simulate(scheduler, arrivals, random.Random(seed), name == "coalesced")
+            print("%-8s %-9s %9.2f %8.0f %8.0f %8.0f %8.0f %6d %9d" % (
+                load, name, (len(latencies) + lost) / busy if busy else 0,
+                percentile(latencies, 50) * 1000, percentile(latencies, 90) * 1000,
+                percentile(latencies, 99) * 1000, max(latencies) * 1000, lost, scheduler.coalesced))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+
+"""Micro-benchmark: inbound mqtt command topic lookup.
+
+Compares the previous process_mqtt_message() lookup (up to 37 uncompiled
+re.search calls in order) with topicrouter.TopicRouter for the first
+route, a colour bulb command, the last route (hw/lqi) and an unknown
+topic. Handlers do nothing, only finding them is measured.
+
+Usage: python3 bench/bench_topic_router.py [iterations]
+"""
+
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import topicrouter
+
+NID = "([0-9A-Fa-f]{16})"
+# the previous regex chain, in its order: (regex, mqtt pattern, node route)
+ROUTES = [("^smarthome/node/%s/hw/zigbee/service" % NID, "smarthome/node/+/hw/zigbee/service", True),
+          ("^smarthome/node/%s/hw/led/([^/]+)" % NID, "smarthome/node/+/hw/led/+", True)]
+for _segment, _verb in [("power", "switch/status"), ("power", "set/switch"), ("power", "sleep"), ("power", "reset/energy"),
+                        ("temperature", "sleep"), ("humidity", "sleep"), ("motion", "arm"), ("motion", "sleep"),
+                        ("fall", "arm"), ("fall", "keepalive"), ("co2", "sleep"), ("voc", "sleep"), ("pm2_5", "sleep"),
+                        ("pm10", "sleep"), ("illuminance", "sleep"), ("pressure", "sleep"), ("bulb", "set/switch"),
+                        ("bulb", "set/level"), ("bulb", "query"), ("colorbulb", "set/switch"), ("colorbulb", "set/level"),
+                        ("colorbulb", "set/hue"), ("colorbulb", "set/saturation"), ("colorbulb", "set/hsv"),
+                        ("colorbulb", "set/temperature"), ("colorbulb", "query")]:
+    ROUTES.append(("^smarthome/node/%s/sensor/%s/([^/]+)/%s" % (NID, _segment, _verb),
+                   "smarthome/node/+/sensor/%s/+/%s" % (_segment, _verb), True))
+for _pattern in ["smarthome/gateway/+/hw/led/+", "smarthome/gateway/+/hw/reset/+", "smarthome/gateway/+/hw/ping/+",
+                 "smarthome/platform/diagnostic/zdo/+", "smarthome/platform/diagnostic/loglevel/zmqtt",
+                 "smarthome/gateway/+/hw/sbl/+", "smarthome/gateway/+/hw/ota/+", "smarthome/gateway/+/hw/swdl/+",
+                 "smarthome/gateway/+/hw/lqi/+"]:
+    ROUTES.append((_pattern.replace("+", "([^/]+)"), _pattern, False))
+
+TOPICS = [
+    ("first", "smarthome/node/67161707004B1200/hw/zigbee/service"),
+    ("colorbulb", "smarthome/node/67161707004B1200/sensor/colorbulb/1026/set/hue"),
+    ("last hw/lqi", "smarthome/gateway/b827eb010203/hw/lqi/1"),
+    ("unknown", "smarthome/gateway/b827eb010203/hw/unknown/1"),
+]
+
+
+def legacy_match(topic):
+    for regex, pattern, node in ROUTES:
+        match = re.search(regex, topic)
+        if match:
+            return pattern, list(match.groups())
+    return None, None
+
+
+def build_router():
+    router = topicrouter.TopicRouter()
+    for regex, pattern, node in ROUTES:
+        router.add(pattern, pattern, {0: topicrouter.is_node_id} if node else None)
+    return router
+
+
+def main(argv):
+    iterations = int(argv[0]) if argv else 100000
+    router = build_router()
+
+    for name, topic in TOPICS:
+        assert legacy_match(topic) == router.match(topic), topic
+
+    print("%-12s %10s %10s %8s" % ("topic", "legacy us", "trie us", "speedup"))
+    for name, topic in TOPICS:
+        legacy = min(timeit.repeat(lambda: legacy_match(topic), number=iterations, repeat=5))
+        trie = min(timeit.repeat(lambda: router.match(topic), number=iterations, repeat=5))
+        print("%-12s %10.3f %10.3f %7.1fx" % (name, legacy * 1e6 / iterations, trie * 1e6 / iterations, legacy / trie))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,123 @@
+"""Compact binary encoding of sensor readings for machine consumers.
+
+Readings are published on a parallel tree, the text value topic with a
+"bin/" segment after "smarthome/":
+  smarthome/bin/node/<nid>/sensor/<segment>/<sid>/value/<attr>
+
+Each payload carries value, unit code (UNIT_CODES), receive time in epoch
+ms and a per-node sequence number (uint32, wraps) to detect lost readings.
+
+Codecs:
+  struct   always available, little endian:
+           B version, B unit code, Q rx_ms, I seq, B kind, value
+           kind 0: d float64, kind 1: utf-8 string (rest of the payload)
+  msgpack  [value, unit code, rx_ms, seq], needs the msgpack package
+  cbor     same array, needs the cbor2 package
+"""
+
+import struct
+import threading
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+STRUCT_VERSION = 1
+STRUCT_HEADER = struct.Struct("<BBQIB")
+STRUCT_FLOAT = struct.Struct("<d")
+KIND_FLOAT = 0
+KIND_STRING = 1
+
+UNIT_CODES = {
+    None: 0,
+    "W": 1,
+    "kWh": 2,
+    "oC": 3,
+    "%": 4,
+    "ppm": 5,
+    "ppb": 6,
+    "ugm3": 7,
+    "lux": 8,
+    "hPa": 9,
+}
+
+TOPIC_CACHE_SIZE = 2048
+
+
+def available_codecs():
+    codecs = ["struct"]
+    if msgpack is not None:
+        codecs.append("msgpack")
+    if cbor2 is not None:
+        codecs.append("cbor")
+    return codecs
+
+
+def _number(value):
+    """Published text value -> float, None for status strings."""
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class BinaryEncoder(object):
+    def __init__(self, codec="struct"):
+        if codec not in available_codecs():
+            raise ValueError("binary codec <" + codec + "> not available, have: " + ", ".join(available_codecs()))
+        self.codec = codec
+        self._seq = {}
+        self._topics = {}
+        self._lock = threading.Lock()
+        self.encoded = 0
+        self.bytes = 0
+
+    def topic(self, value_topic):
+        topic = self._topics.get(value_topic)
+        if topic is None:
+            if len(self._topics) >= TOPIC_CACHE_SIZE:
+                self._topics.clear()
+            topic = "smarthome/bin/" + value_topic[len("smarthome/"):]
+            self._topics[value_topic] = topic
+        return topic
+
+    def encode(self, nodeid, value, unit, rx_ms):
+        with self._lock:
+            seq = self._seq.get(nodeid, 0)
+            self._seq[nodeid] = (seq + 1) & 0xFFFFFFFF
+
+        unit_code = UNIT_CODES.get(unit, 0)
+        number = _number(value)
+        if self.codec == "struct":
+            if number is not None:
+                payload = STRUCT_HEADER.pack(STRUCT_VERSION, unit_code, rx_ms, seq, KIND_FLOAT) + STRUCT_FLOAT.pack(number)
+            else:
+                payload = STRUCT_HEADER.pack(STRUCT_VERSION, unit_code, rx_ms, seq, KIND_STRING) + value.encode("utf-8")
+        else:
+            reading = [value if number is None else number, unit_code, rx_ms, seq]
+            payload = msgpack.packb(reading) if self.codec == "msgpack" else cbor2.dumps(reading)
+
+        self.encoded += 1
+        self.bytes += len(payload)
+        return payload
+
+    def stats(self):
+        return {
+            "codec": self.codec,
+            "encoded": self.encoded,
+            "avg_bytes": round(float(self.bytes) / self.encoded, 1) if self.encoded else 0,
+        }
+
+
+def decode_struct(payload):
+    """struct payload -> (value, unit code, rx_ms, seq), for consumers and tests."""
+    version, unit_code, rx_ms, seq, kind = STRUCT_HEADER.unpack_from(payload)
+    rest = payload[STRUCT_HEADER.size:]
+    value = STRUCT_FLOAT.unpack(rest)[0] if kind == KIND_FLOAT else rest.decode("utf-8")
+    return value, unit_code, rx_ms, seq
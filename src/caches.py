@@ -0,0 +1,131 @@
+"""Bounded lookup caches for the gateway hot paths."""
+
+import collections
+import sys
+import threading
+
+NODE_ID_CACHE_SIZE = 1024
+TOPIC_CACHE_SIZE = 2048
+
+
+class NodeIdCache(object):
+    """Bounded, bidirectional MAC <-> node id cache with LRU eviction.
+
+    A network has a few dozen to a few hundred nodes, so in steady state
+    every conversion is a single dict hit. Misses are computed with the
+    given converters and cached, invalid input (None result) is not.
+    """
+
+    def __init__(self, mac_to_nid, nid_to_mac, maxsize=NODE_ID_CACHE_SIZE):
+        self._mac_to_nid = mac_to_nid
+        self._nid_to_mac = nid_to_mac
+        self.maxsize = maxsize
+        self._nids = collections.OrderedDict()
+        self._macs = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def mac_to_nid(self, mac):
+        """MAC (str or bytes as received on UART) -> node id."""
+        with self._lock:
+            nid = self._nids.get(mac)
+            if nid is not None:
+                self.hits += 1
+                self._nids.move_to_end(mac)
+                return nid
+            self.misses += 1
+        nid = self._mac_to_nid(mac)
+        if nid is not None:
+            with self._lock:
+                self._store(self._nids, mac, nid)
+        return nid
+
+    def nid_to_mac(self, nid):
+        """Node id -> MAC as the coordinator expects it."""
+        with self._lock:
+            mac = self._macs.get(nid)
+            if mac is not None:
+                self.hits += 1
+                self._macs.move_to_end(nid)
+                return mac
+            self.misses += 1
+        mac = self._nid_to_mac(nid)
+        if mac is not None:
+            with self._lock:
+                self._store(self._macs, nid, mac)
+        return mac
+
+    def add(self, nid, mac):
+        """Primes both directions for a node that announced its MAC."""
+        canonical = self._nid_to_mac(nid)
+        with self._lock:
+            self._store(self._nids, mac, nid)
+            if isinstance(mac, str):
+                self._store(self._nids, mac.encode('ascii', 'replace'), nid)
+            if canonical is not None:
+                self._store(self._macs, nid, canonical)
+
+    def _store(self, table, key, value):
+        table[key] = value
+        table.move_to_end(key)
+        if len(table) > self.maxsize:
+            table.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            "size": len(self._nids) + len(self._macs),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class TopicCache(object):
+    """Bounded LRU of pre-built, interned topics per (node, sensor type, sensor id).
+
+    The sensor type (sensors.SensorType) stands for the serial (group, type).
+    Cached tuples are whatever stype.topics() returns, so the publish path
+    does no string building for known sensors.
+    """
+
+    def __init__(self, maxsize=TOPIC_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._topics = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, nodeid, stype, sensorid):
+        key = (nodeid, stype, sensorid)
+        with self._lock:
+            topics = self._topics.get(key)
+            if topics is not None:
+                self.hits += 1
+                self._topics.move_to_end(key)
+                return topics
+            self.misses += 1
+
+        topics = tuple([sys.intern(topic) if topic is not None else None
+                        for topic in stype.topics(nodeid, sensorid)])
+        with self._lock:
+            self._topics[key] = topics
+            if len(self._topics) > self.maxsize:
+                self._topics.popitem(last=False)
+                self.evictions += 1
+        return topics
+
+    def clear(self):
+        with self._lock:
+            self._topics.clear()
+
+    def stats(self):
+        return {
+            "size": len(self._topics),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,27 @@
+"""Shared wall clock formatting."""
+
+import time
+
+TIMESTAMP_FORMAT = "%d.%m.%Y %H:%M:%S"
+
+
+class SecondFormatter(object):
+    """Formats a timestamp once per second, later calls in the same second reuse it."""
+
+    def __init__(self, fmt=TIMESTAMP_FORMAT):
+        self.fmt = fmt
+        self._cached = (None, "")
+        self.formatted = 0
+
+    def format(self, seconds=None):
+        """Formats epoch seconds (default: now) as local time."""
+        if seconds is None:
+            seconds = time.time()
+        seconds = int(seconds)
+        cached = self._cached
+        if cached[0] == seconds:
+            return cached[1]
+        text = time.strftime(self.fmt, time.localtime(seconds))
+        self._cached = (seconds, text)
+        self.formatted += 1
+        return text
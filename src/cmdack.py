@@ -0,0 +1,217 @@
+"""Acknowledgement tracking for actuator commands written to the UART.
+
+Every tracked frame is kept in a pending table keyed by the sequence number
+it was written with. Responses from the coordinator carry no sequence
+number, so a command counts as acknowledged when its node reports the
+attribute the command sets (ACK_REPLIES, e.g. p/st after p/sw) with the
+commanded value; an hsv command by any one of its components. Commands
+that are not acknowledged within the timeout are sent again, at most
+`retries` times, unless a newer command for the same attribute replaced
+them. Each finished command yields an outcome record and a round trip
+time sample for its node.
+"""
+
+import threading
+
+import sertx
+
+ACK_TIMEOUT = 3.0
+ACK_RETRIES = 2
+
+# (command group, command attribute) -> (group, type) of the reports acknowledging it,
+# in the order of the ':' separated command values
+ACK_REPLIES = {
+    ("p", "sw"): (("p", "st"),),
+    ("blb", "sw"): (("blb", "st"),),
+    ("blb", "lv"): (("blb", "lv"),),
+    ("cblb", "sw"): (("cblb", "st"),),
+    ("cblb", "lv"): (("cblb", "lv"),),
+    ("cblb", "hue"): (("cblb", "hue"),),
+    ("cblb", "sat"): (("cblb", "sat"),),
+    ("cblb", "hsv"): (("cblb", "hue"), ("cblb", "sat"), ("cblb", "lv")),
+}
+
+# round trip time histogram, upper bounds in ms
+RTT_BUCKETS = (50, 100, 250, 500, 1000, 2500, 5000)
+
+OUTCOME_ACK = "ack"
+OUTCOME_TIMEOUT = "timeout"
+OUTCOME_SUPERSEDED = "superseded"
+
+
+def _value(value):
+    """Command or report value in comparable form, '050' and '50' are the same level."""
+    try:
+        return int(value)
+    except ValueError:
+        return value.strip()
+
+
+def replies(message):
+    """{(group, type): value} of the reports acknowledging a
+    '<mac>/<group>/<sensor>/<attribute>/<value>' frame, None if untracked."""
+    fields = message.split("/", 4)
+    if len(fields) < 5:
+        return None
+    reply_types = ACK_REPLIES.get((fields[1], fields[3]))
+    if reply_types is None:
+        return None
+    # an hsv value has a transition time after the components, zip() leaves it out
+    return dict(zip(reply_types, (_value(value) for value in fields[4].split(":"))))
+
+
+class _Command(object):
+    __slots__ = ("seq", "nid", "key", "message", "replies", "rx", "first_sent", "sent_at", "attempts", "retrying")
+
+    def __init__(self, seq, nid, key, message, replies, rx, now):
+        self.seq = seq
+        self.nid = nid
+        self.key = key
+        self.message = message
+        self.replies = replies
+        self.rx = rx
+        self.first_sent = now
+        self.sent_at = now
+        self.attempts = 1
+        self.retrying = False
+
+    def outcome(self, outcome, now):
+        """Outcome record for the diagnostics topic."""
+        record = {"seq": self.seq, "nid": self.nid, "command": self.message, "outcome": outcome,
+                  "attempts": self.attempts}
+        if outcome == OUTCOME_ACK:
+            record["rtt_ms"] = round((now - self.sent_at) * 1000, 1)
+            if self.rx is not None:
+                record["latency_ms"] = round((now - self.rx) * 1000, 1)
+        return record
+
+
+class CommandTracker(object):
+    def __init__(self, timeout=ACK_TIMEOUT, retries=ACK_RETRIES):
+        self.timeout = timeout
+        self.retries = retries
+        self._lock = threading.Lock()
+        self._by_seq = {}
+        self._by_key = {}
+        # (nid, group, type) -> [commands] in send order
+        self._waiting = {}
+        self.tracked = 0
+        self.acked = 0
+        self.retried = 0
+        self.timeouts = 0
+        self.superseded = 0
+        # nid -> RTT histogram
+        self._rtt = {}
+
+    def _register(self, command):
+        self._by_seq[command.seq] = command
+        self._by_key[command.key] = command
+        for group, msgtype in command.replies:
+            self._waiting.setdefault((command.nid, group, msgtype), []).append(command)
+
+    def _remove(self, command):
+        if self._by_seq.get(command.seq) is command:
+            del self._by_seq[command.seq]
+        if self._by_key.get(command.key) is command:
+            del self._by_key[command.key]
+        for group, msgtype in command.replies:
+            waiting = self._waiting.get((command.nid, group, msgtype))
+            if waiting is not None and command in waiting:
+                waiting.remove(command)
+                if not waiting:
+                    del self._waiting[(command.nid, group, msgtype)]
+
+    def _finish(self, command, outcome, now, finished):
+        self._remove(command)
+        if outcome == OUTCOME_TIMEOUT:
+            self.timeouts += 1
+        elif outcome == OUTCOME_SUPERSEDED:
+            self.superseded += 1
+        finished.append(command.outcome(outcome, now))
+
+    def sent(self, seq, nid, message, rx, now):
+        """A frame was written with sequence number seq, returns outcome records of
+        commands this finished (superseded, or lost on sequence number wrap)."""
+        command_replies = replies(message)
+        if command_replies is None:
+            return []
+        key = sertx.command_key(message)
+        finished = []
+        with self._lock:
+            command = self._by_key.get(key)
+            if command is not None and command.retrying and command.message == message:
+                # the retry of a pending command
+                self._remove(command)
+                command.seq = seq
+                command.sent_at = now
+                command.attempts += 1
+                command.retrying = False
+            else:
+                if command is not None:
+                    self._finish(command, OUTCOME_SUPERSEDED, now, finished)
+                command = _Command(seq, nid, key, message, command_replies, rx, now)
+                self.tracked += 1
+            older = self._by_seq.get(seq)
+            if older is not None:
+                self._finish(older, OUTCOME_TIMEOUT, now, finished)
+            self._register(command)
+        return finished
+
+    def received(self, nid, group, msgtype, payload, now):
+        """A report was received, returns the outcome record of the command it acknowledges or None.
+        A report of another value than the command's does not acknowledge it."""
+        if not self._waiting:
+            return None
+        value = _value(payload)
+        with self._lock:
+            waiting = self._waiting.get((nid, group, msgtype))
+            if not waiting:
+                return None
+            for command in waiting:
+                if command.replies[(group, msgtype)] == value:
+                    break
+            else:
+                return None
+            self._remove(command)
+            self.acked += 1
+            rtt = (now - command.sent_at) * 1000
+            histogram = self._rtt.get(nid)
+            if histogram is None:
+                histogram = self._rtt[nid] = [0] * (len(RTT_BUCKETS) + 1)
+            bucket = 0
+            while bucket < len(RTT_BUCKETS) and rtt > RTT_BUCKETS[bucket]:
+                bucket += 1
+            histogram[bucket] += 1
+            return command.outcome(OUTCOME_ACK, now)
+
+    def expired(self, now):
+        """Returns ([(message, rx)] to send again, [outcome records]) for unacknowledged commands."""
+        retry = []
+        finished = []
+        with self._lock:
+            for command in list(self._by_seq.values()):
+                if command.retrying or now - command.sent_at < self.timeout:
+                    continue
+                if command.attempts > self.retries:
+                    self._finish(command, OUTCOME_TIMEOUT, now, finished)
+                else:
+                    # stays pending, a late report still acknowledges it
+                    command.retrying = True
+                    self.retried += 1
+                    retry.append((command.message, command.rx))
+        return retry, finished
+
+    def stats(self):
+        labels = ["le_" + str(bound) for bound in RTT_BUCKETS] + ["gt_" + str(RTT_BUCKETS[-1])]
+        with self._lock:
+            rtt = dict((nid, dict(zip(labels, histogram))) for nid, histogram in self._rtt.items())
+            pending = len(self._by_key)
+        return {
+            "pending": pending,
+            "tracked": self.tracked,
+            "acked": self.acked,
+            "retried": self.retried,
+            "timeouts": self.timeouts,
+            "superseded": self.superseded,
+            "rtt_ms": rtt,
+        }
@@ -0,0 +1,126 @@
+"""Publish-only fan-out to additional brokers (--fanout).
+
+Every endpoint has its own paho client with its own network thread and
+reconnect handling and its own bounded queue drained by a publish worker.
+Messages keep the qos, retain and expiry they were published with on the
+primary broker, unless the endpoint has its own publish policies. The
+gateway only puts messages on the endpoint queues: a slow or unreachable
+broker fills and drops from its own queue, it never delays the primary
+broker or the serial side. Commands are only taken from the primary broker.
+"""
+
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+from paho.mqtt.properties import Properties
+from paho.mqtt.packettypes import PacketTypes
+
+import pubpolicy
+import queues
+
+FANOUT_QUEUE_SIZE = 1024
+# QoS 1/2 messages paho keeps for a disconnected endpoint
+FANOUT_CLIENT_QUEUE = 1000
+
+
+def parse_endpoint(spec):
+    """'host[:port][;<qos policy>]' -> (host, port, policies or None)."""
+    address, sep, policy = spec.partition(";")
+    host, sep, port = address.partition(":")
+    if not host:
+        raise ValueError("invalid broker endpoint <" + spec + ">")
+    return host, int(port) if port else 1883, pubpolicy.parse_policies(policy) if policy else None
+
+
+class BrokerEndpoint(object):
+    def __init__(self, host, port, policies=None, protocol=mqtt.MQTTv311, queue_size=FANOUT_QUEUE_SIZE):
+        self.host = host
+        self.port = port
+        self.name = host + ":" + str(port)
+        # None: publish as on the primary broker
+        self.policy = pubpolicy.PolicyTable(policies) if policies else None
+        self.protocol = protocol
+        self.queue = queues.BoundedQueue(queue_size)
+        self.connected = False
+        self.connects = 0
+        self.published = 0
+        self.deferred = 0
+        self.failed = 0
+        self._rate_published = 0
+        self._rate_at = time.monotonic()
+
+        self.client = mqtt.Client(protocol=protocol)
+        self.client.max_queued_messages_set(FANOUT_CLIENT_QUEUE)
+        self.client.reconnect_delay_set(1, 60)
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+
+    def start(self):
+        # connects in the network thread, an unreachable broker does not block startup
+        self.client.connect_async(self.host, self.port, keepalive=60)
+        self.client.loop_start()
+        worker = threading.Thread(target=self._run, name="fanout " + self.name)
+        worker.daemon = True
+        worker.start()
+
+    def put(self, topic, payload, qos, retain, expiry=None, unit=None):
+        self.queue.put((topic, payload, qos, retain, expiry, unit))
+
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
+        self.connected = rc == 0
+        if self.connected:
+            self.connects += 1
+
+    def _on_disconnect(self, client, userdata, rc, properties=None):
+        self.connected = False
+
+    def _run(self):
+        while True:
+            message = self.queue.get()
+            if message is None:
+                continue
+            topic, payload, qos, retain, expiry, unit = message
+            if self.policy is not None:
+                topic_class, policy = self.policy.lookup(topic)
+                qos, retain, expiry = policy.qos, policy.retain, policy.expiry
+            properties = None
+            if self.protocol == mqtt.MQTTv5 and (expiry is not None or unit is not None):
+                properties = Properties(PacketTypes.PUBLISH)
+                if expiry is not None:
+                    properties.MessageExpiryInterval = expiry
+                if unit is not None:
+                    properties.UserProperty = ("unit", unit)
+            try:
+                info = self.client.publish(topic, payload, qos, retain, properties)
+            except ValueError:
+                self.failed += 1
+                continue
+            if info.rc == mqtt.MQTT_ERR_SUCCESS:
+                self.published += 1
+            elif info.rc == mqtt.MQTT_ERR_NO_CONN and qos > 0:
+                # kept by paho, sent after the reconnect
+                self.deferred += 1
+            else:
+                # QoS 0 while disconnected or paho's queue full
+                self.failed += 1
+
+    def stats(self):
+        now = time.monotonic()
+        rate = (self.published - self._rate_published) / (now - self._rate_at) if now > self._rate_at else 0
+        self._rate_published = self.published
+        self._rate_at = now
+
+        stats = self.queue.stats()
+        return {
+            "connected": self.connected,
+            "connects": self.connects,
+            "published": self.published,
+            "deferred": self.deferred,
+            "failed": self.failed,
+            "msgs_per_s": round(rate, 2),
+            "queue_depth": stats["depth"],
+            "queue_dropped": stats["dropped"],
+            "lag_avg_ms": stats["wait_avg_ms"],
+            "lag_max_ms": stats["wait_max_ms"],
+        }
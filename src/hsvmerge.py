@@ -0,0 +1,105 @@
+"""Merges colour bulb hue, saturation and level commands into one hsv frame.
+
+Home Assistant sends a colour change as separate hue, saturation and
+brightness topics. Components commanded within the merge window of a bulb
+are sent as one "<mac>/cblb/set/hsv/<hue>:<saturation>:<level><transition>"
+frame, components that were not commanded are taken from the last value
+the bulb reported or was sent. A single component, or a bulb whose other
+components are not known yet, is sent as its own frame as before.
+"""
+
+import threading
+
+HSV_WINDOW = 0.1
+# frame components in hsv order
+COMPONENTS = ("hue", "sat", "lv")
+# colorbulb reading attribute -> frame component
+REPORTED = {"hue": "hue", "saturation": "sat", "level": "lv"}
+LIMITS = {"hue": (0, 360), "sat": (0, 100), "lv": (0, 100)}
+
+
+def normalise(component, value):
+    """Component value as sent to the bulb, None if it is not a valid integer in range."""
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    low, high = LIMITS[component]
+    return str(value) if low <= value <= high else None
+
+
+class HsvMerger(object):
+    def __init__(self, window=HSV_WINDOW, transition=":0"):
+        self.window = window
+        self.transition = transition
+        # mac -> {component: value}
+        self._current = {}
+        # mac -> ({component: value}, rx of the first command)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.commands = 0
+        self.merged_frames = 0
+        self.merged_commands = 0
+        self.single_frames = 0
+
+    def report(self, mac, attr, value):
+        """Stores a colorbulb reading, other attributes are ignored."""
+        component = REPORTED.get(attr)
+        if component is None:
+            return
+        value = normalise(component, value)
+        if value is not None:
+            with self._lock:
+                self._current.setdefault(mac, {})[component] = value
+
+    def command(self, mac, component, value, rx=None):
+        """Queues a component command, returns True if this opened the bulb's merge window."""
+        with self._lock:
+            self.commands += 1
+            pending = self._pending.get(mac)
+            if pending is None:
+                self._pending[mac] = ({component: str(value)}, rx)
+                return True
+            pending[0][component] = str(value)
+            return False
+
+    def command_hsv(self, mac, hue, saturation, level):
+        """A full hsv command was sent, it supersedes pending components."""
+        components = {"hue": normalise("hue", hue), "sat": normalise("sat", saturation), "lv": normalise("lv", level)}
+        with self._lock:
+            current = self._current.setdefault(mac, {})
+            for component, value in components.items():
+                if value is not None:
+                    current[component] = value
+            pending = self._pending.get(mac)
+            if pending is not None:
+                pending[0].clear()
+
+    def take(self, mac):
+        """Closes the bulb's merge window, returns ([frames], rx)."""
+        with self._lock:
+            pending = self._pending.pop(mac, None)
+            if pending is None or not pending[0]:
+                return [], None
+            components, rx = pending
+            current = self._current.setdefault(mac, {})
+            current.update(components)
+
+            if len(components) > 1 and all(component in current for component in COMPONENTS):
+                self.merged_frames += 1
+                self.merged_commands += len(components)
+                hsv = ":".join(current[component] for component in COMPONENTS)
+                return [str(mac) + "/cblb/set/hsv/" + hsv + self.transition], rx
+
+            self.single_frames += len(components)
+            return [str(mac) + "/cblb/set/" + component + "/" + components[component]
+                    for component in COMPONENTS if component in components], rx
+
+    def stats(self):
+        return {
+            "bulbs": len(self._current),
+            "commands": self.commands,
+            "merged_frames": self.merged_frames,
+            "merged_commands": self.merged_commands,
+            "single_frames": self.single_frames,
+        }
@@ -0,0 +1,230 @@
+"""On-disk store-and-forward journal for publishes while the broker is away.
+
+Backed by SQLite in WAL mode. Retained publishes are stored with one row
+per topic, so a newer publish replaces the older one (last value wins, as
+the broker would). Publishes without retain are events, every one of them
+is kept (publish_event). Records are buffered in memory and written in one
+transaction per flush to spare the SD card. The journal is bounded by age
+and by the stored topic + payload bytes, the oldest records go first.
+
+If a write fails the records stay buffered, at most JOURNAL_BUFFER_RECORDS of
+them (oldest dropped first), and the buffer is not written again before
+JOURNAL_FLUSH_INTERVAL has passed. take() hands out buffered records while
+the database cannot be written.
+"""
+
+import sqlite3
+import threading
+import time
+
+JOURNAL_MAX_BYTES = 4 * 1024 * 1024
+JOURNAL_MAX_AGE = 24 * 3600
+JOURNAL_FLUSH_INTERVAL = 5
+JOURNAL_FLUSH_RECORDS = 256
+JOURNAL_BUFFER_RECORDS = 16 * JOURNAL_FLUSH_RECORDS
+
+
+class PublishJournal(object):
+    def __init__(self, path, max_bytes=JOURNAL_MAX_BYTES, max_age=JOURNAL_MAX_AGE):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS publish ("
+                         "topic TEXT PRIMARY KEY, payload TEXT, qos INTEGER, retain INTEGER, "
+                         "expiry INTEGER, unit TEXT, stamp REAL)")
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(publish)")]
+        if "unit" not in columns:
+            # journal written before the unit user property
+            self._db.execute("ALTER TABLE publish ADD COLUMN unit TEXT")
+        self._db.execute("CREATE INDEX IF NOT EXISTS publish_stamp ON publish (stamp)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS publish_event ("
+                         "topic TEXT, payload TEXT, qos INTEGER, retain INTEGER, "
+                         "expiry INTEGER, unit TEXT, stamp REAL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS publish_event_stamp ON publish_event (stamp)")
+        # retained: topic -> row not yet written, oldest first
+        self._pending = {}
+        # not retained: rows not yet written
+        self._pending_events = []
+        self._stored = self._count()
+        # time.monotonic() before which a failed write is not retried by record()
+        self._retry_at = 0
+        self.failing = False
+        self.recorded = 0
+        self.compacted = 0
+        self.replayed = 0
+        self.expired = 0
+        self.evicted = 0
+        self.flushes = 0
+        self.errors = 0
+        self.last_error = None
+
+    def __len__(self):
+        return self._stored + len(self._pending) + len(self._pending_events)
+
+    def _count(self):
+        return (self._db.execute("SELECT COUNT(*) FROM publish").fetchone()[0] +
+                self._db.execute("SELECT COUNT(*) FROM publish_event").fetchone()[0])
+
+    def record(self, topic, payload, qos, retain, expiry=None, unit=None):
+        row = (topic, payload, qos, retain, expiry, unit, time.time())
+        with self._lock:
+            if retain:
+                if self._pending.pop(topic, None) is not None:
+                    self.compacted += 1
+                self._pending[topic] = row
+            else:
+                self._pending_events.append(row)
+            self.recorded += 1
+            buffered = len(self._pending) + len(self._pending_events)
+            while buffered > JOURNAL_BUFFER_RECORDS:
+                self._drop_oldest()
+                buffered -= 1
+            full = buffered >= JOURNAL_FLUSH_RECORDS and time.monotonic() >= self._retry_at
+        if full:
+            self.flush()
+
+    def _drop_oldest(self):
+        oldest = next(iter(self._pending.values()), None)
+        if self._pending_events and (oldest is None or self._pending_events[0][6] <= oldest[6]):
+            del self._pending_events[0]
+        else:
+            del self._pending[oldest[0]]
+        self.evicted += 1
+
+    def _failed(self, error):
+        if self._db.in_transaction:
+            self._db.execute("ROLLBACK")
+        self.errors += 1
+        self.last_error = str(error)
+        self.failing = True
+        self._retry_at = time.monotonic() + JOURNAL_FLUSH_INTERVAL
+
+    def flush(self):
+        """Writes the buffered records in one transaction and applies the bounds,
+        returns False if the write failed (the records stay buffered)."""
+        with self._lock:
+            if not self._pending and not self._pending_events:
+                return True
+            rows = list(self._pending.values())
+            events = self._pending_events
+            self._pending.clear()
+            self._pending_events = []
+            try:
+                self._write(rows, events)
+            except sqlite3.Error as e:
+                self._failed(e)
+                # keep the records for the next flush, newer ones recorded meanwhile win
+                newer = self._pending
+                self._pending = dict((row[0], row) for row in rows if row[0] not in newer)
+                self._pending.update(newer)
+                self._pending_events[:0] = events
+                return False
+            self._stored = self._count()
+            self.flushes += 1
+            self.failing = False
+            return True
+
+    def _write(self, rows, events):
+        self._db.execute("BEGIN")
+        self._db.executemany("INSERT OR REPLACE INTO publish (topic, payload, qos, retain, expiry, unit, stamp) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        self._db.executemany("INSERT INTO publish_event (topic, payload, qos, retain, expiry, unit, stamp) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?)", events)
+        oldest = time.time() - self.max_age
+        for table in ("publish", "publish_event"):
+            self.expired += self._db.execute("DELETE FROM " + table + " WHERE stamp < ?", (oldest,)).rowcount
+        size = self._db.execute("SELECT COALESCE(SUM(LENGTH(topic) + LENGTH(payload)), 0) FROM publish").fetchone()[0]
+        size += self._db.execute("SELECT COALESCE(SUM(LENGTH(topic) + LENGTH(payload)), 0) FROM publish_event").fetchone()[0]
+        while size > self.max_bytes:
+            table, rowid, length = self._db.execute(
+                "SELECT 'publish', rowid, LENGTH(topic) + LENGTH(payload), stamp FROM publish "
+                "UNION ALL SELECT 'publish_event', rowid, LENGTH(topic) + LENGTH(payload), stamp FROM publish_event "
+                "ORDER BY stamp LIMIT 1").fetchone()[:3]
+            self._db.execute("DELETE FROM " + table + " WHERE rowid = ?", (rowid,))
+            self.evicted += 1
+            size -= length
+        self._db.execute("COMMIT")
+
+    def take(self, count):
+        """Removes and returns up to count oldest records as
+        (topic, payload, qos, retain, expiry left, unit), expired ones are skipped."""
+        if (self.failing and time.monotonic() < self._retry_at) or not self.flush():
+            return self._take_buffered(count)
+        now = time.time()
+        records = []
+        with self._lock:
+            try:
+                rows = self._take_rows(count)
+            except sqlite3.Error as e:
+                self._failed(e)
+                return records
+            for table, rowid, topic, payload, qos, retain, expiry, unit, stamp in rows:
+                record = self._replayable(topic, payload, qos, retain, expiry, unit, stamp, now)
+                if record is not None:
+                    records.append(record)
+            self.replayed += len(records)
+        return records
+
+    def _take_rows(self, count):
+        rows = self._db.execute("SELECT 'publish', rowid, topic, payload, qos, retain, expiry, unit, stamp FROM publish "
+                                    "UNION ALL SELECT 'publish_event', rowid, topic, payload, qos, retain, expiry, unit, stamp "
+                                "FROM publish_event ORDER BY stamp LIMIT ?", (count,)).fetchall()
+        if rows:
+            self._db.execute("BEGIN")
+            for table in ("publish", "publish_event"):
+                self._db.executemany("DELETE FROM " + table + " WHERE rowid = ?", [(row[1],) for row in rows if row[0] == table])
+            self._db.execute("COMMIT")
+            self._stored -= len(rows)
+        return rows
+
+    def _take_buffered(self, count):
+        """take() from the buffer while the database cannot be written."""
+        now = time.time()
+        records = []
+        with self._lock:
+            rows = sorted(list(self._pending.values()) + self._pending_events, key=lambda row: row[6])[:count]
+            taken = set(id(row) for row in rows)
+            self._pending_events = [row for row in self._pending_events if id(row) not in taken]
+            for row in rows:
+                if row[3]:
+                    del self._pending[row[0]]
+                record = self._replayable(*row, now=now)
+                if record is not None:
+                    records.append(record)
+            self.replayed += len(records)
+        return records
+
+    def _replayable(self, topic, payload, qos, retain, expiry, unit, stamp, now):
+        """(topic, payload, qos, retain, expiry left, unit), None if the record expired."""
+        if stamp < now - self.max_age:
+            self.expired += 1
+            return None
+        if expiry is not None:
+            expiry -= int(now - stamp)
+            if expiry <= 0:
+                self.expired += 1
+                return None
+        return (topic, payload, qos, retain, expiry, unit)
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._db.close()
+
+    def stats(self):
+        return {
+            "depth": len(self),
+            "recorded": self.recorded,
+            "compacted": self.compacted,
+            "replayed": self.replayed,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "flushes": self.flushes,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "failing": self.failing,
+        }
@@ -0,0 +1,53 @@
+"""Consolidated per node state document (smarthome/node/<nid>/state).
+
+Readings update an in-memory json document per node. Updates arriving
+within the coalescing window are published together as one message,
+next to the legacy per-reading topics.
+"""
+
+import json
+import threading
+
+STATE_WINDOW = 1.0
+
+
+class NodeStateStore(object):
+    def __init__(self, window=STATE_WINDOW):
+        self.window = window
+        self._docs = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self.updates = 0
+        self.flushed = 0
+
+    def update(self, nodeid, segment, sensorid, attr, value, unit, rx_ms):
+        """Stores a reading, returns True if this opened a new coalescing window."""
+        with self._lock:
+            doc = self._docs.get(nodeid)
+            if doc is None:
+                doc = self._docs[nodeid] = {"nid": nodeid, "sensor": {}}
+            reading = {"value": value, "ts": rx_ms}
+            if unit is not None:
+                reading["unit"] = unit
+            doc["sensor"].setdefault(segment, {}).setdefault(sensorid, {})[attr] = reading
+            doc["ts"] = rx_ms
+            self.updates += 1
+            opened = not self._dirty
+            self._dirty.add(nodeid)
+            return opened
+
+    def take_dirty(self):
+        """Returns [(nodeid, json)] for nodes changed since the last call."""
+        with self._lock:
+            dirty = [(nodeid, json.dumps(self._docs[nodeid], sort_keys=True, separators=(",", ":")))
+                     for nodeid in self._dirty]
+            self._dirty.clear()
+            self.flushed += len(dirty)
+            return dirty
+
+    def stats(self):
+        return {
+            "nodes": len(self._docs),
+            "updates": self.updates,
+            "published": self.flushed,
+        }
@@ -0,0 +1,141 @@
+"""Filters between the serial message handlers and the mqtt publish."""
+
+import string
+import threading
+import time
+
+METADATA_MAX_TOPICS = 4096
+
+# ASCII characters outside string.printable: control characters and DEL
+_UNPRINTABLE = str.maketrans("", "", "".join(chr(c) for c in range(128) if chr(c) not in string.printable))
+
+
+def printable(payload):
+    """Drops characters outside string.printable, returns payload itself when it is clean."""
+    if payload.isascii():
+        if payload.isprintable():
+            return payload
+        return payload.translate(_UNPRINTABLE)
+    return payload.encode("ascii", "ignore").decode("ascii").translate(_UNPRINTABLE)
+
+
+class MetadataTracker(object):
+    """Publishes static, retained descriptors (units ...) once per session.
+
+    A topic is let through when it is first seen, when its payload changed or
+    after reset(), which is called on every (re)connect to the broker.
+    """
+
+    def __init__(self, maxsize=METADATA_MAX_TOPICS):
+        self.maxsize = maxsize
+        self._sent = {}
+        self._lock = threading.Lock()
+        self.published = 0
+        self.saved = 0
+
+    def should_publish(self, topic, payload):
+        with self._lock:
+            if self._sent.get(topic) == payload:
+                self.saved += 1
+                return False
+            if len(self._sent) >= self.maxsize:
+                self._sent.clear()
+            self._sent[topic] = payload
+            self.published += 1
+            return True
+
+    def reset(self):
+        with self._lock:
+            self._sent.clear()
+
+    def stats(self):
+        return {
+            "topics": len(self._sent),
+            "published": self.published,
+            "saved": self.saved,
+        }
+
+
+# default deadbands per sensor class, "<segment>" or "<segment>/<attr>"
+# energy is reported as a per-interval delta and must never be filtered
+DEFAULT_DEADBANDS = {
+    "temperature": 0.05,
+    "humidity": 0.5,
+    "power/power": 1.0,
+    "pressure": 0.1,
+}
+DEFAULT_MAX_SILENCE = 300
+REPORT_FILTER_MAX_SENSORS = 4096
+
+
+def parse_deadbands(spec):
+    """'temperature:0.05,power/power:1' -> dict, 'default' -> DEFAULT_DEADBANDS."""
+    if spec == "default":
+        return dict(DEFAULT_DEADBANDS)
+    deadbands = {}
+    for item in spec.split(","):
+        sclass, deadband = item.split(":")
+        deadbands[sclass.strip()] = float(deadband)
+    return deadbands
+
+
+class ReportFilter(object):
+    """Change-only publishing of numeric readings.
+
+    A reading of a sensor class with a deadband is suppressed while it stays
+    within the deadband of the last forwarded value, unless max_silence
+    seconds passed since then. Classes without a deadband are always
+    forwarded.
+    """
+
+    def __init__(self, deadbands, max_silence=DEFAULT_MAX_SILENCE, maxsize=REPORT_FILTER_MAX_SENSORS):
+        self.deadbands = deadbands
+        self.max_silence = max_silence
+        self.maxsize = maxsize
+        # sensor type -> deadband (None: not filtered)
+        self._class_deadband = {}
+        # value topic -> (last forwarded value, monotonic time)
+        self._last = {}
+        self.forwarded = 0
+        self.suppressed = 0
+
+    def deadband(self, stype):
+        try:
+            return self._class_deadband[stype]
+        except KeyError:
+            deadband = self.deadbands.get(stype.segment + "/" + stype.attr,
+                                          self.deadbands.get(stype.segment))
+            self._class_deadband[stype] = deadband
+            return deadband
+
+    def accept(self, stype, topic, value):
+        """True if the reading should be published."""
+        deadband = self.deadband(stype)
+        if deadband is None:
+            self.forwarded += 1
+            return True
+
+        try:
+            number = float(value)
+        except ValueError:
+            self.forwarded += 1
+            return True
+
+        now = time.monotonic()
+        last = self._last.get(topic)
+        if last is not None and abs(number - last[0]) < deadband and now - last[1] < self.max_silence:
+            self.suppressed += 1
+            return False
+
+        if len(self._last) >= self.maxsize:
+            self._last.clear()
+        self._last[topic] = (number, now)
+        self.forwarded += 1
+        return True
+
+    def stats(self):
+        return {
+            "sensors": len(self._last),
+            "forwarded": self.forwarded,
+            "suppressed": self.suppressed,
+        }
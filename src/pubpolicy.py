@@ -0,0 +1,126 @@
+"""QoS, retain and expiry policy per topic class.
+
+Topics are classified by the first matching rule in TOPIC_CLASSES, the
+result is cached per topic so the regexes only run once for each topic.
+Expiry (seconds) is the MQTT v5 message expiry interval, it is ignored on
+MQTT 3.1.1 connections.
+
+By default every class is published as before the policy table, QoS 1 and
+retained without expiry. TUNED_POLICIES ("tuned" in a policy spec) lowers
+the QoS of high rate classes and lets retained telemetry expire, so slow
+sensors whose last reading is older than the expiry have no retained
+value on MQTT v5 brokers.
+"""
+
+import collections
+import re
+import threading
+
+Policy = collections.namedtuple("Policy", ("qos", "retain", "expiry"))
+
+# (class, topic rule), first match wins
+TOPIC_CLASSES = [
+    ("alarm", r"^smarthome/node/[^/]+/sensor/(smoke|water|fall)/[^/]+/value/"),
+    ("timestamp", r"^smarthome/node/[^/]+/sensor/[^/]+/[^/]+/(timestamp|rxtime)/"),
+    ("metadata", r"^smarthome/node/[^/]+/sensor/[^/]+/[^/]+/unit"),
+    ("power", r"^smarthome/node/[^/]+/sensor/power/[^/]+/value/power$"),
+    ("status", r"^smarthome/node/[^/]+/sensor/[^/]+/[^/]+/value/(status|switch)$"),
+    ("telemetry", r"^smarthome/node/[^/]+/sensor/[^/]+/[^/]+/value/"),
+    ("state", r"^smarthome/node/[^/]+/state$"),
+]
+
+# QoS 1, retained, no expiry for every class
+DEFAULT_POLICIES = {
+    "alarm": Policy(1, 1, None),
+    "timestamp": Policy(1, 1, None),
+    "metadata": Policy(1, 1, None),
+    "power": Policy(1, 1, None),
+    "status": Policy(1, 1, None),
+    "telemetry": Policy(1, 1, None),
+    "state": Policy(1, 1, None),
+    "default": Policy(1, 1, None),
+}
+
+TUNED_POLICIES = {
+    # alarms must arrive exactly once
+    "alarm": Policy(2, 1, None),
+    # losing a timestamp is harmless, the next reading brings a new one
+    "timestamp": Policy(0, 1, 3600),
+    "metadata": Policy(1, 1, None),
+    # high rate samples, a stale power reading is worse than none
+    "power": Policy(0, 1, 600),
+    "status": Policy(1, 1, None),
+    # readings older than an hour are not worth delivering
+    "telemetry": Policy(1, 1, 3600),
+    "state": Policy(1, 1, None),
+    "default": Policy(1, 1, None),
+}
+
+# outbound scheduler lanes (see queues.PublishScheduler), lower is served first
+LANE_ALARM = 0
+LANE_STATE = 1
+LANE_TELEMETRY = 2
+
+CLASS_LANES = {
+    "alarm": LANE_ALARM,
+    "status": LANE_STATE,
+    "metadata": LANE_STATE,
+    "state": LANE_STATE,
+    "default": LANE_STATE,
+    "timestamp": LANE_TELEMETRY,
+    "power": LANE_TELEMETRY,
+    "telemetry": LANE_TELEMETRY,
+}
+
+POLICY_CACHE_SIZE = 4096
+
+
+def parse_policies(spec, policies=None):
+    """'power:0:1:600,telemetry:0:1' -> policies updated from DEFAULT_POLICIES,
+    'tuned' in the spec applies TUNED_POLICIES."""
+    policies = dict(DEFAULT_POLICIES if policies is None else policies)
+    for item in spec.split(","):
+        if item.strip() == "tuned":
+            policies.update(TUNED_POLICIES)
+            continue
+        fields = item.strip().split(":")
+        if len(fields) not in (3, 4) or fields[0] not in policies:
+            raise ValueError("invalid publish policy <" + item + ">")
+        qos = int(fields[1])
+        if qos not in (0, 1, 2):
+            raise ValueError("invalid qos <" + item + ">")
+        expiry = int(fields[3]) if len(fields) == 4 and int(fields[3]) > 0 else None
+        policies[fields[0]] = Policy(qos, int(fields[2]), expiry)
+    return policies
+
+
+class PolicyTable(object):
+    def __init__(self, policies=None, maxsize=POLICY_CACHE_SIZE):
+        self.policies = dict(DEFAULT_POLICIES if policies is None else policies)
+        self.maxsize = maxsize
+        self._rules = [(name, re.compile(rule)) for name, rule in TOPIC_CLASSES]
+        self._cache = {}
+        self._lock = threading.Lock()
+        self.counts = collections.Counter()
+
+    def classify(self, topic):
+        for name, rule in self._rules:
+            if rule.search(topic):
+                return name
+        return "default"
+
+    def lookup(self, topic):
+        """Returns (class, Policy) of the topic, see CLASS_LANES for its lane."""
+        entry = self._cache.get(topic)
+        if entry is None:
+            name = self.classify(topic)
+            entry = (name, self.policies[name])
+            with self._lock:
+                if len(self._cache) >= self.maxsize:
+                    self._cache.clear()
+                self._cache[topic] = entry
+        self.counts[entry[0]] += 1
+        return entry
+
+    def stats(self):
+        return dict(self.counts)
@@ -0,0 +1,182 @@
+"""Queues used between the gateway stages (serial ingest, mqtt publish)."""
+
+import collections
+import threading
+import time
+
+
+class BoundedQueue(object):
+    """Bounded FIFO between a producer and a consumer.
+
+    put() never blocks: when the queue is full the oldest item is dropped,
+    the newest reading is the one worth keeping. Keeps high-water mark, drop
+    counter and queue-wait time so the size can be tuned to the network.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._items = collections.deque()
+        self._cond = threading.Condition()
+        self.puts = 0
+        self.drops = 0
+        self.high_water = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.gets = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item):
+        """Adds item, returns False if the oldest item had to be dropped."""
+        with self._cond:
+            dropped = False
+            if len(self._items) >= self.maxsize:
+                self._items.popleft()
+                self.drops += 1
+                dropped = True
+            self._items.append((time.monotonic(), item))
+            self.puts += 1
+            if len(self._items) > self.high_water:
+                self.high_water = len(self._items)
+            self._cond.notify()
+        return not dropped
+
+    def get(self, timeout=None):
+        """Removes and returns the oldest item, None on timeout."""
+        with self._cond:
+            if not self._items:
+                self._cond.wait(timeout)
+                if not self._items:
+                    return None
+            return self._take()
+
+    def get_nowait(self):
+        with self._cond:
+            if not self._items:
+                return None
+            return self._take()
+
+    def _take(self):
+        queued_at, item = self._items.popleft()
+        wait = time.monotonic() - queued_at
+        self.gets += 1
+        self.wait_total += wait
+        if wait > self.wait_max:
+            self.wait_max = wait
+        return item
+
+    def stats(self):
+        return {
+            "size": self.maxsize,
+            "depth": len(self._items),
+            "high_water": self.high_water,
+            "in": self.puts,
+            "out": self.gets,
+            "dropped": self.drops,
+            "wait_avg_ms": round(self.wait_total * 1000 / self.gets, 3) if self.gets else 0,
+            "wait_max_ms": round(self.wait_max * 1000, 3),
+        }
+
+
+LANE_NAMES = ("alarm", "state", "telemetry")
+TELEMETRY_LANE_SIZE = 512
+
+
+class PublishScheduler(object):
+    """Prioritised, rate limited outbound publish queue.
+
+    Lanes are served strictly in order (alarm, state, telemetry), a token
+    bucket limits the rate handed to the mqtt client. Only the telemetry
+    lane is shed under overload: a newer message for a topic that is still
+    queued replaces the old one (coalesced), and when the lane is full the
+    oldest message is dropped.
+    """
+
+    def __init__(self, publish, rate, burst=None, lane_size=TELEMETRY_LANE_SIZE):
+        # publish(topic, payload, qos, retain, properties)
+        self._publish = publish
+        self.rate = float(rate)
+        self.burst = float(burst if burst else rate)
+        self.lane_size = lane_size
+        self._lanes = (collections.deque(), collections.deque(), collections.OrderedDict())
+        self._cond = threading.Condition()
+        self._tokens = self.burst
+        self._refilled = time.monotonic()
+        self._lane_stats = [{"queued": 0, "published": 0, "dropped": 0, "coalesced": 0,
+                             "latency_avg_ms": 0.0, "latency_max_ms": 0.0} for name in LANE_NAMES]
+
+    def __len__(self):
+        return sum(len(lane) for lane in self._lanes)
+
+    def put(self, lane, topic, payload, qos, retain, properties=None):
+        message = (time.monotonic(), topic, payload, qos, retain, properties)
+        stats = self._lane_stats[lane]
+        with self._cond:
+            stats["queued"] += 1
+            if lane == len(self._lanes) - 1:
+                telemetry = self._lanes[lane]
+                if topic in telemetry:
+                    # keep the original queue position and wait time
+                    message = (telemetry[topic][0],) + message[1:]
+                    stats["coalesced"] += 1
+                elif len(telemetry) >= self.lane_size:
+                    telemetry.popitem(last=False)
+                    stats["dropped"] += 1
+                telemetry[topic] = message
+            else:
+                self._lanes[lane].append(message)
+            self._cond.notify()
+
+    def _pop(self):
+        for lane, queue in enumerate(self._lanes):
+            if queue:
+                if lane == len(self._lanes) - 1:
+                    return lane, queue.popitem(last=False)[1]
+                return lane, queue.popleft()
+        return None, None
+
+    def _take_token(self, now):
+        """0 if a token was taken, else seconds until the next one."""
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    def service(self):
+        """Publishes while tokens last. Returns seconds until it should run again, None if empty."""
+        while True:
+            with self._cond:
+                if not len(self):
+                    return None
+                now = time.monotonic()
+                wait = self._take_token(now)
+                if wait > 0:
+                    return wait
+                lane, message = self._pop()
+                stats = self._lane_stats[lane]
+                latency = (now - message[0]) * 1000
+                stats["published"] += 1
+                stats["latency_avg_ms"] += (latency - stats["latency_avg_ms"]) / stats["published"]
+                if latency > stats["latency_max_ms"]:
+                    stats["latency_max_ms"] = latency
+            self._publish(*message[1:])
+
+    def run(self):
+        """Publisher thread."""
+        while True:
+            with self._cond:
+                while not len(self):
+                    self._cond.wait()
+            wait = self.service()
+            if wait:
+                time.sleep(wait)
+
+    def stats(self):
+        stats = {"rate": self.rate, "depth": len(self)}
+        for name, lane in zip(LANE_NAMES, self._lane_stats):
+            stats[name] = dict(lane, latency_avg_ms=round(lane["latency_avg_ms"], 3),
+                               latency_max_ms=round(lane["latency_max_ms"], 3))
+        return stats
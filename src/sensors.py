@@ -0,0 +1,94 @@
+"""Declarative description of the sensor readings sent by the coordinator.
+
+Every serial (group, type) message that only converts the payload and
+publishes it under the sensor topics is an entry in SENSOR_TYPES. Adding a
+device type is a data change here, zmqtt.ser_msg_handler_sensor() runs it.
+
+Published topics for an entry with attribute <attr>:
+  smarthome/node/<nid>/sensor/<segment>/<sid>/timestamp/<attr>
+  smarthome/node/<nid>/sensor/<segment>/<sid>/unit[/<attr>]   (only with unit)
+  smarthome/node/<nid>/sensor/<segment>/<sid>/value/<attr>
+  smarthome/node/<nid>/sensor/<segment>/<sid>/rxtime/<attr>   (epoch ms, optional)
+"""
+
+BOOL = {"0": "false", "1": "true"}
+MOTION = {"0": "IDLE", "1": "ACTIVE"}
+FALL = {"0": "OK", "1": "FALL", "2": "PANIC"}
+
+
+class SensorType(object):
+    def __init__(self, segment, attr, unit=None, scale=None, fmt=str, enum=None, limits=None, sensorid=None):
+        self.segment = segment
+        self.attr = attr
+        self.unit = unit
+        # value = fmt(float(payload) / scale)
+        self.scale = scale
+        self.fmt = fmt
+        # status types: payload -> published value
+        self.enum = enum
+        # (min, max) of integer payloads, published normalised with int()
+        self.limits = limits
+        # sensors published under a fixed sensor id
+        self.sensorid = sensorid
+        # convert() builds the value itself, it can skip the printable filter
+        self.clean = enum is not None or limits is not None or scale is not None
+
+        # everything that does not depend on the payload
+        self.prefix = "/sensor/" + segment + "/"
+        self.value_suffix = "/value/" + attr
+        self.timestamp_suffix = "/timestamp/" + attr
+        self.rxtime_suffix = "/rxtime/" + attr
+        if unit is None:
+            self.unit_suffix = None
+        elif attr == "actual":
+            self.unit_suffix = "/unit"
+        else:
+            self.unit_suffix = "/unit/" + attr
+
+    def convert(self, payload):
+        """Serial payload -> published value, None if payload is invalid."""
+        try:
+            if self.enum is not None:
+                return self.enum.get(payload)
+            if self.limits is not None:
+                value = int(payload)
+                if self.limits[0] <= value <= self.limits[1]:
+                    return str(value)
+                return None
+            if self.scale is not None:
+                return self.fmt(float(payload) / self.scale)
+        except ValueError:
+            return None
+        return payload
+
+    def topics(self, nodeid, sensorid):
+        """Returns (value, timestamp, unit, rxtime) topics, unit is None for unitless types."""
+        base = "smarthome/node/" + nodeid + self.prefix + (self.sensorid or sensorid)
+        unit = base + self.unit_suffix if self.unit_suffix is not None else None
+        return base + self.value_suffix, base + self.timestamp_suffix, unit, base + self.rxtime_suffix
+
+
+SENSOR_TYPES = {
+    ("p", "st"): SensorType("power", "status", enum=BOOL),
+    ("p", "p"): SensorType("power", "power", unit="W", scale=100),
+    ("p", "e"): SensorType("power", "energy", unit="kWh", scale=100000, fmt="{0:.10f}".format),
+    ("t", "act"): SensorType("temperature", "actual", unit="oC", scale=100),
+    ("h", "act"): SensorType("humidity", "actual", unit="%", scale=100),
+    ("m", "st"): SensorType("motion", "status", enum=MOTION),
+    ("f", "st"): SensorType("fall", "status", enum=FALL),
+    ("co2", "act"): SensorType("co2", "actual", unit="ppm"),
+    ("voc", "act"): SensorType("voc", "actual", unit="ppb"),
+    ("pm2_5", "act"): SensorType("pm2_5", "actual", unit="ugm3"),
+    ("pm10", "act"): SensorType("pm10", "actual", unit="ugm3"),
+    ("lux", "act"): SensorType("illuminance", "actual", unit="lux"),
+    ("pr", "act"): SensorType("pressure", "actual", unit="hPa", scale=10),
+    ("blb", "st"): SensorType("bulb", "switch", enum=BOOL),
+    ("blb", "lv"): SensorType("bulb", "level", limits=(0, 100)),
+    ("cblb", "st"): SensorType("colorbulb", "switch", enum=BOOL),
+    ("cblb", "lv"): SensorType("colorbulb", "level", limits=(0, 100)),
+    ("cblb", "hue"): SensorType("colorbulb", "hue", limits=(0, 360)),
+    ("cblb", "sat"): SensorType("colorbulb", "saturation", limits=(0, 100)),
+    ("w", "st"): SensorType("water", "status", enum=BOOL, sensorid="1031"),
+    ("d", "st"): SensorType("door", "status", enum=BOOL, sensorid="1032"),
+    ("sm", "st"): SensorType("smoke", "status", enum=BOOL, sensorid="1033"),
+}
@@ -0,0 +1,168 @@
+"""Frame splitter for the zigbee coordinator UART.
+
+The coordinator interleaves two framings on the same line:
+  * ASCII sensor messages, terminated with a newline
+  * binary MT frames: SOF(0xFE) LEN CMD0 CMD1 DATA[LEN] FCS
+
+Everything pending on the port is read in one call and split into complete
+frames. Incomplete frames stay buffered until the rest arrives, so a partial
+line never blocks the reader. Frames are stamped with their receive time
+when they leave the reader, so queueing does not skew event times.
+"""
+
+import collections
+import time
+from functools import reduce
+from operator import xor
+
+SOF = 0xFE
+
+FRAME_LINE = 0
+FRAME_MT = 1
+
+# SOF + LEN + CMD0 + CMD1 + FCS
+MT_OVERHEAD = 5
+
+# kind: FRAME_LINE or FRAME_MT; rx_mono: time.monotonic(); rx_ms: epoch milliseconds
+Frame = collections.namedtuple("Frame", ("kind", "data", "rx_mono", "rx_ms"))
+
+# longest ASCII line we wait for before treating the buffer as garbage
+LINE_MAX_LEN = 512
+
+
+class SerialFrameReader(object):
+    def __init__(self, max_line=LINE_MAX_LEN):
+        self._buf = bytearray()
+        self.max_line = max_line
+        self.bytes_in = 0
+        self.lines = 0
+        self.mt_frames = 0
+        self.garbage_bytes = 0
+        self.fcs_errors = 0
+
+    def read(self, port):
+        """Reads everything pending on the port, returns list of complete frames."""
+        pending = port.in_waiting
+        # block for the first byte (up to port timeout) when nothing is pending
+        data = port.read(pending if pending > 0 else 1)
+        if not data:
+            return []
+        return self.feed(data)
+
+    def feed(self, data):
+        """Appends raw bytes, returns list of complete Frames."""
+        buf = self._buf
+        buf += data
+        self.bytes_in += len(data)
+
+        frames = []
+        rx_mono = time.monotonic()
+        rx_ms = int(time.time() * 1000)
+        pos = 0
+        end = len(buf)
+
+        while pos < end:
+            if buf[pos] == SOF:
+                if end - pos < 2:
+                    break
+                size = buf[pos + 1] + MT_OVERHEAD
+                if end - pos < size:
+                    break
+                frame = bytes(buf[pos:pos + size])
+                if reduce(xor, frame[1:-1]) != frame[-1]:
+                    # not a real frame start, skip SOF and resync
+                    self.fcs_errors += 1
+                    self.garbage_bytes += 1
+                    pos += 1
+                    continue
+                frames.append(Frame(FRAME_MT, frame, rx_mono, rx_ms))
+                self.mt_frames += 1
+                pos += size
+                continue
+
+            nl = buf.find(b'\n', pos)
+            sof = buf.find(b'\xfe', pos, end if nl == -1 else nl)
+            if sof != -1:
+                # ASCII lines never contain SOF, drop the broken line
+                self.garbage_bytes += sof - pos
+                pos = sof
+                continue
+
+            if nl == -1:
+                if end - pos > self.max_line:
+                    self.garbage_bytes += end - pos
+                    pos = end
+                break
+
+            frames.append(Frame(FRAME_LINE, bytes(buf[pos:nl + 1]), rx_mono, rx_ms))
+            self.lines += 1
+            pos = nl + 1
+
+        del buf[:pos]
+        return frames
+
+    def reset(self):
+        """Drops buffered partial frame, e.g. after the port was reopened."""
+        self.garbage_bytes += len(self._buf)
+        del self._buf[:]
+
+    def stats(self):
+        return {
+            "bytes": self.bytes_in,
+            "lines": self.lines,
+            "mt_frames": self.mt_frames,
+            "garbage_bytes": self.garbage_bytes,
+            "fcs_errors": self.fcs_errors,
+        }
+
+
+# one lookup per MAC octet: "4b", "4B", "b" ... -> zero filled node id octet
+_NID_OCTET = {}
+for _hi in "0123456789abcdefABCDEF":
+    _NID_OCTET[_hi] = "0" + _hi
+    for _lo in "0123456789abcdefABCDEF":
+        _NID_OCTET[_hi + _lo] = _hi + _lo
+for _octet, _nid in list(_NID_OCTET.items()):
+    _NID_OCTET[_octet.encode('ascii')] = _nid
+
+
+def mac_to_nid(mac):
+    """Converts colon separated MAC (str or bytes) to 16 char node id, None if invalid."""
+    octets = mac.split(b':') if type(mac) is bytes else mac.split(':')
+    if len(octets) != 8:
+        return None
+    try:
+        return "".join([_NID_OCTET[octet] for octet in octets])
+    except KeyError:
+        return None
+
+
+def split_line(line):
+    """Splits raw 'mac/group/sensorid/type/payload' serial line.
+
+    Returns (mac, group, sensorid, type, payload) with the MAC left as bytes
+    (see mac_to_nid) and the rest decoded, or None for an invalid line.
+    """
+    fields = line.split(b'/', 5)
+    if len(fields) < 5:
+        return None
+    mac, group, sensorid, msgtype, payload = fields[:5]
+    if len(fields) == 5:
+        payload = payload.rstrip()
+    if not (mac and group and sensorid and msgtype and payload):
+        return None
+    try:
+        return (mac, group.decode('ascii'), sensorid.decode('ascii'),
+                msgtype.decode('ascii'), payload.decode('ascii'))
+    except UnicodeDecodeError:
+        return None
+
+
+_HEX_DIGITS = frozenset("0123456789abcdefABCDEF")
+
+
+def nid_to_mac(nid):
+    """Converts 16 char node id to colon separated MAC as the coordinator expects it."""
+    if len(nid) != 16 or not _HEX_DIGITS.issuperset(nid):
+        return None
+    return ":".join([nid[i].lstrip("0") + nid[i + 1] for i in range(0, 16, 2)])
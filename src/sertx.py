@@ -0,0 +1,194 @@
+"""Paces frames written to the coordinator UART.
+
+Replaces the fixed sleep after every frame. Frames are written by a single
+writer in queue order, subject to:
+  - a global gap to the previous frame, adapted to how fast the
+    coordinator answers: gap = RESPONSE_FACTOR * average response time,
+    kept between min_gap and max_gap. It starts at max_gap and a frame
+    that gets no answer within max_gap counts as a max_gap response.
+  - a per-destination gap (node mac, coordinator "0"), a frame for a
+    node that was just addressed lets frames for other nodes pass it.
+
+Actuator commands can be queued latest-wins (put(coalesce=True)): a newer
+frame for the same node, sensor and attribute replaces the queued one, so
+a dragged slider only sends the value it ends on. The replacing frame
+goes to the end of the queue, frames for one node stay in the order of
+their last change.
+
+The response time is measured from a write to the next frame that answers
+it (responded()): a frame from the node the frame was written to, or from
+the coordinator itself. Readings other nodes send meanwhile do not count.
+All methods take the monotonic time, so the pacing can also be simulated
+(bench/bench_serial_tx.py).
+"""
+
+import collections
+import threading
+import time
+
+SER_TX_MIN_GAP = 0.05
+SER_TX_MAX_GAP = 0.5
+SER_TX_DEST_GAP = 0.25
+RESPONSE_FACTOR = 2.0
+RESPONSE_WEIGHT = 0.2
+DEST_TABLE_SIZE = 1024
+
+# queue -> write latency histogram, upper bounds in ms
+LATENCY_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def destination(message):
+    """'<mac>/<group>/...' -> '<mac>'."""
+    return message.split("/", 1)[0]
+
+
+def command_key(message):
+    """'<mac>/<group>/<sensor>/<attribute>/<value>' -> '<mac>/<group>/<sensor>/<attribute>'."""
+    return "/".join(message.split("/", 4)[:4])
+
+
+class TxScheduler(object):
+    def __init__(self, min_gap=SER_TX_MIN_GAP, max_gap=SER_TX_MAX_GAP, dest_gap=SER_TX_DEST_GAP):
+        self.min_gap = min_gap
+        self.max_gap = max_gap
+        self.dest_gap = dest_gap
+        # (destination, key, message, rx, queued_at), key only for coalesced frames
+        self._queue = collections.deque()
+        self._pending = {}
+        self._cond = threading.Condition()
+        self.gap = max_gap
+        self.response = max_gap / RESPONSE_FACTOR
+        self._next_tx = 0.0
+        self._dest_next = {}
+        self._awaiting = None
+        self._awaiting_dest = None
+        self.queued = 0
+        self.sent = 0
+        self.timeouts = 0
+        self.coalesced = 0
+        self.coalesced_by_attribute = {}
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def __len__(self):
+        return len(self._queue)
+
+    def put(self, message, rx=None, now=None, coalesce=False):
+        """rx: receive time of the command the frame belongs to, passed back on write.
+        coalesce: replace a queued frame for the same node, sensor and attribute."""
+        with self._cond:
+            queued_at = time.monotonic() if now is None else now
+            key = None
+            if coalesce:
+                key = command_key(message)
+                older = self._pending.get(key)
+                if older is not None:
+                    self._queue.remove(older)
+                    # latency counts from the first change that waited
+                    queued_at = older[4]
+                    self.coalesced += 1
+                    fields = key.split("/")
+                    attribute = fields[1] + "/" + fields[-1]
+                    self.coalesced_by_attribute[attribute] = self.coalesced_by_attribute.get(attribute, 0) + 1
+            item = (destination(message), key, message, rx, queued_at)
+            if key is not None:
+                self._pending[key] = item
+            self._queue.append(item)
+            self.queued += 1
+            self._cond.notify()
+
+    def retry(self, message, rx=None, now=None):
+        """Queues an unacknowledged frame again (coalesced), returns False if a newer
+        frame for the same node, sensor and attribute is already queued."""
+        with self._cond:
+            if command_key(message) in self._pending:
+                return False
+            self.put(message, rx, now, coalesce=True)
+            return True
+
+    def _sample(self, response):
+        self.response += (response - self.response) * RESPONSE_WEIGHT
+        self.gap = min(self.max_gap, max(self.min_gap, RESPONSE_FACTOR * self.response))
+
+    def responded(self, now, source=None):
+        """A frame was received from the coordinator (source None) or from node source."""
+        with self._cond:
+            if source is not None and source != self._awaiting_dest:
+                return
+            if self._awaiting is not None and now >= self._awaiting:
+                self._sample(now - self._awaiting)
+                self._awaiting = None
+
+    def take(self, now):
+        """Returns (frame, None) with frame (message, rx) to write now, else
+        (None, seconds to wait), the wait is None when the queue is empty."""
+        with self._cond:
+            if self._awaiting is not None and now - self._awaiting > self.max_gap:
+                self.timeouts += 1
+                self._sample(self.max_gap)
+                self._awaiting = None
+
+            if not self._queue:
+                return None, None
+            if now < self._next_tx:
+                return None, self._next_tx - now
+
+            ready_at = None
+            for index, item in enumerate(self._queue):
+                dest_next = self._dest_next.get(item[0], 0.0)
+                if dest_next <= now:
+                    break
+                if ready_at is None or dest_next < ready_at:
+                    ready_at = dest_next
+            else:
+                return None, ready_at - now
+
+            del self._queue[index]
+            dest, key, message, rx, queued_at = item
+            if key is not None:
+                del self._pending[key]
+            self._next_tx = now + self.gap
+            if len(self._dest_next) >= DEST_TABLE_SIZE:
+                self._dest_next.clear()
+            self._dest_next[dest] = now + self.dest_gap
+            if self._awaiting is None:
+                self._awaiting = now
+                self._awaiting_dest = dest
+
+            latency = (now - queued_at) * 1000
+            self.sent += 1
+            self.latency_total += latency
+            if latency > self.latency_max:
+                self.latency_max = latency
+            bucket = 0
+            while bucket < len(LATENCY_BUCKETS) and latency > LATENCY_BUCKETS[bucket]:
+                bucket += 1
+            self.histogram[bucket] += 1
+            return (message, rx), None
+
+    def run(self, write):
+        """Writer thread, write(message, rx) writes one frame."""
+        while True:
+            with self._cond:
+                frame, wait = self.take(time.monotonic())
+                if frame is None:
+                    self._cond.wait(wait)
+                    continue
+            write(*frame)
+
+    def stats(self):
+        labels = ["le_" + str(bound) for bound in LATENCY_BUCKETS] + ["gt_" + str(LATENCY_BUCKETS[-1])]
+        return {
+            "queued": self.queued,
+            "sent": self.sent,
+            "depth": len(self._queue),
+            "gap_ms": round(self.gap * 1000, 1),
+            "response_ms": round(self.response * 1000, 1),
+            "timeouts": self.timeouts,
+            "coalesced": self.coalesced,
+            "coalesced_by_attribute": dict(self.coalesced_by_attribute),
+            "latency_avg_ms": round(self.latency_total / self.sent, 1) if self.sent else 0,
+            "latency_max_ms": round(self.latency_max, 1),
+            "latency_ms": dict(zip(labels, self.histogram)),
+        }
@@ -0,0 +1,85 @@
+"""MQTT v5 topic aliases for frequently published topics.
+
+A topic published ALIAS_HOT_COUNT times gets one of the aliases the
+broker allowed in CONNACK (Topic Alias Maximum). The first publish sends
+topic and alias, later ones only the two byte alias. Aliases only live as
+long as the connection, reset() starts over on every connect.
+
+Only QoS 0 publishes use aliases: paho resends unacknowledged QoS 1/2
+packets after a reconnect as they were stored, an alias-only packet would
+then refer to an alias the new connection does not know.
+"""
+
+import threading
+
+from paho.mqtt.properties import Properties
+from paho.mqtt.packettypes import PacketTypes
+
+ALIAS_HOT_COUNT = 3
+# cap on topics counted while looking for hot ones
+ALIAS_CANDIDATES = 4096
+
+
+class TopicAliases(object):
+    def __init__(self, client, limit=None):
+        self._client = client
+        # --topic-aliases, None takes what the broker allows
+        self.limit = limit
+        self.maximum = 0
+        self._aliases = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+        self.aliased = 0
+        self.bytes_saved = 0
+
+    def reset(self, maximum):
+        """New connection, maximum is the broker's Topic Alias Maximum."""
+        with self._lock:
+            self.maximum = maximum if self.limit is None else min(maximum, self.limit)
+            self._aliases.clear()
+            self._counts.clear()
+
+    def _alias(self, topic):
+        """(alias, first use) for the topic, alias is None if it has none."""
+        alias = self._aliases.get(topic)
+        if alias is not None:
+            return alias, False
+        if len(self._aliases) >= self.maximum:
+            return None, False
+        count = self._counts.get(topic, 0) + 1
+        if count < ALIAS_HOT_COUNT:
+            if len(self._counts) >= ALIAS_CANDIDATES:
+                self._counts.clear()
+            self._counts[topic] = count
+            return None, False
+        self._counts.pop(topic, None)
+        alias = len(self._aliases) + 1
+        self._aliases[topic] = alias
+        return alias, True
+
+    def publish(self, topic, payload, qos, retain, properties=None):
+        """mqtt client publish() with the topic replaced by its alias where possible."""
+        if qos != 0 or not self.maximum:
+            return self._client.publish(topic, payload, qos, retain, properties)
+
+        # alias assignment and the publish must reach the socket in order
+        with self._lock:
+            alias, first = self._alias(topic)
+            if alias is None:
+                return self._client.publish(topic, payload, qos, retain, properties)
+            if properties is None:
+                properties = Properties(PacketTypes.PUBLISH)
+            properties.TopicAlias = alias
+            if not first:
+                self.aliased += 1
+                self.bytes_saved += len(topic)
+                topic = ""
+            return self._client.publish(topic, payload, qos, retain, properties)
+
+    def stats(self):
+        return {
+            "maximum": self.maximum,
+            "assigned": len(self._aliases),
+            "aliased": self.aliased,
+            "bytes_saved": self.bytes_saved,
+        }
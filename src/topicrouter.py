@@ -0,0 +1,82 @@
+"""Routes inbound mqtt topics to their handlers with a segment trie.
+
+Patterns use the mqtt subscription syntax, "+" matches one topic level
+and is passed to the handler as a parameter, optionally checked by a
+validator. A topic is resolved in one pass over its levels, literal levels
+are tried before "+" (no backtracking, the command topics never need it).
+
+  router.add("smarthome/node/+/sensor/bulb/+/set/level", handler, {0: is_node_id})
+  router.route("smarthome/node/67161707004B1200/sensor/bulb/1/set/level", b"50")
+  -> handler(["67161707004B1200", "1"], b"50")
+"""
+
+import string
+
+_HEX_DIGITS = frozenset(string.hexdigits)
+
+
+def is_node_id(segment):
+    """16 hex digit node id."""
+    return len(segment) == 16 and _HEX_DIGITS.issuperset(segment)
+
+
+class _Node(object):
+    __slots__ = ("children", "wildcard", "validator", "handler")
+
+    def __init__(self):
+        self.children = {}
+        self.wildcard = None
+        self.validator = None
+        self.handler = None
+
+
+class TopicRouter(object):
+    def __init__(self):
+        self._root = _Node()
+        self.routed = 0
+        self.unknown = 0
+
+    def add(self, pattern, handler, validators=None):
+        """validators: {parameter index: callable(segment) -> bool}."""
+        node = self._root
+        param = 0
+        for segment in pattern.split("/"):
+            if segment == "+":
+                if node.wildcard is None:
+                    node.wildcard = _Node()
+                node = node.wildcard
+                if validators and param in validators:
+                    node.validator = validators[param]
+                param += 1
+            else:
+                node = node.children.setdefault(segment, _Node())
+        if node.handler is not None:
+            raise ValueError("duplicate route <" + pattern + ">")
+        node.handler = handler
+
+    def match(self, topic):
+        """Returns (handler, parameters), handler is None for unknown topics."""
+        node = self._root
+        params = []
+        for segment in topic.split("/"):
+            child = node.children.get(segment)
+            if child is None:
+                child = node.wildcard
+                if child is None or (child.validator is not None and not child.validator(segment)):
+                    return None, None
+                params.append(segment)
+            node = child
+        return node.handler, params
+
+    def route(self, topic, payload):
+        """Calls the topic's handler, returns False for unknown topics."""
+        handler, params = self.match(topic)
+        if handler is None:
+            self.unknown += 1
+            return False
+        self.routed += 1
+        handler(params, payload)
+        return True
+
+    def stats(self):
+        return {"routed": self.routed, "unknown": self.unknown}
@@ -5,10 +5,16 @@ import signal
 import sys
 import serial
 import paho.mqtt.client as mqtt
+from paho.mqtt.properties import Properties
+from paho.mqtt.packettypes import PacketTypes
 import re
 import getopt
 import os
 import struct
+import asyncio
+import collections
+import functools
+import json
 
 # insert env variable for pi 1 before importing GPIO
 try:
@@ -20,11 +26,26 @@ except:
     sys.exit(1)
 
 import RPi.GPIO as GPIO
-from threading import Timer
+from threading import Timer, Thread, Lock, Condition, Event, local, current_thread
 import sbl
+import serframe
+import queues
+import caches
+import sensors
+import clock
+import pubfilter
+import nodestate
+import pubpolicy
+import journal
+import topicalias
+import binenc
+import fanout
+import topicrouter
+import sertx
+import hsvmerge
+import cmdack
 #import otaserv
 import subprocess
-import string
 
 _transitionTime = ":0"
 
@@ -53,11 +74,32 @@ _gwmc_led5_timer = None
 _ping_timer = None
 _ping_timer_timeout = None
 _ping_timer_timeout_flag = 0
+# set while a ping sent by the ping timer waits in the TX queue
+_ping_timer_queued = False
 PING_TIMER_TIMEOUT = 300
+PING_MESSAGE = "0/ready/ping/0/0"
 
 _uart_port = None
 _serial_port = None
 _mqttc = None
+_mqtt_protocol = mqtt.MQTTv311
+# MQTT v5 topic aliases (--mqtt5); None when disabled
+_topic_aliases = None
+# additional publish-only brokers (--fanout)
+_fanout = []
+# QoS/retain/expiry per topic class (--qos-policy)
+_publish_policy = pubpolicy.PolicyTable()
+# prioritised, rate limited publishing (--publish-rate); None publishes directly
+_publish_scheduler = None
+_aio_publish_scheduled = False
+_mqtt_connected = False
+# store-and-forward while the broker is away (--journal); None disables
+_journal = None
+_journal_replaying = False
+# orders journal.record() in mqtt_msg_deliver against the end of a replay
+_journal_lock = Lock()
+JOURNAL_REPLAY_BATCH = 50
+JOURNAL_REPLAY_INTERVAL = 0.1
 _gwid = ""
 _gw_serial_sent = False
 _gw_revision_sent = False
@@ -73,6 +115,65 @@ _coord_mac_sent = False
 _coord_nwk = ""
 _coord_nwk_sent = False
 
+# asyncio runtime (--asyncio); None when running with threads
+_aio_loop = None
+_aio_serial_port = None
+# fd registered with the loop, the port's fileno() is gone once it is closed
+_aio_serial_fd = None
+_aio_tx_handle = None
+_aio_mqtt_reconnect_at = 0
+AIO_HOUSEKEEPING_INTERVAL = 1
+AIO_MQTT_RECONNECT_INTERVAL = 5
+
+_serial_reader = None
+# the UART reader thread closes and reopens the port, other threads post a
+# request ("close", "open" or "reopen") and wait for it (serial_port_request)
+_serial_reader_thread = None
+_serial_port_request = None
+_serial_port_baudrate = None
+_serial_port_cond = Condition()
+SERIAL_PORT_REQUEST_TIMEOUT = 20
+# paced UART writes, a single writer owns the port writes and _seq_num
+_ser_tx = None
+_ser_tx_lock = Lock()
+SER_TX_INTERVAL = sertx.SER_TX_MAX_GAP
+# colour bulb hue/saturation/level commands merged into hsv frames (--hsv-window)
+_hsv_merge = None
+
+# frame being processed, its rx_ms is the reading's timestamp
+_rx_frame = None
+_clock = clock.SecondFormatter()
+# also publish .../rxtime/<attr> with the epoch ms receive time (--rx-timestamp)
+_rx_timestamp_topics = False
+# UART receive -> handled, from the frames' monotonic stamp
+_rx_latency = {"frames": 0, "avg_ms": 0.0, "max_ms": 0.0}
+
+# serial ingest -> publisher queue
+_ingest_queue = None
+_aio_ingest_scheduled = False
+INGEST_QUEUE_SIZE = 256
+INGEST_BATCH = 16
+
+# inbound mqtt commands -> command worker, keeps paho's network thread free
+_command_queue = None
+_aio_command_scheduled = False
+COMMAND_QUEUE_SIZE = 128
+# monotonic receive time of the command being handled (rx), for time-to-serial
+_command_context = local()
+_command_latency = {"frames": 0, "avg_ms": 0.0, "max_ms": 0.0}
+# optional actuator command acknowledgement tracking (--ack-timeout)
+_command_acks = None
+COMMAND_ACK_CHECK_INTERVAL = 0.25
+COMMAND_OUTCOME_TOPIC = "smarthome/platform/diagnostic/zmqtt/command"
+
+# periodic diagnostics, smarthome/platform/diagnostic/zmqtt/<name>
+_stats_providers = collections.OrderedDict()
+_stats_timer = None
+STATS_INTERVAL = 60
+
+# unknown serial "group/type" -> count
+_ser_msg_unknown = {}
+
 _nid_mac_table = {}
 _nid_nwk_table = {}
 
@@ -103,6 +204,8 @@ def sigint_handler(signal, frame):
     _serial_port.flushOutput()
     GPIO.cleanup()
     led_exit()
+    if _journal is not None:
+        _journal.close()
     sys.exit(0)
 
 
@@ -147,15 +250,78 @@ def get_nid_nwk(nid):
     return _nid_nwk_table.get(nid)
 
 # MQTT callbacks
-def on_connect(client, userdata, flags, rc):
+def on_connect(client, userdata, flags, rc, properties=None):
+    global _mqtt_connected
+    global _journal_replaying
+
     LOG(SYSLOG_INF, "MQ connected with result code:" + str(rc))
+    # broker may have lost retained messages, send metadata again
+    _metadata.reset()
     mqtt_subscribe(client)
+    _mqtt_connected = rc == 0
+    if _topic_aliases is not None:
+        _topic_aliases.reset(getattr(properties, "TopicAliasMaximum", 0))
+    if _mqtt_connected and _journal is not None and len(_journal) and not _journal_replaying:
+        # new publishes go to the journal too until it is drained, so they stay in order
+        _journal_replaying = True
+        LOG(SYSLOG_INF, "replaying " + str(len(_journal)) + " journaled publishes")
+        SingleShotTimer(0, journal_replay)
     #gw_send_serial()
     #gw_send_revision()
 
+def on_disconnect(client, userdata, rc, properties=None):
+    global _mqtt_connected
+
+    LOG(SYSLOG_WRN, "MQ disconnected with result code:" + str(rc))
+    _mqtt_connected = False
+
 def on_message(client, userdata, msg):
+    global _aio_command_scheduled
+
     LOG(SYSLOG_DBG, "received mqtt message: <" + msg.topic + "> <" + msg.payload.decode('utf-8') + ">" )
-    process_mqtt_message(msg)
+    # handlers wait for the UART, never on the network thread
+    if not _command_queue.put((time.monotonic(), msg)):
+        LOG(SYSLOG_WRN, "command queue full, dropped oldest command (" + str(_command_queue.drops) + " total)")
+
+    if _aio_loop is not None and not _aio_command_scheduled:
+        _aio_command_scheduled = True
+        _aio_loop.call_soon(aio_command_drain)
+
+def command_handle(rx, msg):
+    _command_context.rx = rx
+    try:
+        process_mqtt_message(msg)
+    except Exception as e:
+        LOG(SYSLOG_ERR, "failed to handle mqtt message <" + msg.topic + ">: " + str(e))
+    finally:
+        _command_context.rx = None
+
+def command_worker():
+    """Command stage thread."""
+    while True:
+        item = _command_queue.get()
+        if item is not None:
+            command_handle(*item)
+
+def aio_command_drain():
+    global _aio_command_scheduled
+
+    # ser_msg_send() only queues frames in asyncio mode, handling all is cheap
+    _aio_command_scheduled = False
+    item = _command_queue.get_nowait()
+    while item is not None:
+        command_handle(*item)
+        item = _command_queue.get_nowait()
+
+def command_sent(rx):
+    """Frame of a command written to the UART, rx is the command's receive time."""
+    if rx is None:
+        return
+    latency = (time.monotonic() - rx) * 1000
+    _command_latency["frames"] += 1
+    _command_latency["avg_ms"] += (latency - _command_latency["avg_ms"]) / _command_latency["frames"]
+    if latency > _command_latency["max_ms"]:
+        _command_latency["max_ms"] = latency
 
 
 def on_publish(client, userdata, mid):
@@ -184,49 +350,206 @@ def mqtt_subscribe(client):
     client.subscribe("smarthome/platform/diagnostic/loglevel/zmqtt")
 
 
-def mqtt_msg_publish(topic, payload):
-    """Sends mqtt message to the broker."""
-    mqtt_msg_publish_x(topic, payload, 1, 1)
+def mqtt_msg_publish(topic, payload, unit=None, clean=False):
+    """Sends mqtt message to the broker, QoS/retain/expiry from the topic class policy."""
+    topic_class, policy = _publish_policy.lookup(topic)
+    mqtt_msg_publish_x(topic, payload, policy.qos, policy.retain, policy.expiry, pubpolicy.CLASS_LANES[topic_class], unit, clean)
+
+def mqtt_msg_publish_x(topic, payload, qos, retain, expiry=None, lane=pubpolicy.LANE_STATE, unit=None, clean=False):
+    """Sends mqtt message to the broker, through the publish scheduler lane if enabled.
+
+    clean: payload was formatted by the gateway (numbers, timestamps, json),
+    it is not filtered for unprintable characters.
+    """
+    if SYSLOG_SEVERITY <= SYSLOG_DBG:
+        LOG(SYSLOG_DBG, "mqtt_msg_publish: " + topic + "<" + payload + ">; qos=" + str(qos) + " retain=" + str(retain))
+    mqtt_msg_deliver(topic, payload if clean else pubfilter.printable(payload), qos, retain, expiry, lane, unit)
+
+def mqtt_msg_publish_raw(topic, payload, policy_topic):
+    """Sends a binary payload unchanged, QoS/retain/expiry from the policy of policy_topic."""
+    topic_class, policy = _publish_policy.lookup(policy_topic)
+    if SYSLOG_SEVERITY <= SYSLOG_DBG:
+        LOG(SYSLOG_DBG, "mqtt_msg_publish_raw: " + topic + "<" + payload.hex() + ">")
+    mqtt_msg_deliver(topic, payload, policy.qos, policy.retain, policy.expiry, pubpolicy.CLASS_LANES[topic_class])
+
+def mqtt_msg_deliver(topic, payload, qos, retain, expiry, lane, unit=None):
+    """Journals the message while the broker is away, else sends it. Copies it to the fan-out brokers."""
+    for endpoint in _fanout:
+        endpoint.put(topic, payload, qos, retain, expiry, unit)
+    if _journal is not None:
+        with _journal_lock:
+            # a failing journal is bypassed once the broker is back
+            if not _mqtt_connected or (_journal_replaying and not _journal.failing):
+                _journal.record(topic, payload, qos, retain, expiry, unit)
+                return
+    mqtt_msg_send(topic, payload, qos, retain, expiry, lane, unit)
+
+def mqtt_msg_send(topic, payload, qos, retain, expiry, lane, unit=None):
+    """Hands a sanitised or binary message to the scheduler or the mqtt client."""
+    properties = None
+    if _mqtt_protocol == mqtt.MQTTv5 and (expiry is not None or unit is not None):
+        properties = Properties(PacketTypes.PUBLISH)
+        if expiry is not None:
+            properties.MessageExpiryInterval = expiry
+        if unit is not None:
+            properties.UserProperty = ("unit", unit)
+    if _publish_scheduler is not None:
+        _publish_scheduler.put(lane, topic, payload, qos, retain, properties)
+        if _aio_loop is not None:
+            aio_publish_schedule()
+        return
+    mqtt_client_publish(topic, payload, qos, retain, properties)
+
+def mqtt_client_publish(topic, payload, qos, retain, properties):
+    if _topic_aliases is not None:
+        _topic_aliases.publish(topic, payload, qos, retain, properties)
+    else:
+        _mqttc.publish(topic, payload, qos, retain, properties)
+
+def journal_replay():
+    """Publishes the journal in paced batches after a reconnect."""
+    global _journal_replaying
+
+    if not _mqtt_connected:
+        # disconnected again, on_connect restarts the replay
+        _journal_replaying = False
+        return
+
+    depth = len(_journal)
+    records = _journal.take(JOURNAL_REPLAY_BATCH)
+    for topic, payload, qos, retain, expiry, unit in records:
+        mqtt_msg_send(topic, payload, qos, retain, expiry, pubpolicy.CLASS_LANES[_publish_policy.lookup(topic)[0]], unit)
+
+    with _journal_lock:
+        left = len(_journal)
+        if left and (records or left < depth):
+            SingleShotTimer(JOURNAL_REPLAY_INTERVAL, journal_replay)
+            return
+        _journal_replaying = False
+    if left:
+        # take() made no progress, the next connect tries again
+        LOG(SYSLOG_WRN, "journal replay stopped, " + str(left) + " publishes left: " + str(_journal.last_error))
+    else:
+        LOG(SYSLOG_INF, "journal replay done")
 
-def mqtt_msg_publish_x(topic, payload, qos, retain):
-    global _mqttc
-    """Sends mqtt message to the broker."""
-    LOG(SYSLOG_DBG, "mqtt_msg_publish: " + topic + "<" + payload + ">; qos=" + str(qos) + " retain=" + str(retain))
-    spayload = "".join(filter(lambda x: x in string.printable, str(payload)))
-    _mqttc.publish(str(topic), str(spayload), qos, retain)
+def aio_publish_schedule():
+    global _aio_publish_scheduled
+
+    if not _aio_publish_scheduled:
+        _aio_publish_scheduled = True
+        _aio_loop.call_soon(aio_publish_drain)
+
+def aio_publish_drain():
+    global _aio_publish_scheduled
+
+    # publish what the token bucket allows, come back when the next token is due
+    wait = _publish_scheduler.service()
+    if wait is None:
+        _aio_publish_scheduled = False
+    else:
+        _aio_loop.call_later(wait, aio_publish_drain)
+
+def stats_register(name, provider):
+    """Registers callable returning a dict, published periodically as json."""
+    _stats_providers[name] = provider
+
+def stats_publish():
+    for name, provider in _stats_providers.items():
+        mqtt_msg_publish_x("smarthome/platform/diagnostic/zmqtt/" + name, json.dumps(provider(), sort_keys=True), 0, 0, lane=pubpolicy.LANE_TELEMETRY, clean=True)
 
 def a2s(arr):
     """ Array of integer byte values --> binary string """
     return bytes(arr)
 
-def ser_msg_send(message):
-    """Sends a message to UART."""
-    global _serial_port
+def ser_msg_send(message, coalesce=False, rx=None, retry=False):
+    """Queues a message for the UART writer, never blocks.
+    coalesce: latest-wins actuator command, replaces a queued older value.
+    rx: receive time of the command, defaults to the command being handled.
+    retry: unacknowledged command, dropped if a newer value is queued."""
+    global _aio_tx_handle
+
+    if rx is None:
+        rx = getattr(_command_context, "rx", None)
+    if retry:
+        if not _ser_tx.retry(message, rx):
+            return
+    else:
+        _ser_tx.put(message, rx, coalesce=coalesce)
+    if _aio_loop is not None:
+        # the new frame may be ready before the scheduled wakeup
+        if _aio_tx_handle is not None:
+            _aio_tx_handle.cancel()
+        _aio_tx_handle = _aio_loop.call_soon(aio_ser_tx_next)
+
+def ser_tx_write(message, rx):
+    global _ping_timer_queued, _ping_timer_timeout
+    seq = ser_msg_write(message)
+    command_sent(rx)
+    if _ping_timer_queued and message == PING_MESSAGE:
+        # the reply timeout runs from the write, not from the time the ping was queued
+        _ping_timer_queued = False
+        _ping_timer_timeout = SingleShotTimer(1, ping_timer_timeout_callback, 0, 0, 0)
+    if _command_acks is not None:
+        nid = convert_mac_to_nid(sertx.destination(message))
+        if nid is not None:
+            for outcome in _command_acks.sent(seq, nid, message, rx, time.monotonic()):
+                command_outcome_publish(outcome)
+
+def command_outcome_publish(outcome):
+    if outcome["outcome"] == cmdack.OUTCOME_TIMEOUT:
+        LOG(SYSLOG_WRN, "command " + outcome["command"] + ": " + outcome["outcome"] + " after " + str(outcome["attempts"]) + " attempt(s)")
+    mqtt_msg_publish_x(COMMAND_OUTCOME_TOPIC, json.dumps(outcome, sort_keys=True), 0, 0, lane=pubpolicy.LANE_TELEMETRY, clean=True)
+
+def command_ack_check():
+    """Sends unacknowledged commands again and reports the ones that ran out of retries."""
+    retry, finished = _command_acks.expired(time.monotonic())
+    for message, rx in retry:
+        ser_msg_send(message, rx=rx, retry=True)
+    for outcome in finished:
+        command_outcome_publish(outcome)
+
+def aio_ser_tx_next():
+    global _aio_tx_handle
+
+    _aio_tx_handle = None
+    while True:
+        frame, wait = _ser_tx.take(time.monotonic())
+        if frame is None:
+            break
+        ser_tx_write(*frame)
+    if wait is not None:
+        _aio_tx_handle = _aio_loop.call_later(wait, aio_ser_tx_next)
+
+def ser_msg_write(message):
+    """Writes a message to UART with sequence number and MT framing, returns the sequence number."""
     global _seq_num
-    global _uart_port
     led_on("1")
 #    _serial_port.write(message + "\n\r")
 
-    message_with_mt = append_crc ('%0.2x'% _seq_num + "/" + message )
+    disconnected = False
+    with _ser_tx_lock:
+        seq = _seq_num
+        message_with_mt = append_crc ('%0.2x'% seq + "/" + message )
 
-    try:
-        if _serial_port.isOpen():
-            _serial_port.write(message_with_mt)
-    except serial.SerialException as e:
-        LOG(SYSLOG_WRN, "Serial exception: " + str(e))
-    except TypeError as e:
-        LOG(SYSLOG_WRN, "UART Disconnected: " + str(e))
-        _serial_port.close()
-        _serial_port = serial.Serial(_uart_port, baudrate=uart_baudrate, timeout=15)
+        try:
+            if _serial_port.isOpen():
+                _serial_port.write(message_with_mt)
+        except serial.SerialException as e:
+            LOG(SYSLOG_WRN, "Serial exception: " + str(e))
+        except TypeError as e:
+            LOG(SYSLOG_WRN, "UART Disconnected: " + str(e))
+            disconnected = True
 
-    LOG(SYSLOG_DBG, "send serial message: " + message_with_mt[5:-2].decode('ascii'))
-    led_off("1")
+        _seq_num = (seq + 1) % 256
 
-    _seq_num += 1
-    if (_seq_num == 256):
-        _seq_num = 0
+    if disconnected:
+        # the port is replaced outside _ser_tx_lock, serial_port_apply() takes it
+        serial_port_request("reopen")
 
-    time.sleep(0.5)
+    if SYSLOG_SEVERITY <= SYSLOG_DBG:
+        LOG(SYSLOG_DBG, "send serial message: " + message_with_mt[5:-2].decode('ascii'))
+    led_off("1")
+    return seq
 
 def append_crc(message):
     """calculate crc and append it too message"""
@@ -241,6 +564,61 @@ def append_crc(message):
     #message = "M/" + '%0.2x'% checksum + "/" + message
     return message_full
 
+def serial_port_apply(action, baudrate=None):
+    """Closes and/or opens the UART, only on the reader (or before it runs).
+    Holds _ser_tx_lock, the UART writer never sees a closed or half replaced port."""
+    global _serial_port
+
+    with _ser_tx_lock:
+        if action in ("close", "reopen") and _serial_port.isOpen():
+            if _aio_loop is not None:
+                aio_serial_detach()
+            _serial_port.close()
+        if action in ("open", "reopen") and not _serial_port.isOpen():
+            _serial_port = serial.Serial(_uart_port, baudrate=baudrate or uart_baudrate, timeout=15)
+            _serial_reader.reset()
+    if _aio_loop is not None:
+        aio_serial_attach()
+
+def serial_port_request(action, baudrate=None):
+    """Has the UART reader close and/or open the port, returns False if it did not answer in time."""
+    global _serial_port_request
+    global _serial_port_baudrate
+
+    if _aio_loop is not None or _serial_reader_thread is None or current_thread() is _serial_reader_thread:
+        serial_port_apply(action, baudrate)
+        return True
+
+    with _serial_port_cond:
+        _serial_port_request = action
+        _serial_port_baudrate = baudrate
+        try:
+            # wakes the reader up if it is blocked in read()
+            _serial_port.cancel_read()
+        except (AttributeError, serial.SerialException, OSError):
+            pass
+        _serial_port_cond.notify_all()
+        done = _serial_port_cond.wait_for(lambda: _serial_port_request is None, SERIAL_PORT_REQUEST_TIMEOUT)
+    if not done:
+        LOG(SYSLOG_WRN, "UART reader did not " + action + " the port")
+    return done
+
+def serial_port_serve():
+    """Reader side of serial_port_request(), waits for a request while the port is closed."""
+    global _serial_port_request
+
+    with _serial_port_cond:
+        if _serial_port_request is None and not _serial_port.isOpen():
+            _serial_port_cond.wait(1)
+        if _serial_port_request is None:
+            return
+        try:
+            serial_port_apply(_serial_port_request, _serial_port_baudrate)
+        except serial.SerialException as e:
+            LOG(SYSLOG_WRN, "Serial exception: " + str(e))
+        _serial_port_request = None
+        _serial_port_cond.notify_all()
+
 def sbl_handler (current_version):
     global _serial_port
     global _mqttc
@@ -248,8 +626,7 @@ def sbl_handler (current_version):
     global _image_dir
     global _gw_version_file
 
-    if _serial_port.isOpen():
-        _serial_port.close()
+    serial_port_request("close")
     #_mqttc.disconnect()
 
     if os.path.isfile(_image_dir + '/' + _gw_version_file):
@@ -271,8 +648,7 @@ def sbl_handler (current_version):
                         LOG(SYSLOG_WRN, "Execution of sbl.py failed: " + str(e))
                 else:
                     LOG(SYSLOG_ERR, "GW image file is missing!")
-                if(_serial_port.isOpen() != True):
-                    _serial_port = serial.Serial(_uart_port, baudrate=115200, timeout=15)
+                serial_port_request("open", 115200)
                 #_mqttc.reconnect()
                 reset_zigbee("APP")
                 time.sleep(0.5)
@@ -280,171 +656,60 @@ def sbl_handler (current_version):
         else:
             LOG(SYSLOG_WRN, _gw_version_file + "contains invalid version: " + str(new_version))
 
-    if(_serial_port.isOpen() != True):
-        _serial_port = serial.Serial(_uart_port, baudrate=115200, timeout=15)
+    serial_port_request("open", 115200)
     #_mqttc.reconnect()
 
     return
 
 
-def convert_mac_to_nid(mac):
-    match = re.search("^([0-9A-Fa-f]{1,2}):([0-9A-Fa-f]{1,2}):([0-9A-Fa-f]{1,2}):([0-9A-Fa-f]{1,2}):([0-9A-Fa-f]{1,2}):([0-9A-Fa-f]{1,2}):([0-9A-Fa-f]{1,2}):([0-9A-Fa-f]{1,2})$", mac)
-
-    if match:
-        nid = match.group(1).zfill(2) + \
-              match.group(2).zfill(2) + \
-              match.group(3).zfill(2) + \
-              match.group(4).zfill(2) + \
-              match.group(5).zfill(2) + \
-              match.group(6).zfill(2) + \
-              match.group(7).zfill(2) + \
-              match.group(8).zfill(2)
-    else:
-        nid = None
+_node_id_cache = caches.NodeIdCache(serframe.mac_to_nid, serframe.nid_to_mac)
+stats_register("node_id_cache", _node_id_cache.stats)
 
-    return nid
+def convert_mac_to_nid(mac):
+    return _node_id_cache.mac_to_nid(mac)
 
 def convert_nid_to_mac(nid):
-    match = re.match("^([0-9A-Fa-f]){16}$", nid)
-    if match is None:
-        mac = None
-    else:
-        mac = nid[0].lstrip("0") + nid[1] + ":" + \
-              nid[2].lstrip("0") + nid[3] + ":" + \
-              nid[4].lstrip("0") + nid[5] + ":" + \
-              nid[6].lstrip("0") + nid[7] + ":" + \
-              nid[8].lstrip("0") + nid[9] + ":" + \
-              nid[10].lstrip("0") + nid[11] + ":" + \
-              nid[12].lstrip("0") + nid[13] + ":" + \
-              nid[14].lstrip("0") + nid[15]
-
-    return mac
+    return _node_id_cache.nid_to_mac(nid)
 
 
 def process_serial_message(message_bytes,client):
-    #strip the line
-    message = message_bytes.rstrip().decode('ascii')
-    if message == '':
-        # nothing to do
-        return
-
-    LOG(SYSLOG_DBG, "received serial message: <" + message + ">")
+    if SYSLOG_SEVERITY <= SYSLOG_DBG:
+        LOG(SYSLOG_DBG, "received serial message: <" + message_bytes.rstrip().decode('ascii', 'replace') + ">")
 
-    match = re.search("([^/]+)/([^/]+)/([^/]+)/([^/]+)/([^/]+)", message)
-    if match is None:
-        LOG(SYSLOG_WRN, "invalid serial message: " + message)
+    fields = serframe.split_line(message_bytes)
+    if fields is None:
+        if message_bytes.strip():
+            LOG(SYSLOG_WRN, "invalid serial message: " + message_bytes.rstrip().decode('ascii', 'replace'))
         return
 
-    node_id = match.group(1)
-    mac= node_id
-    msg_group = match.group(2)
-    sensor_id = match.group(3)
-    msg_type = match.group(4)
-    msg_payload = match.group(5)
-    '''
-    print("NODE ID: " + node_id)
-    print("GROUP: " + msg_group)
-    print("SENSOR ID: " + sensor_id)
-    print("TYPE: " + msg_type)
-    print("PAYLOAD: " + msg_payload)
-    '''
-
-    node_id = convert_mac_to_nid(node_id)
+    mac, msg_group, sensor_id, msg_type, msg_payload = fields
+
+    node_id = convert_mac_to_nid(mac)
     if node_id is None:
+        mac = mac.decode('ascii', 'replace')
         LOG(SYSLOG_WRN, "process_serial_message: Invalid node id <" + mac + "> " + str(len(mac)))
         return
 
-    if msg_group == "hw" or msg_group == "gw":
-        # common topics
-        ser_msg_handler_hw(msg_group, node_id, sensor_id, msg_type, msg_payload)
-
-    if msg_group == "bat":
-        # common topics
-        ser_msg_handler_battery(node_id, sensor_id, msg_type, msg_payload)
-
-    elif msg_group == "p":
-        ser_msg_handler_power(node_id, sensor_id, msg_type, msg_payload)
-
-    elif msg_group == "t":
-        ser_msg_handler_temperature(node_id, sensor_id, msg_type, msg_payload)
-
-    elif msg_group == "h":
-        ser_msg_handler_humidity(node_id, sensor_id, msg_type, msg_payload)
-
-    elif msg_group == "m":
-        ser_msg_handler_motion(node_id, sensor_id, msg_type, msg_payload)
-
-    elif msg_group == "f":
-        ser_msg_handler_fall(node_id, sensor_id, msg_type, msg_payload)
-
-    elif msg_group == "co2":
-        ser_msg_handler_co2(node_id, sensor_id, msg_type, msg_payload)
-
-    elif msg_group == "voc":
-        ser_msg_handler_voc(node_id, sensor_id, msg_type, msg_payload)
+    # answers to UART writes pace the writes, readings from other nodes do not count
+    rx_mono = _rx_frame.rx_mono if _rx_frame is not None else time.monotonic()
+    _ser_tx.responded(rx_mono, None if msg_group == "gw" else convert_nid_to_mac(node_id))
 
-    elif msg_group == "pm2_5":
-        ser_msg_handler_pm2_5(node_id, sensor_id, msg_type, msg_payload)
+    if _command_acks is not None:
+        outcome = _command_acks.received(node_id, msg_group, msg_type, msg_payload, rx_mono)
+        if outcome is not None:
+            command_outcome_publish(outcome)
 
-    elif msg_group == "pm10":
-        ser_msg_handler_pm10(node_id, sensor_id, msg_type, msg_payload)
-
-    elif msg_group == "lux":
-        ser_msg_handler_illuminance(node_id, sensor_id, msg_type, msg_payload)
-
-    elif msg_group == "pr":
-        ser_msg_handler_pressure(node_id, sensor_id, msg_type, msg_payload)
-
-    elif msg_group == "blb":
-        ser_msg_handler_bulb(node_id, sensor_id, msg_type, msg_payload)
-
-    elif msg_group == "cblb":
-        ser_msg_handler_colorbulb(node_id, sensor_id, msg_type, msg_payload)
-
-    elif msg_group == "w":
-        ser_msg_handler_water(node_id, sensor_id, msg_type, msg_payload)
-
-    elif msg_group == "d":
-        ser_msg_handler_door(node_id, sensor_id, msg_type, msg_payload)
-
-    elif msg_group == "sm":
-        ser_msg_handler_smoke(node_id, sensor_id, msg_type, msg_payload)
-    return
-
-
-def ser_msg_handler_hw(msg_group, nodeid, sensorid, msgtype, payload):
-    if (msgtype == "MAC"):
-        ser_msg_handler_general_mac(msg_group, nodeid, sensorid, payload)
-    elif (msgtype == "NWK"):
-        ser_msg_handler_general_nwk(msg_group, nodeid, sensorid, payload)
-    elif (msgtype == "lqi"):
-        ser_msg_handler_general_lqi(msg_group, nodeid, sensorid, payload)
-    elif (msgtype == "ieee"):
-        ser_msg_handler_general_ieee(msg_group, nodeid, sensorid, payload)
-    elif (msgtype == "role"):
-        ser_msg_handler_general_role(msg_group, nodeid, sensorid, payload)
-    elif (msgtype == "rev"):
-        ser_msg_handler_general_revision(msg_group, nodeid, sensorid, payload)
-    elif (msgtype == "ser"):
-        ser_msg_handler_general_serial(msg_group, nodeid, sensorid, payload)
-    elif (msgtype == "bt"):
-        ser_msg_handler_general_button(msg_group, nodeid, sensorid, payload)
-    elif (msgtype == "sw"):
-        ser_msg_handler_general_version(msg_group, nodeid, sensorid, payload)
-    elif (msgtype == "crc"):
-        ser_msg_handler_general_crc(msg_group, nodeid, sensorid, payload)
-    elif (msgtype == "chn"):
-        ser_msg_handler_general_channel(msg_group, nodeid, sensorid, payload)
-    elif (msgtype == "ping"):
-        ser_msg_handler_general_ping(msg_group, nodeid, sensorid, payload)
-    elif (msgtype == "nv_mem"):
-        ser_msg_handler_general_nv_mem(msg_group, nodeid, sensorid, payload)
-    elif (msgtype == "heap"):
-        ser_msg_handler_general_heap(msg_group, nodeid, sensorid, payload)
-    else:
-        LOG(SYSLOG_WRN, "unknown general message: " + msgtype)
+    handler = SER_MSG_DISPATCH.get((msg_group, msg_type))
+    if handler is None:
+        key = msg_group + "/" + msg_type
+        count = _ser_msg_unknown.get(key, 0) + 1
+        _ser_msg_unknown[key] = count
+        # warn once per key, the serial_unknown stats keep counting
+        LOG(SYSLOG_WRN if count == 1 else SYSLOG_DBG, "unknown serial message: " + key)
         return
 
+    handler(node_id, sensor_id, msg_payload)
+
 
 def ser_msg_handler_general_mac(msg_group, nodeid, sensorid, payload):
     global _coord_nid
@@ -453,6 +718,9 @@ def ser_msg_handler_general_mac(msg_group, nodeid, sensorid, payload):
     if mac is None:
         LOG(SYSLOG_WRN, "ser_msg_handler_general_mac: failed to convert mac address, use received value")
         mac = payload
+    else:
+        # node announced itself, lookups in both directions are cached from now on
+        _node_id_cache.add(mac, payload)
     if msg_group == "hw":
         topic = "smarthome/node/" + nodeid + "/hw/zigbee/MAC"
 
@@ -533,10 +801,9 @@ def ser_msg_handler_general_revision(msg_group, nodeid, sensorid, payload):
         topic = "smarthome/node/" + nodeid + "/hw/revision"
         mqtt_msg_publish(topic, payload)
         if "RGB" in payload:
-            ser_msg_handler_colorbulb_status(nodeid, "0006", "1")
-            ser_msg_handler_colorbulb_level(nodeid, "0006", "75")
-            ser_msg_handler_colorbulb_hue(nodeid, "0006", "48")
-            ser_msg_handler_colorbulb_saturation(nodeid, "0006", "91")
+            # initial colorbulb state
+            for msgtype, value in (("st", "1"), ("lv", "75"), ("hue", "48"), ("sat", "91")):
+                ser_msg_handler_sensor(sensors.SENSOR_TYPES[("cblb", msgtype)], nodeid, "0006", value)
 
     elif msg_group == "gw":
         topic = "smarthome/gateway/" + nodeid + "/hw/revision"
@@ -554,7 +821,7 @@ def ser_msg_handler_general_revision(msg_group, nodeid, sensorid, payload):
 
 
 def ser_msg_handler_general_serial(msg_group, nodeid, sensorid, payload):
-    payload = "".join(filter(lambda x: x in string.printable, payload))
+    payload = pubfilter.printable(payload)
 
     if msg_group == "hw":
         topic = "smarthome/node/" + nodeid + "/hw/serial"
@@ -622,16 +889,6 @@ def ser_msg_handler_general_heap(msg_group, nodeid, sensorid, payload):
     mqtt_msg_publish("smarthome/platform/diagnostic/heap", payload)
 
 
-def ser_msg_handler_battery(nodeid, sensorid, msgtype, payload):
-    if (msgtype == "v"):
-        ser_msg_handler_battery_voltage(nodeid, sensorid, payload)
-    elif (msgtype == "est"):
-        ser_msg_handler_battery_estimate(nodeid, sensorid, payload)
-    else:
-        LOG(SYSLOG_ERR, "ser_msg_handler_battery: unknown battery message <" + msgtype + ">")
-        return
-
-
 def ser_msg_handler_battery_voltage(nodeid, sensorid, payload):
     topic = "smarthome/node/" + nodeid + "/battery/voltage"
     voltage = str(float(payload)/100)
@@ -655,665 +912,96 @@ def ser_msg_handler_battery_estimate(nodeid, sensorid, payload):
     mqtt_msg_publish(topic, "3")
 
 
-def ser_msg_handler_power(nodeid, sensorid, msgtype, payload):
-    if (msgtype == "st"):
-        ser_msg_handler_power_status(nodeid, sensorid, payload)
+_topic_cache = caches.TopicCache()
+stats_register("topic_cache", _topic_cache.stats)
 
-    elif (msgtype == "p"):
-        ser_msg_handler_power_power(nodeid, sensorid, payload)
-
-    elif (msgtype == "e"):
-        ser_msg_handler_power_energy(nodeid, sensorid, payload)
-    else:
-        LOG(SYSLOG_WRN, "unknown power message: " + msgtype)
-        return
-
-
-def ser_msg_handler_power_status(nodeid, sensorid, payload):
-    if payload == "0":
-        value = "false"
-    elif payload == "1":
-        value = "true"
-    else:
-        LOG(SYSLOG_ERR, "ser_msg_handler_power_status: invalid payload <" + payload.decode('utf-8') + ">")
-        return
-
-    timestamp = time.strftime("%d.%m.%Y %H:%M:%S")
-    topic = "smarthome/node/" + nodeid + "/sensor/power/" + sensorid + "/value/status"
-    mqtt_msg_publish(topic.replace("value", "timestamp"), timestamp)
-    mqtt_msg_publish(topic, value)
+# unit topics are retained and constant, publish them once per broker session
+_metadata = pubfilter.MetadataTracker()
+stats_register("metadata", _metadata.stats)
 
+# optional change-only publishing (--deadband)
+_report_filter = None
 
-def ser_msg_handler_power_power(nodeid, sensorid, payload):
-    topic = "smarthome/node/" + nodeid + "/sensor/power/" + sensorid + "/value/power"
-    unit = "W"
+# optional consolidated smarthome/node/<nid>/state documents (--state)
+_node_state = None
+# per-reading topics, can be turned off once consumers moved to state (--state-only)
+_legacy_topics = True
+# optional binary readings on smarthome/bin/... (--binary)
+_binary_encoder = None
 
-    power = str(float(payload)/100)
-    timestamp = time.strftime("%d.%m.%Y %H:%M:%S")
-    mqtt_msg_publish(topic.replace("value", "timestamp"), timestamp)
-    mqtt_msg_publish(topic.replace("value", "unit"), unit)
-    mqtt_msg_publish(topic, power)
+def node_state_flush():
+    for nodeid, doc in _node_state.take_dirty():
+        mqtt_msg_publish("smarthome/node/" + nodeid + "/state", doc, clean=True)
 
-
-def ser_msg_handler_power_energy(nodeid, sensorid, payload):
-    topic = "smarthome/node/" + nodeid + "/sensor/power/" + sensorid + "/value/energy"
-    unit = "kWh"
-    #energy = str(float(payload) / 100000)
-    energy = str("{0:.10f}".format(float(payload) / 100000))
-
-    timestamp = time.strftime("%d.%m.%Y %H:%M:%S")
-    mqtt_msg_publish(topic.replace("value", "timestamp"), timestamp)
-    mqtt_msg_publish(topic.replace("value", "unit"), unit)
-    mqtt_msg_publish(topic, energy)
-
-
-
-def ser_msg_handler_temperature(nodeid, sensorid, msgtype, payload):
-    if msgtype == "act":
-        ser_msg_handler_temperature_actual(nodeid, sensorid, payload)
-    else:
-        LOG(SYSLOG_WRN, "unknown temperature message: " + msgtype)
+def ser_msg_handler_sensor(stype, nodeid, sensorid, payload):
+    """Publishes a reading described by sensors.SENSOR_TYPES."""
+    value = stype.convert(payload)
+    if value is None:
+        LOG(SYSLOG_ERR, "ser_msg_handler_sensor: invalid " + stype.segment + "/" + stype.attr + " payload <" + payload + ">")
         return
 
+    if _hsv_merge is not None and stype.segment == "colorbulb":
+        _hsv_merge.report(convert_nid_to_mac(nodeid), stype.attr, value)
 
-def ser_msg_handler_temperature_actual(nodeid, sensorid, payload):
-    topic = "smarthome/node/" + nodeid + "/sensor/temperature/" + sensorid + "/value/actual"
-    unit = "oC"
-    actual = str(float(payload) / 100)
-    timestamp = time.strftime("%d.%m.%Y %H:%M:%S")
-    mqtt_msg_publish(topic.replace("value", "timestamp"), timestamp)
-    mqtt_msg_publish(topic.replace("value/actual", "unit"), unit)
-    mqtt_msg_publish(topic, actual)
-
-
-def ser_msg_handler_humidity(nodeid, sensorid, msgtype, payload):
-    if msgtype == "act":
-        ser_msg_handler_humidity_value(nodeid, sensorid, payload)
-    else:
-        LOG(SYSLOG_WRN, "unknown humidity message: " + msgtype)
-
-
-def ser_msg_handler_humidity_value(nodeid, sensorid, payload):
-    topic = "smarthome/node/" + nodeid + "/sensor/humidity/" + sensorid + "/value/actual"
-    unit = "%"
-    actual = str(float(payload) / 100)
-    timestamp = time.strftime("%d.%m.%Y %H:%M:%S")
-    mqtt_msg_publish(topic.replace("value", "timestamp"), timestamp)
-    mqtt_msg_publish(topic.replace("value/actual", "unit"), unit)
-    mqtt_msg_publish(topic, actual)
-
-
-def ser_msg_handler_motion(nodeid, sensorid, msgtype, payload):
-    if msgtype == "st":
-        ser_msg_handler_motion_status(nodeid, sensorid, payload)
-    else:
-        LOG(SYSLOG_WRN, "unknown motion message: " + msgtype)
-        return
-
-
-def ser_msg_handler_motion_status(nodeid, sensorid, payload):
-    if payload == "0":
-        value = "IDLE"
-#        value = "false"
-    elif payload == "1":
-#        value = "true"
-        value = "ACTIVE"
-    else:
-        LOG(SYSLOG_ERR, "ser_msg_handler_motion_status: invalid payload <" + payload + ">")
-        return
-
-    topic = "smarthome/node/" + nodeid + "/sensor/motion/" + sensorid + "/value/status"
-    timestamp = time.strftime("%d.%m.%Y %H:%M:%S")
-    mqtt_msg_publish(topic.replace("value", "timestamp"), timestamp)
-    mqtt_msg_publish(topic, value)
-
-
-def ser_msg_handler_fall(nodeid, sensorid, msgtype, payload):
-    if msgtype == "st":
-        ser_msg_handler_fall_status(nodeid, sensorid, payload)
-    else:
-        LOG(SYSLOG_WRN, "unknown fall message: " + msgtype)
-        return
-
-
-def ser_msg_handler_fall_status(nodeid, sensorid, payload):
-    if payload == "0":
-        value = "OK"
-    elif payload == "1":
-        value = "FALL"
-    elif payload == "2":
-        value = "PANIC"
-    else:
-        LOG(SYSLOG_ERR, "ser_msg_handler_fall_status: invalid payload <" + payload + ">")
+    topic, timestamp_topic, unit_topic, rxtime_topic = _topic_cache.get(nodeid, stype, sensorid)
+    if _report_filter is not None and not _report_filter.accept(stype, topic, value):
         return
 
-    topic = "smarthome/node/" + nodeid + "/sensor/fall/" + sensorid + "/value/status"
-    timestamp = time.strftime("%d.%m.%Y %H:%M:%S")
-    mqtt_msg_publish(topic.replace("value", "timestamp"), timestamp)
-    mqtt_msg_publish(topic, value)
+    rx_ms = _rx_frame.rx_ms if _rx_frame is not None else int(time.time() * 1000)
 
-def ser_msg_handler_co2(nodeid, sensorid, msgtype, payload):
-    if msgtype == "act":
-        ser_msg_handler_co2_actual(nodeid, sensorid, payload)
-    else:
-        LOG(SYSLOG_WRN, "unknown fall message: " + msgtype)
-        return
+    if _binary_encoder is not None:
+        mqtt_msg_publish_raw(_binary_encoder.topic(topic), _binary_encoder.encode(nodeid, value, stype.unit, rx_ms), topic)
 
-def ser_msg_handler_co2_actual(nodeid, sensorid, payload):
-    topic = "smarthome/node/" + nodeid + "/sensor/co2/" + sensorid + "/value/actual"
-    unit = "ppm"
-    actual = str(payload)
-    timestamp = time.strftime("%d.%m.%Y %H:%M:%S")
-    mqtt_msg_publish(topic.replace("value", "timestamp"), timestamp)
-    mqtt_msg_publish(topic.replace("value/actual", "unit"), unit)
-    mqtt_msg_publish(topic, actual)
+    if _node_state is not None:
+        if _node_state.update(nodeid, stype.segment, stype.sensorid or sensorid, stype.attr, value, stype.unit, rx_ms):
+            SingleShotTimer(_node_state.window, node_state_flush)
+        if not _legacy_topics:
+            return
 
+    # formatted by the gateway, no need to filter it (the value only if convert() built it)
+    mqtt_msg_publish(timestamp_topic, _clock.format(rx_ms // 1000), clean=True)
+    if _rx_timestamp_topics:
+        mqtt_msg_publish(rxtime_topic, str(rx_ms), clean=True)
+    if unit_topic is not None and _metadata.should_publish(unit_topic, stype.unit):
+        mqtt_msg_publish(unit_topic, stype.unit, clean=True)
+    mqtt_msg_publish(topic, value, stype.unit, clean=stype.clean)
 
 
-def ser_msg_handler_voc(nodeid, sensorid, msgtype, payload):
-    if msgtype == "act":
-        ser_msg_handler_voc_actual(nodeid, sensorid, payload)
-    else:
-        LOG(SYSLOG_WRN, "unknown voc message: " + msgtype)
-        return
-
-def ser_msg_handler_voc_actual(nodeid, sensorid, payload):
-    topic = "smarthome/node/" + nodeid + "/sensor/voc/" + sensorid + "/value/actual"
-    unit = "ppb"
-    actual = str(payload)
-    timestamp = time.strftime("%d.%m.%Y %H:%M:%S")
-    mqtt_msg_publish(topic.replace("value", "timestamp"), timestamp)
-    mqtt_msg_publish(topic.replace("value/actual", "unit"), unit)
-    mqtt_msg_publish(topic, actual)
-
-
-def ser_msg_handler_pm2_5(nodeid, sensorid, msgtype, payload):
-    if msgtype == "act":
-        ser_msg_handler_pm2_5_actual(nodeid, sensorid, payload)
-    else:
-        LOG(SYSLOG_WRN, "unknown pm2.5 message: " + msgtype)
-        return
+# (group, type) -> handler(nodeid, sensorid, payload)
+SER_MSG_DISPATCH = {
+    ("bat", "v"): ser_msg_handler_battery_voltage,
+    ("bat", "est"): ser_msg_handler_battery_estimate,
+}
 
+# plain sensor readings are data driven
+for _key, _stype in sensors.SENSOR_TYPES.items():
+    SER_MSG_DISPATCH[_key] = functools.partial(ser_msg_handler_sensor, _stype)
 
-def ser_msg_handler_pm2_5_actual(nodeid, sensorid, payload):
-    topic = "smarthome/node/" + nodeid + "/sensor/pm2_5/" + sensorid + "/value/actual"
-    unit = "ugm3"
-    actual = str(payload)
-    timestamp = time.strftime("%d.%m.%Y %H:%M:%S")
-    mqtt_msg_publish(topic.replace("value", "timestamp"), timestamp)
-    mqtt_msg_publish(topic.replace("value/actual", "unit"), unit)
-    mqtt_msg_publish(topic, actual)
+# general messages are the same for nodes (hw) and the gateway (gw)
+for _group in ("hw", "gw"):
+    for _type, _handler in (("MAC", ser_msg_handler_general_mac),
+                            ("NWK", ser_msg_handler_general_nwk),
+                            ("lqi", ser_msg_handler_general_lqi),
+                            ("ieee", ser_msg_handler_general_ieee),
+                            ("role", ser_msg_handler_general_role),
+                            ("rev", ser_msg_handler_general_revision),
+                            ("ser", ser_msg_handler_general_serial),
+                            ("bt", ser_msg_handler_general_button),
+                            ("sw", ser_msg_handler_general_version),
+                            ("crc", ser_msg_handler_general_crc),
+                            ("chn", ser_msg_handler_general_channel),
+                            ("ping", ser_msg_handler_general_ping),
+                            ("nv_mem", ser_msg_handler_general_nv_mem),
+                            ("heap", ser_msg_handler_general_heap)):
+        SER_MSG_DISPATCH[(_group, _type)] = functools.partial(_handler, _group)
 
-
-def ser_msg_handler_pm10(nodeid, sensorid, msgtype, payload):
-    if msgtype == "act":
-        ser_msg_handler_pm10_actual(nodeid, sensorid, payload)
-    else:
-        LOG(SYSLOG_WRN, "unknown pm10 message: " + msgtype)
-        return
-
-
-def ser_msg_handler_pm10_actual(nodeid, sensorid, payload):
-    topic = "smarthome/node/" + nodeid + "/sensor/pm10/" + sensorid + "/value/actual"
-    unit = "ugm3"
-    actual = str(payload)
-    timestamp = time.strftime("%d.%m.%Y %H:%M:%S")
-    mqtt_msg_publish(topic.replace("value", "timestamp"), timestamp)
-    mqtt_msg_publish(topic.replace("value/actual", "unit"), unit)
-    mqtt_msg_publish(topic, actual)
-
-
-def ser_msg_handler_illuminance(nodeid, sensorid, msgtype, payload):
-    if msgtype == "act":
-        ser_msg_handler_illuminance_actual(nodeid, sensorid, payload)
-    else:
-        LOG(SYSLOG_WRN, "unknown illuminance message: " + msgtype)
-        return
-
-
-def ser_msg_handler_illuminance_actual(nodeid, sensorid, payload):
-    topic = "smarthome/node/" + nodeid + "/sensor/illuminance/" + sensorid + "/value/actual"
-    unit = "lux"
-    actual = str(payload)
-    timestamp = time.strftime("%d.%m.%Y %H:%M:%S")
-    mqtt_msg_publish(topic.replace("value", "timestamp"), timestamp)
-    mqtt_msg_publish(topic.replace("value/actual", "unit"), unit)
-    mqtt_msg_publish(topic, actual)
-
-
-def ser_msg_handler_pressure(nodeid, sensorid, msgtype, payload):
-    if msgtype == "act":
-        ser_msg_handler_pressure_actual(nodeid, sensorid, payload)
-    else:
-        LOG(SYSLOG_WRN, "unknown pressure message: " + msgtype)
-        return
-
-
-def ser_msg_handler_pressure_actual(nodeid, sensorid, payload):
-    topic = "smarthome/node/" + nodeid + "/sensor/pressure/" + sensorid + "/value/actual"
-    unit = "hPa"
-    actual = str(float(payload) / 10)
-    timestamp = time.strftime("%d.%m.%Y %H:%M:%S")
-    mqtt_msg_publish(topic.replace("value", "timestamp"), timestamp)
-    mqtt_msg_publish(topic.replace("value/actual", "unit"), unit)
-    mqtt_msg_publish(topic, actual)
-
-
-def ser_msg_handler_bulb(nodeid, sensorid, msgtype, payload):
-    if (msgtype == "st"):
-        ser_msg_handler_bulb_status(nodeid, sensorid, payload)
-    elif (msgtype == "lv"):
-        ser_msg_handler_bulb_level(nodeid, sensorid, payload)  
-    else:
-        LOG(SYSLOG_WRN, "unknown bulb message: " + msgtype)
-        return
-
-def ser_msg_handler_bulb_status(nodeid, sensorid, payload):
-    if payload == "0":
-        value = "false"
-    elif payload == "1":
-        value = "true"
-    else:
-        LOG(SYSLOG_ERR, "ser_msg_handler_bulb_status: invalid payload <" + payload + ">")
-        return
-
-    timestamp = time.strftime("%d.%m.%Y %H:%M:%S")
-    topic = "smarthome/node/" + nodeid + "/sensor/bulb/" + sensorid + "/value/switch"
-    mqtt_msg_publish(topic.replace("value", "timestamp"), timestamp)
-    mqtt_msg_publish(topic, value)
-
-def ser_msg_handler_bulb_level(nodeid, sensorid, payload):
-    if int(payload) >= 0 and int(payload) <= 100:
-        timestamp = time.strftime("%d.%m.%Y %H:%M:%S")
-        topic = "smarthome/node/" + nodeid + "/sensor/bulb/" + sensorid + "/value/level"
-        mqtt_msg_publish(topic.replace("value", "timestamp"), timestamp)
-        mqtt_msg_publish(topic, payload)
-    else:
-        LOG(SYSLOG_ERR, "ser_msg_handler_bulb_level: invalid payload <" + payload + ">")
-        return
-
-def ser_msg_handler_colorbulb(nodeid, sensorid, msgtype, payload):
-    if (msgtype == "st"):
-        ser_msg_handler_colorbulb_status(nodeid, sensorid, payload)
-    elif (msgtype == "lv"):
-        ser_msg_handler_colorbulb_level(nodeid, sensorid, payload)
-    elif (msgtype == "hue"):
-        ser_msg_handler_colorbulb_hue(nodeid, sensorid, payload)
-    elif (msgtype == "sat"):
-        ser_msg_handler_colorbulb_saturation(nodeid, sensorid, payload)
-    else:
-        LOG(SYSLOG_WRN, "unknown bulb message: " + msgtype)
-        return
-
-def ser_msg_handler_colorbulb_status(nodeid, sensorid, payload):
-    if payload == "0":
-        value = "false"
-    elif payload == "1":
-        value = "true"
-    else:
-        LOG(SYSLOG_ERR, "ser_msg_handler_colorbulb_status: invalid payload <" + payload + ">")
-        return
-
-    timestamp = time.strftime("%d.%m.%Y %H:%M:%S")
-    topic = "smarthome/node/" + nodeid + "/sensor/colorbulb/" + sensorid + "/value/switch"
-    mqtt_msg_publish(topic.replace("value", "timestamp"), timestamp)
-    mqtt_msg_publish(topic, value)
-
-def ser_msg_handler_colorbulb_level(nodeid, sensorid, payload):
-    if int(payload) >= 0 and int(payload) <= 100:
-        timestamp = time.strftime("%d.%m.%Y %H:%M:%S")
-        topic = "smarthome/node/" + nodeid + "/sensor/colorbulb/" + sensorid + "/value/level"
-        mqtt_msg_publish(topic.replace("value", "timestamp"), timestamp)
-        mqtt_msg_publish(topic, payload)
-    else:
-        LOG(SYSLOG_ERR, "ser_msg_handler_colorbulb_level: invalid payload <" + payload + ">")
-        return
-
-def ser_msg_handler_colorbulb_hue(nodeid, sensorid, payload):
-    if int(payload) >= 0 and int(payload) <= 360:
-        timestamp = time.strftime("%d.%m.%Y %H:%M:%S")
-        topic = "smarthome/node/" + nodeid + "/sensor/colorbulb/" + sensorid + "/value/hue"
-        mqtt_msg_publish(topic.replace("value", "timestamp"), timestamp)
-        mqtt_msg_publish(topic, payload)
-    else:
-        LOG(SYSLOG_ERR, "ser_msg_handler_colorbulb_hue: invalid payload <" + payload + ">")
-        return
-
-def ser_msg_handler_colorbulb_saturation(nodeid, sensorid, payload):
-    if int(payload) >= 0 and int(payload) <= 100:
-        timestamp = time.strftime("%d.%m.%Y %H:%M:%S")
-        topic = "smarthome/node/" + nodeid + "/sensor/colorbulb/" + sensorid + "/value/saturation"
-        mqtt_msg_publish(topic.replace("value", "timestamp"), timestamp)
-        mqtt_msg_publish(topic, payload)
-    else:
-        LOG(SYSLOG_ERR, "ser_msg_handler_colorbulb_saturation: invalid payload <" + payload + ">")
-        return
-
-def ser_msg_handler_water(nodeid, sensorid, msgtype, payload):
-    if (msgtype == "st"):
-        ser_msg_handler_water_status(nodeid, sensorid, payload)
-    else:
-        LOG(SYSLOG_WRN, "unknown bulb message: " + msgtype)
-        return
-
-def ser_msg_handler_water_status(nodeid, sensorid, payload):
-
-    if payload == "0":
-      value = "false"
-    elif payload == "1":
-      value = "true"
-    else:
-        LOG(SYSLOG_ERR, "ser_msg_handler_water_status: invalid payload <" + payload + ">")
-        return
-
-    topic = "smarthome/node/" + nodeid + "/sensor/water/1031/value/status"
-    timestamp = time.strftime("%d.%m.%Y %H:%M:%S")
-    mqtt_msg_publish(topic.replace("value", "timestamp"), timestamp)
-    mqtt_msg_publish(topic, value)
-
-def ser_msg_handler_door(nodeid, sensorid, msgtype, payload):
-    if (msgtype == "st"):
-        ser_msg_handler_door_status(nodeid, sensorid, payload)
-    else:
-        LOG(SYSLOG_WRN, "unknown bulb message: " + msgtype)
-        return
-
-def ser_msg_handler_door_status(nodeid, sensorid, payload):
-
-    if payload == "0":
-      value = "false"
-    elif payload == "1":
-      value = "true"
-    else:
-        LOG(SYSLOG_ERR, "ser_msg_handler_door_status: invalid payload <" + payload + ">")
-        return
-
-    topic = "smarthome/node/" + nodeid + "/sensor/door/1032/value/status"
-    timestamp = time.strftime("%d.%m.%Y %H:%M:%S")
-    mqtt_msg_publish(topic.replace("value", "timestamp"), timestamp)
-    mqtt_msg_publish(topic, value)
-
-def ser_msg_handler_smoke(nodeid, sensorid, msgtype, payload):
-    if (msgtype == "st"):
-        ser_msg_handler_smoke_status(nodeid, sensorid, payload)
-    else:
-        LOG(SYSLOG_WRN, "unknown bulb message: " + msgtype)
-        return
-
-def ser_msg_handler_smoke_status(nodeid, sensorid, payload):
-
-    if payload == "0":
-      value = "false"
-    elif payload == "1":
-      value = "true"
-    else:
-        LOG(SYSLOG_ERR, "ser_msg_handler_smoke_status: invalid payload <" + payload + ">")
-        return
-
-    topic = "smarthome/node/" + nodeid + "/sensor/smoke/1033/value/status"
-    timestamp = time.strftime("%d.%m.%Y %H:%M:%S")
-    mqtt_msg_publish(topic.replace("value", "timestamp"), timestamp)
-    mqtt_msg_publish(topic, value)
+stats_register("serial_unknown", lambda: dict(_ser_msg_unknown))
+stats_register("publish_policy", lambda: _publish_policy.stats())
 
 
 def process_mqtt_message(msg):
-    # 1 node level messages
-    # smarthome/node/[node_id]/hw/zigbee/service
-    match = re.search("^smarthome/node/([0-9A-Fa-f]{16})/hw/zigbee/service", msg.topic)
-    if match:
-        mac = convert_nid_to_mac(match.group(1))
-        mqtt_msg_handler_hw_service(mac, msg.payload)
-        return
-
-    # smarthome/node/[node_id]/hw/led/[led_id]
-    match = re.search("^smarthome/node/([0-9A-Fa-f]{16})/hw/led/([^/]+)", msg.topic)
-    if match:
-        mac = convert_nid_to_mac(match.group(1))
-        mqtt_msg_handler_hw_led(mac, match.group(2), msg.payload)
-        return
-
-    # 2 sensor level messages
-    # 2-1 power messages 
-    # smarthome/node/[node_id]/sensor/power/[sensor_id]/switch/status
-    # smarthome/node/[node_id]/sensor/power/[sensor_id]/set/switch
-    match = re.search("^smarthome/node/([0-9A-Fa-f]{16})/sensor/power/([^/]+)/switch/status", msg.topic)
-    if match:
-        mac = convert_nid_to_mac(match.group(1))
-        mqtt_msg_handler_sensor_pwr_switch(mac, match.group(2), msg.payload)
-        return
-    match = re.search("^smarthome/node/([0-9A-Fa-f]{16})/sensor/power/([^/]+)/set/switch", msg.topic)
-    if match:
-        mac = convert_nid_to_mac(match.group(1))
-        mqtt_msg_handler_sensor_pwr_switch(mac, match.group(2), msg.payload)
-        return
-
-    # smarthome/node/[node_id]/sensor/power/[sensor_id]/sleep
-    match = re.search("^smarthome/node/([0-9A-Fa-f]{16})/sensor/power/([^/]+)/sleep", msg.topic)
-    if match:
-        mac = convert_nid_to_mac(match.group(1))
-        mqtt_msg_handler_sensor_pwr_sleep(mac, match.group(2), msg.payload)
-        return
-
-    # smarthome/node/[node_id]/sensor/power/[sensor_id]/reset/energy
-    match = re.search("^smarthome/node/([0-9A-Fa-f]{16})/sensor/power/([^/]+)/reset/energy", msg.topic)
-    if match:
-        mac = convert_nid_to_mac(match.group(1))
-        mqtt_msg_handler_sensor_pwr_reset(mac, match.group(2), msg.payload)
-        return
-
-    # 2-2 temperature messages
-    # smarthome/node/[node_id]/sensor/temperature/[sensor_id]/sleep
-    match = re.search("^smarthome/node/([0-9A-Fa-f]{16})/sensor/temperature/([^/]+)/sleep", msg.topic)
-    if match:
-        mac = convert_nid_to_mac(match.group(1))
-        mqtt_msg_handler_sensor_temp_sleep(mac, match.group(2), msg.payload)
-        return
-
-    # 2-3 humidity messages
-    # smarthome/node/[node_id]/sensor/humidity/[sensor_id]/sleep
-    match = re.search("^smarthome/node/([0-9A-Fa-f]{16})/sensor/humidity/([^/]+)/sleep", msg.topic)
-    if match:
-        mac = convert_nid_to_mac(match.group(1))
-        mqtt_msg_handler_sensor_humidity_sleep(mac, match.group(2), msg.payload)
-        return 
-
-    # 2-4 motion messages
-    # smarthome/node/[node_id]/sensor/motion/[sensor_id]/arm
-    match = re.search("^smarthome/node/([0-9A-Fa-f]{16})/sensor/motion/([^/]+)/arm", msg.topic)
-    if match:
-        mac = convert_nid_to_mac(match.group(1))
-        mqtt_msg_handler_sensor_motion_arm(mac, match.group(2), msg.payload)
-        return
-
-    # smarthome/node/[node_id]/sensor/motion/[sensor_id]/sleep
-    match = re.search("^smarthome/node/([0-9A-Fa-f]{16})/sensor/motion/([^/]+)/sleep", msg.topic)
-    if match:
-        mac = convert_nid_to_mac(match.group(1))
-        mqtt_msg_handler_sensor_motion_sleep(mac, match.group(2), msg.payload)
-        return
-
-    # 2-5 fall messages
-    # smarthome/node/[node_id]/sensor/fall/[sensor_id]/arm
-    match = re.search("^smarthome/node/([0-9A-Fa-f]{16})/sensor/fall/([^/]+)/arm", msg.topic)
-    if match:
-        mac = convert_nid_to_mac(match.group(1))
-        mqtt_msg_handler_sensor_fall_arm(mac, match.group(2), msg.payload)
-        return
-
-    # smarthome/node/[node_id]/sensor/fall/[sensor_id]/keepalive
-    match = re.search("^smarthome/node/([0-9A-Fa-f]{16})/sensor/fall/([^/]+)/keepalive", msg.topic)
-    if match:
-        mac = convert_nid_to_mac(match.group(1))
-        mqtt_msg_handler_sensor_fall_keepalive(mac, match.group(2), msg.payload)
-        return
-
-    # smarthome/node/[node_id]/sensor/co2/[sensor_id]/sleep
-    match = re.search("^smarthome/node/([0-9A-Fa-f]{16})/sensor/co2/([^/]+)/sleep", msg.topic)
-    if match:
-        mac = convert_nid_to_mac(match.group(1))
-        mqtt_msg_handler_sensor_co2_sleep(mac, match.group(2), msg.payload)
-        return
-
-    # smarthome/node/[node_id]/sensor/voc/[sensor_id]/sleep
-    match = re.search("^smarthome/node/([0-9A-Fa-f]{16})/sensor/voc/([^/]+)/sleep", msg.topic)
-    if match:
-        mac = convert_nid_to_mac(match.group(1))
-        mqtt_msg_handler_sensor_voc_sleep(mac, match.group(2), msg.payload)
-        return
-
-    # smarthome/node/[node_id]/sensor/pm2_5/[sensor_id]/sleep
-    match = re.search("^smarthome/node/([0-9A-Fa-f]{16})/sensor/pm2_5/([^/]+)/sleep", msg.topic)
-    if match:
-        mac = convert_nid_to_mac(match.group(1))
-        mqtt_msg_handler_sensor_pm2_5_sleep(mac, match.group(2), msg.payload)
-        return
-
-    # smarthome/node/[node_id]/sensor/pm10/[sensor_id]/sleep
-    match = re.search("^smarthome/node/([0-9A-Fa-f]{16})/sensor/pm10/([^/]+)/sleep", msg.topic)
-    if match:
-        mac = convert_nid_to_mac(match.group(1))
-        mqtt_msg_handler_sensor_pm10_sleep(mac, match.group(2), msg.payload)
-        return
-
-    # smarthome/node/[node_id]/sensor/illuminance/[sensor_id]/sleep
-    match = re.search("^smarthome/node/([0-9A-Fa-f]{16})/sensor/illuminance/([^/]+)/sleep", msg.topic)
-    if match:
-        mac = convert_nid_to_mac(match.group(1))
-        mqtt_msg_handler_sensor_illuminance_sleep(mac, match.group(2), msg.payload)
-        return
-
-    # smarthome/node/[node_id]/sensor/pressure/[sensor_id]/sleep
-    match = re.search("^smarthome/node/([0-9A-Fa-f]{16})/sensor/pressure/([^/]+)/sleep", msg.topic)
-    if match:
-        mac = convert_nid_to_mac(match.group(1))
-        mqtt_msg_handler_sensor_pressure_sleep(mac, match.group(2), msg.payload)
-        return
-
-    # smarthome/node/[node_id]/sensor/bulb/[sensor_id]/set/switch
-    match = re.search("^smarthome/node/([0-9A-Fa-f]{16})/sensor/bulb/([^/]+)/set/switch", msg.topic)
-    if match:
-        mac = convert_nid_to_mac(match.group(1))
-        mqtt_msg_handler_sensor_bulb_switch(mac, match.group(2), msg.payload)
-        return
-
-    # smarthome/node/[node_id]/sensor/bulb/[sensor_id]/set/level
-    match = re.search("^smarthome/node/([0-9A-Fa-f]{16})/sensor/bulb/([^/]+)/set/level", msg.topic)
-    if match:
-        mac = convert_nid_to_mac(match.group(1))
-        mqtt_msg_handler_sensor_bulb_level(mac, match.group(2), msg.payload)
-        return
-
-    # smarthome/node/[node_id]/sensor/bulb/[sensor_id]/query
-    match = re.search("^smarthome/node/([0-9A-Fa-f]{16})/sensor/bulb/([^/]+)/query", msg.topic)
-    if match:
-        mac = convert_nid_to_mac(match.group(1))
-        mqtt_msg_handler_sensor_bulb_query(mac, match.group(2), msg.payload)
-        return
-
-    # smarthome/node/[node_id]/sensor/colorbulb/[sensor_id]/set/switch
-    match = re.search("^smarthome/node/([0-9A-Fa-f]{16})/sensor/colorbulb/([^/]+)/set/switch", msg.topic)
-    if match:
-        mac = convert_nid_to_mac(match.group(1))
-        mqtt_msg_handler_sensor_colorbulb_switch(mac, match.group(2), msg.payload)
-        return
-
-    # smarthome/node/[node_id]/sensor/colorbulb/[sensor_id]/set/level
-    match = re.search("^smarthome/node/([0-9A-Fa-f]{16})/sensor/colorbulb/([^/]+)/set/level", msg.topic)
-    if match:
-        mac = convert_nid_to_mac(match.group(1))
-        mqtt_msg_handler_sensor_colorbulb_level(mac, match.group(2), msg.payload)
-        return
-
-    # smarthome/node/[node_id]/sensor/colorbulb/[sensor_id]/set/hue
-    match = re.search("^smarthome/node/([0-9A-Fa-f]{16})/sensor/colorbulb/([^/]+)/set/hue", msg.topic)
-    if match:
-        mac = convert_nid_to_mac(match.group(1))
-        mqtt_msg_handler_sensor_colorbulb_hue(mac, match.group(2), msg.payload)
-        return
-
-    # smarthome/node/[node_id]/sensor/colorbulb/[sensor_id]/set/saturation
-    match = re.search("^smarthome/node/([0-9A-Fa-f]{16})/sensor/colorbulb/([^/]+)/set/saturation", msg.topic)
-    if match:
-        mac = convert_nid_to_mac(match.group(1))
-        mqtt_msg_handler_sensor_colorbulb_saturation(mac, match.group(2), msg.payload)
-        return
-
-    # smarthome/node/[node_id]/sensor/colorbulb/[sensor_id]/set/hsv
-    match = re.search("^smarthome/node/([0-9A-Fa-f]{16})/sensor/colorbulb/([^/]+)/set/hsv", msg.topic)
-    if match:
-        mac = convert_nid_to_mac(match.group(1))
-        mqtt_msg_handler_sensor_colorbulb_hsv(mac, match.group(2), msg.payload)
-        return
-
-    # smarthome/node/[node_id]/sensor/colorbulb/[sensor_id]/set/temperature
-    match = re.search("^smarthome/node/([0-9A-Fa-f]{16})/sensor/colorbulb/([^/]+)/set/temperature", msg.topic)
-    if match:
-        mac = convert_nid_to_mac(match.group(1))
-        mqtt_msg_handler_sensor_colorbulb_temperature(mac, match.group(2), msg.payload)
-        return
-
-    # smarthome/node/[node_id]/sensor/colorbulb/[sensor_id]/query
-    match = re.search("^smarthome/node/([0-9A-Fa-f]{16})/sensor/colorbulb/([^/]+)/query", msg.topic)
-    if match:
-        mac = convert_nid_to_mac(match.group(1))
-        mqtt_msg_handler_sensor_colorbulb_query(mac, match.group(2), msg.payload)
-        return
-
-    # smarthome/gateway/[gw_id]/hw/led/[led_id]
-    match = re.search("smarthome/gateway/([^/]+)/hw/led/([^/]+)", msg.topic)
-    if match:
-        mqtt_msg_handler_gateway_led(match.group(1), match.group(2), msg.payload)
-        return
-
-    # smarthome/gateway/[gw_id]/hw/reset/[reset_id]
-    match = re.search("smarthome/gateway/([^/]+)/hw/reset/([^/]+)", msg.topic)
-    if match:
-        mqtt_msg_handler_gateway_reset(match.group(1), match.group(2), msg.payload)
-        return
-
-    # smarthome/gateway/[gw_id]/hw/ping/[ping_id]
-    match = re.search("smarthome/gateway/([^/]+)/hw/ping/([^/]+)", msg.topic)
-    if match:
-        mqtt_msg_handler_gateway_ping(match.group(1), match.group(2), msg.payload)
-        return
-
-    match = re.search("smarthome/platform/diagnostic/zdo/([^/]+)", msg.topic)
-    if match:
-        mqtt_msg_handler_gateway_zdo(match.group(1), msg.payload)
-        return
-
-    match = re.search("smarthome/platform/diagnostic/loglevel/zmqtt", msg.topic)
-    if match:
-        mqtt_msg_handler_gateway_loglevel(msg.payload)
-        return
-
-    # smarthome/gateway/[gw_id]/hw/sbl/[sbl_id]
-    match = re.search("smarthome/gateway/([^/]+)/hw/sbl/([^/]+)", msg.topic)
-    if match:
-        mqtt_msg_handler_gateway_sbl(match.group(1), match.group(2), msg.payload)
-        return
-
-    # smarthome/gateway/[gw_id]/hw/ota/[ota_id]
-    match = re.search("smarthome/gateway/([^/]+)/hw/ota/([^/]+)", msg.topic)
-    if match:
-        mqtt_msg_handler_gateway_ota(match.group(1), match.group(2), msg.payload)
-        return
-
-    # smarthome/gateway/[gw_id]/hw/swdl/[swdl_id]
-    match = re.search("smarthome/gateway/([^/]+)/hw/swdl/([^/]+)", msg.topic)
-    if match:
-        mqtt_msg_handler_gateway_swdl(match.group(1), match.group(2), msg.payload)
-        return
-
-    # smarthome/gateway/[gw_id]/hw/lqi/[lqi_id]
-    match = re.search("smarthome/gateway/([^/]+)/hw/lqi/([^/]+)", msg.topic)
-    if match:
-        mqtt_msg_handler_gateway_lqi(match.group(1), match.group(2), msg.payload)
-        return
-
-    # error - unknown message
-    LOG(SYSLOG_ERR, "Received unknown or invalid mqtt message <" + msg.topic + "> <" + msg.payload +">")
-    return
+    if not _mqtt_router.route(msg.topic, msg.payload):
+        LOG(SYSLOG_ERR, "Received unknown or invalid mqtt message <" + msg.topic + "> <" + msg.payload.decode('utf-8', 'replace') + ">")
 
 
 def mqtt_msg_handler_hw_service(mac, payload):
@@ -1341,7 +1029,7 @@ def mqtt_msg_handler_hw_led(mac, ledid, payload):
         return
 
     message = str(mac) + "/hw/" + str(ledid) +"/led/" + str(value)
-    ser_msg_send(message)
+    ser_msg_send(message, coalesce=True)
 
 
 def mqtt_msg_handler_sensor_pwr_switch(mac, sensorid, payload):
@@ -1354,7 +1042,7 @@ def mqtt_msg_handler_sensor_pwr_switch(mac, sensorid, payload):
         return
 
     message = str(mac) + "/p/" + str(sensorid) +"/sw/" + str(value)
-    ser_msg_send(message)
+    ser_msg_send(message, coalesce=True)
 
 
 def mqtt_msg_handler_sensor_pwr_sleep(mac, sensorid, payload):
@@ -1455,7 +1143,7 @@ def mqtt_msg_handler_sensor_bulb_switch(mac, sensorid, payload):
         return
 
     message = str(mac) + "/blb/set/sw/" + str(value)
-    ser_msg_send(message)
+    ser_msg_send(message, coalesce=True)
 
 def mqtt_msg_handler_sensor_bulb_level(mac, sensorid, payload):
     try:
@@ -1466,7 +1154,7 @@ def mqtt_msg_handler_sensor_bulb_level(mac, sensorid, payload):
 
     if value >= 0 and value <= 100:
         message = str(mac) + "/blb/set/lv/" + str(value)
-        ser_msg_send(message)
+        ser_msg_send(message, coalesce=True)
     else:
         LOG(SYSLOG_ERR, "mqtt_msg_handler_sensor_bulb_level: invalid payload <" + payload + ">")
         return
@@ -1489,7 +1177,19 @@ def mqtt_msg_handler_sensor_colorbulb_switch(mac, sensorid, payload):
         return
 
     message = str(mac) + "/cblb/set/sw/" + str(value)
-    ser_msg_send(message)
+    ser_msg_send(message, coalesce=True)
+
+def colorbulb_set(mac, component, value):
+    """Sends a hue, sat or lv command, merged with the bulb's other components if enabled."""
+    if _hsv_merge is None:
+        ser_msg_send(str(mac) + "/cblb/set/" + component + "/" + str(value), coalesce=True)
+    elif _hsv_merge.command(mac, component, value, getattr(_command_context, "rx", None)):
+        SingleShotTimer(_hsv_merge.window, colorbulb_merge_flush, mac)
+
+def colorbulb_merge_flush(mac):
+    messages, rx = _hsv_merge.take(mac)
+    for message in messages:
+        ser_msg_send(message, coalesce=True, rx=rx)
 
 def mqtt_msg_handler_sensor_colorbulb_level(mac, sensorid, payload):
     try:
@@ -1499,8 +1199,7 @@ def mqtt_msg_handler_sensor_colorbulb_level(mac, sensorid, payload):
         return
 
     if value >= 0 and value <= 100:
-        message = str(mac) + "/cblb/set/lv/" + str(value)
-        ser_msg_send(message)
+        colorbulb_set(mac, "lv", value)
     else:
         LOG(SYSLOG_ERR, "mqtt_msg_handler_sensor_colorbulb_level: invalid payload <" + payload + ">")
         return
@@ -1513,8 +1212,7 @@ def mqtt_msg_handler_sensor_colorbulb_hue(mac, sensorid, payload):
         return
 
     if value >= 0 and value <= 360:
-        message = str(mac) + "/cblb/set/hue/" + str(value)
-        ser_msg_send(message)
+        colorbulb_set(mac, "hue", value)
     else:
         LOG(SYSLOG_ERR, "mqtt_msg_handler_sensor_colorbulb_hue: invalid payload <" + payload + ">")
         return
@@ -1527,19 +1225,23 @@ def mqtt_msg_handler_sensor_colorbulb_saturation(mac, sensorid, payload):
         return
 
     if value >= 0 and value <= 100:
-        message = str(mac) + "/cblb/set/sat/" + str(value)
-        ser_msg_send(message)
+        colorbulb_set(mac, "sat", value)
     else:
         LOG(SYSLOG_ERR, "mqtt_msg_handler_sensor_colorbulb_saturation: invalid payload <" + payload + ">")
         return
 
 def mqtt_msg_handler_sensor_colorbulb_hsv(mac, sensorid, payload):
-    message = str(mac) + "/cblb/set/hsv/" + str(payload) + _transitionTime
-    ser_msg_send(message)
+    payload = payload.decode('ascii', 'replace')
+    message = str(mac) + "/cblb/set/hsv/" + payload + _transitionTime
+    if _hsv_merge is not None:
+        components = payload.split(":")
+        if len(components) == 3 and all(component.isdigit() for component in components):
+            _hsv_merge.command_hsv(mac, *components)
+    ser_msg_send(message, coalesce=True)
 
 def mqtt_msg_handler_sensor_colorbulb_temperature(mac, sensorid, payload):
     message = str(mac) + "/cblb/set/ctemp/" + str(payload)
-    ser_msg_send(message)
+    ser_msg_send(message, coalesce=True)
 
 def mqtt_msg_handler_sensor_colorbulb_query(mac, sensorid, payload):
     if payload == "all":
@@ -1572,6 +1274,8 @@ def mqtt_msg_handler_gateway_reset(gwid, resetid, payload):
 
     elif payload == "sensor_delete":
         message = "0/ready/sensor_delete/0/0"
+        # departed nodes, drop their cached topics
+        _topic_cache.clear()
         ser_msg_send(message)
 
     elif payload == "sensor_rewrite":
@@ -1584,6 +1288,7 @@ def mqtt_msg_handler_gateway_reset(gwid, resetid, payload):
 
     elif payload == "network_reset":
         message = "0/ready/network_reset/0/0"
+        _topic_cache.clear()
         ser_msg_send(message)
 
     elif payload == "reset":
@@ -1597,8 +1302,7 @@ def mqtt_msg_handler_gateway_ping(gwid, pingid, payload):
     LOG(SYSLOG_DBG, "mqtt_msg_handler_gateway_ping: debug <" + payload + ">")
 
     if payload == "ping":
-        message = "0/ready/ping/0/0"
-        ser_msg_send(message)
+        ser_msg_send(PING_MESSAGE)
 
     else:
         LOG(SYSLOG_ERR, "mqtt_msg_handler_gateway_ping: invalid payload <" + payload + ">")
@@ -1650,7 +1354,7 @@ def mqtt_msg_handler_gateway_sbl(gwid, sblid, payload):
     if payload.split(".")[1] == "bin":
         reset_zigbee("SBL")
         #_mqttc.disconnect()
-        _serial_port.close()
+        serial_port_request("close")
 
         #Two ways of calling sbl
         #sbl.main(["-i", "blinky.bin"])
@@ -1658,7 +1362,7 @@ def mqtt_msg_handler_gateway_sbl(gwid, sblid, payload):
         cmd = './sbl.py -i ' + payload
         cmd_status = os.system(cmd) # returns the exit status
 
-        _serial_port = serial.Serial(_uart_port, baudrate=115200, timeout=15)
+        serial_port_request("open", 115200)
         #_mqttc.reconnect()
     else:
         LOG(SYSLOG_ERR, "mqtt_msg_handler_gateway_sbl: payload must be .bin filename <" + payload + ">")  
@@ -1728,6 +1432,67 @@ def mqtt_msg_handler_gateway_lqi(gwid, lqiid, payload):
         message = str(gwid) + "/hw/" + str(lqiid) +"/lqi/" + str(1)
         ser_msg_send(message)
 
+
+# inbound mqtt commands, routed by topic segments (topicrouter)
+# node topics: the node id is checked and passed on as the node's mac,
+# handler(mac, [sensor/led id,] payload)
+MQTT_NODE_ROUTES = [
+    ("smarthome/node/+/hw/zigbee/service", mqtt_msg_handler_hw_service),
+    ("smarthome/node/+/hw/led/+", mqtt_msg_handler_hw_led),
+    ("smarthome/node/+/sensor/power/+/switch/status", mqtt_msg_handler_sensor_pwr_switch),
+    ("smarthome/node/+/sensor/power/+/set/switch", mqtt_msg_handler_sensor_pwr_switch),
+    ("smarthome/node/+/sensor/power/+/sleep", mqtt_msg_handler_sensor_pwr_sleep),
+    ("smarthome/node/+/sensor/power/+/reset/energy", mqtt_msg_handler_sensor_pwr_reset),
+    ("smarthome/node/+/sensor/temperature/+/sleep", mqtt_msg_handler_sensor_temp_sleep),
+    ("smarthome/node/+/sensor/humidity/+/sleep", mqtt_msg_handler_sensor_humidity_sleep),
+    ("smarthome/node/+/sensor/motion/+/arm", mqtt_msg_handler_sensor_motion_arm),
+    ("smarthome/node/+/sensor/motion/+/sleep", mqtt_msg_handler_sensor_motion_sleep),
+    ("smarthome/node/+/sensor/fall/+/arm", mqtt_msg_handler_sensor_fall_arm),
+    ("smarthome/node/+/sensor/fall/+/keepalive", mqtt_msg_handler_sensor_fall_keepalive),
+    ("smarthome/node/+/sensor/co2/+/sleep", mqtt_msg_handler_sensor_co2_sleep),
+    ("smarthome/node/+/sensor/voc/+/sleep", mqtt_msg_handler_sensor_voc_sleep),
+    ("smarthome/node/+/sensor/pm2_5/+/sleep", mqtt_msg_handler_sensor_pm2_5_sleep),
+    ("smarthome/node/+/sensor/pm10/+/sleep", mqtt_msg_handler_sensor_pm10_sleep),
+    ("smarthome/node/+/sensor/illuminance/+/sleep", mqtt_msg_handler_sensor_illuminance_sleep),
+    ("smarthome/node/+/sensor/pressure/+/sleep", mqtt_msg_handler_sensor_pressure_sleep),
+    ("smarthome/node/+/sensor/bulb/+/set/switch", mqtt_msg_handler_sensor_bulb_switch),
+    ("smarthome/node/+/sensor/bulb/+/set/level", mqtt_msg_handler_sensor_bulb_level),
+    ("smarthome/node/+/sensor/bulb/+/query", mqtt_msg_handler_sensor_bulb_query),
+    ("smarthome/node/+/sensor/colorbulb/+/set/switch", mqtt_msg_handler_sensor_colorbulb_switch),
+    ("smarthome/node/+/sensor/colorbulb/+/set/level", mqtt_msg_handler_sensor_colorbulb_level),
+    ("smarthome/node/+/sensor/colorbulb/+/set/hue", mqtt_msg_handler_sensor_colorbulb_hue),
+    ("smarthome/node/+/sensor/colorbulb/+/set/saturation", mqtt_msg_handler_sensor_colorbulb_saturation),
+    ("smarthome/node/+/sensor/colorbulb/+/set/hsv", mqtt_msg_handler_sensor_colorbulb_hsv),
+    ("smarthome/node/+/sensor/colorbulb/+/set/temperature", mqtt_msg_handler_sensor_colorbulb_temperature),
+    ("smarthome/node/+/sensor/colorbulb/+/query", mqtt_msg_handler_sensor_colorbulb_query),
+]
+
+# handler([gateway id,] [id,] payload)
+MQTT_GATEWAY_ROUTES = [
+    ("smarthome/gateway/+/hw/led/+", mqtt_msg_handler_gateway_led),
+    ("smarthome/gateway/+/hw/reset/+", mqtt_msg_handler_gateway_reset),
+    ("smarthome/gateway/+/hw/ping/+", mqtt_msg_handler_gateway_ping),
+    ("smarthome/platform/diagnostic/zdo/+", mqtt_msg_handler_gateway_zdo),
+    ("smarthome/platform/diagnostic/loglevel/zmqtt", mqtt_msg_handler_gateway_loglevel),
+    ("smarthome/gateway/+/hw/sbl/+", mqtt_msg_handler_gateway_sbl),
+    ("smarthome/gateway/+/hw/ota/+", mqtt_msg_handler_gateway_ota),
+    ("smarthome/gateway/+/hw/swdl/+", mqtt_msg_handler_gateway_swdl),
+    ("smarthome/gateway/+/hw/lqi/+", mqtt_msg_handler_gateway_lqi),
+]
+
+def mqtt_node_route(handler):
+    return lambda params, payload: handler(convert_nid_to_mac(params[0]), *(params[1:] + [payload]))
+
+def mqtt_gateway_route(handler):
+    return lambda params, payload: handler(*(params + [payload]))
+
+_mqtt_router = topicrouter.TopicRouter()
+for _pattern, _handler in MQTT_NODE_ROUTES:
+    _mqtt_router.add(_pattern, mqtt_node_route(_handler), {0: topicrouter.is_node_id})
+for _pattern, _handler in MQTT_GATEWAY_ROUTES:
+    _mqtt_router.add(_pattern, mqtt_gateway_route(_handler))
+stats_register("mqtt_router", _mqtt_router.stats)
+
 def gw_send_serial():
     global _gw_serial_sent
     global _gwid
@@ -1814,14 +1579,27 @@ class RepeatedTimer(object):
         self.start()
         self.function(*self.args, **self.kwargs)
 
+    def _loop(self, stopped):
+        # one thread for the timer's lifetime, not a new Timer thread per interval
+        while not stopped.wait(self.interval):
+            self.function(*self.args, **self.kwargs)
+
     def start(self):
         if not self.is_running:
-            self._timer = Timer(self.interval, self._run)
-            self._timer.start()
+            if _aio_loop is not None:
+                self._timer = _aio_loop.call_later(self.interval, self._run)
+            else:
+                self._stopped = Event()
+                self._timer = Thread(target=self._loop, args=(self._stopped,), name="timer " + self.function.__name__)
+                self._timer.daemon = True
+                self._timer.start()
             self.is_running = True
 
     def stop(self):
-        self._timer.cancel()
+        if _aio_loop is not None:
+            self._timer.cancel()
+        else:
+            self._stopped.set()
         self.is_running = False
 
 
@@ -1841,8 +1619,11 @@ class SingleShotTimer(object):
 
     def start(self):
         if not self.is_running:
-            self._timer = Timer(self.interval, self._run)
-            self._timer.start()
+            if _aio_loop is not None:
+                self._timer = _aio_loop.call_later(self.interval, self._run)
+            else:
+                self._timer = Timer(self.interval, self._run)
+                self._timer.start()
             self.is_running = True
 
     def stop(self):
@@ -2169,14 +1950,14 @@ def reset_zigbee(type):
         cmd = b'\xef'
 
         try:
-            if _serial_port.isOpen():
-                _serial_port.write(cmd)
+            with _ser_tx_lock:
+                if _serial_port.isOpen():
+                    _serial_port.write(cmd)
         except serial.SerialException as e:
             LOG(SYSLOG_WRN, "Serial exception: " + str(e))
         except TypeError as e:
             LOG(SYSLOG_WRN, "UART Disconnected: " + str(e))
-            _serial_port.close()
-            _serial_port = serial.Serial(_uart_port, baudrate=uart_baudrate, timeout=15)
+            serial_port_request("reopen")
 
         LOG(SYSLOG_INF, "poslan kod za izlazak iz bootloadera")
 
@@ -2195,11 +1976,11 @@ def sblCheck():
     return
 
 def ping_timer_callback(arg1, arg2, arg3):
-    global _ping_timer_timeout_flag
-    message = "0/ready/ping/0/0"
+    global _ping_timer, _ping_timer_queued
     LOG(SYSLOG_DBG, "PING SEND")
-    ser_msg_send(message)
-    _ping_timer_timeout = SingleShotTimer(1, ping_timer_timeout_callback, 0, 0, 0)
+    # ser_tx_write starts the reply timeout once the ping is on the UART
+    _ping_timer_queued = True
+    ser_msg_send(PING_MESSAGE)
     _ping_timer = SingleShotTimer(PING_TIMER_TIMEOUT, ping_timer_callback, 0, 0, 0)
     return
 
@@ -2212,6 +1993,162 @@ def ping_timer_timeout_callback(arg1, arg2, arg3):
         reset_zigbee("SBL")
     return
 
+def process_serial_frame(rx_frame):
+    global _serial_port
+    global _rx_frame
+
+    frame = rx_frame.data
+    # handlers stamp their readings with the time the frame left the UART reader
+    _rx_frame = rx_frame
+
+    #MT messages
+    if rx_frame.kind == serframe.FRAME_MT:
+        LOG(SYSLOG_DBG, "received mt message: <" + ' '.join('0x{:02x}'.format(x) for x in frame) + ">")
+        # MT frames come from the coordinator itself
+        _ser_tx.responded(rx_frame.rx_mono)
+
+        #if _ota_allowed == 1:
+            #msg = otaserv.mt_receive_message(frame)
+            #print(msg)
+            #if msg:
+                #otaserv.mt_handle_message(msg, _serial_port)
+
+    #First terminating charactor, only once on beggining
+    elif frame == b'\n':
+        LOG(SYSLOG_INF, "FIRST READY MESSAGE RECEIVED")
+
+    #Regular sensor messages
+    else:
+        try:
+            led_on("1")
+            process_serial_message(frame, _mqttc)
+            led_off("1")
+        except serial.SerialException as e:
+            LOG(SYSLOG_WRN, "Serial exception" + str(e))
+        except TypeError as e:
+            LOG(SYSLOG_WRN, "UART Disconnected:" + str(e))
+            serial_port_request("reopen")
+
+        latency = (time.monotonic() - rx_frame.rx_mono) * 1000
+        _rx_latency["frames"] += 1
+        _rx_latency["avg_ms"] += (latency - _rx_latency["avg_ms"]) / _rx_latency["frames"]
+        if latency > _rx_latency["max_ms"]:
+            _rx_latency["max_ms"] = latency
+
+
+def ingest_frames(frames):
+    """Ingest stage: only queue the frames, the publisher stage processes them."""
+    global _aio_ingest_scheduled
+
+    for frame in frames:
+        if not _ingest_queue.put(frame):
+            LOG(SYSLOG_DBG, "ingest queue full, dropped oldest frame (" + str(_ingest_queue.drops) + " total)")
+
+    if _aio_loop is not None and not _aio_ingest_scheduled and len(_ingest_queue):
+        _aio_ingest_scheduled = True
+        _aio_loop.call_soon(aio_ingest_drain)
+
+def ingest_worker():
+    """Publisher stage thread."""
+    while True:
+        frame = _ingest_queue.get()
+        try:
+            process_serial_frame(frame)
+        except Exception as e:
+            LOG(SYSLOG_ERR, "ingest_worker: failed to process frame: " + str(e))
+
+def aio_ingest_drain():
+    global _aio_ingest_scheduled
+
+    # process a batch, then give the UART reader a chance to run
+    for i in range(INGEST_BATCH):
+        frame = _ingest_queue.get_nowait()
+        if frame is None:
+            break
+        process_serial_frame(frame)
+
+    if len(_ingest_queue):
+        _aio_loop.call_soon(aio_ingest_drain)
+    else:
+        _aio_ingest_scheduled = False
+
+
+# asyncio runtime: UART, MQTT socket and timers all run on one event loop
+def aio_serial_attach():
+    """(Re)registers the UART fd with the event loop, the port is reopened after sbl."""
+    global _aio_serial_port
+    global _aio_serial_fd
+
+    if _aio_serial_port is _serial_port:
+        return
+
+    if _aio_serial_port is not None:
+        aio_serial_detach()
+        _serial_reader.reset()
+
+    if _serial_port.isOpen():
+        _aio_serial_fd = _serial_port.fileno()
+        _aio_loop.add_reader(_aio_serial_fd, aio_serial_readable)
+        _aio_serial_port = _serial_port
+
+def aio_serial_detach():
+    """Stops watching the UART, aio_housekeeping() attaches it again."""
+    global _aio_serial_port
+    global _aio_serial_fd
+
+    if _aio_serial_fd is not None:
+        _aio_loop.remove_reader(_aio_serial_fd)
+    _aio_serial_fd = None
+    _aio_serial_port = None
+
+def aio_serial_readable():
+    try:
+        # readable fd, only take what is pending so the loop never blocks
+        pending = _serial_port.in_waiting
+        if pending == 0:
+            # readable without data is a hangup, watching it again right away would spin the loop
+            aio_serial_detach()
+            return
+        frames = _serial_reader.feed(_serial_port.read(pending))
+    except (serial.SerialException, TypeError, OSError) as e:
+        LOG(SYSLOG_WRN, "Serial exception: " + str(e))
+        aio_serial_detach()
+        return
+
+    ingest_frames(frames)
+
+def aio_mqtt_socket_open(client, userdata, sock):
+    _aio_loop.add_reader(sock, client.loop_read)
+
+def aio_mqtt_socket_close(client, userdata, sock):
+    _aio_loop.remove_reader(sock)
+
+def aio_mqtt_socket_register_write(client, userdata, sock):
+    _aio_loop.add_writer(sock, client.loop_write)
+
+def aio_mqtt_socket_unregister_write(client, userdata, sock):
+    _aio_loop.remove_writer(sock)
+
+def aio_housekeeping():
+    global _aio_mqtt_reconnect_at
+
+    # keepalive and reconnect are normally done by paho's loop_start() thread
+    if _mqttc.loop_misc() == mqtt.MQTT_ERR_NO_CONN and time.monotonic() >= _aio_mqtt_reconnect_at:
+        _aio_mqtt_reconnect_at = time.monotonic() + AIO_MQTT_RECONNECT_INTERVAL
+        try:
+            _mqttc.reconnect()
+        except OSError as e:
+            LOG(SYSLOG_WRN, "MQ reconnect failed: " + str(e))
+
+    if _serial_port is not _aio_serial_port:
+        try:
+            aio_serial_attach()
+        except (serial.SerialException, OSError) as e:
+            LOG(SYSLOG_WRN, "Serial exception: " + str(e))
+
+    _aio_loop.call_later(AIO_HOUSEKEEPING_INTERVAL, aio_housekeeping)
+
+
 def usage():
     print("Zigbee node mqtt client")
     print("Usage is:" + sys.argv[0] + " [options]")
@@ -2220,19 +2157,86 @@ def usage():
     print("--<b>aud baudrate (38400)")
     print("--b<r>oker mqtt broker address (messagesight.demos.ibm.com)")
     print("--<p>ort mqtt broker port (1883)")
+    print("--<a>syncio run serial, mqtt and timers on a single asyncio event loop")
+    print("--<q>ueue serial ingest queue size (256)")
+    print("--<s>tats diagnostics publish interval in seconds, 0 disables (60)")
+    print("--rx-timestamp also publish .../rxtime/<attr> with epoch ms receive time of each reading")
+    print("--deadband change-only publishing: 'default' or <class>:<deadband>,... e.g. temperature:0.05,power/power:1")
+    print("--max-silence seconds after which a reading inside the deadband is published anyway (300)")
+    print("--state also publish a json state document per node on smarthome/node/<nid>/state")
+    print("--state-window seconds to coalesce readings into one state publish (1.0)")
+    print("--state-only publish sensor readings only in the state document")
+    print("--qos-policy override publish policies <class>:<qos>:<retain>[:<expiry s>],... (all 1:1, no expiry)")
+    print("             classes: " + ", ".join(sorted(pubpolicy.DEFAULT_POLICIES)))
+    print("             'tuned': QoS 0 for timestamps and power, QoS 2 for alarms, retained telemetry expires (1 h)")
+    print("--publish-rate limit publishing to <msgs/s>, alarms first, then state, then telemetry (off)")
+    print("--publish-burst messages that may be published at once after an idle period (publish rate)")
+    print("--publish-queue queued telemetry messages before the oldest are dropped (512)")
+    print("--mqtt5 connect with MQTT v5: message expiry, unit user property, topic aliases for hot QoS 0 topics")
+    print("--topic-aliases at most this many topic aliases with --mqtt5, 0 disables (broker maximum)")
+    print("--binary also publish readings binary encoded on smarthome/bin/..., codec: " + "|".join(binenc.available_codecs()))
+    print("--fanout also publish to broker <host>[:<port>][;<qos-policy>], may be given several times")
+    print("--tx-min-gap shortest gap between UART frames in seconds when the coordinator answers fast (0.05)")
+    print("--tx-dest-gap gap between UART frames to the same node in seconds (0.25)")
+    print("--ack-timeout track actuator commands, resend them when their node did not report the new state within <s> (off)")
+    print("--ack-retries times an unacknowledged command is sent again (2)")
+    print("--hsv-window seconds to merge colour bulb hue/saturation/level commands into one hsv frame, 0 disables (0.1)")
+    print("--journal sqlite file keeping publishes while the broker is unreachable, replayed on reconnect (off)")
+    print("--journal-size journal limit in topic + payload bytes (4194304)")
+    print("--journal-age seconds after which journaled publishes are discarded (86400)")
 
 def main(argv):
 
     global _serial_port
+    global _serial_reader_thread
     global _mqttc
     global _gwid
     global _uart_port
+    global _serial_reader
+    global _aio_loop
+    global uart_baudrate
+    global _ingest_queue
+    global _command_queue
+    global _ser_tx
+    global _stats_timer
+    global _rx_timestamp_topics
+    global _report_filter
+    global _node_state
+    global _legacy_topics
+    global _publish_policy
+    global _publish_scheduler
+    global _journal
+    global _mqtt_protocol
+    global _topic_aliases
+    global _binary_encoder
+    global _hsv_merge
+    global _command_acks
 
     # default parameters
     _uart_port = "/dev/ttyAMA0"
     uart_baudrate = 115200
     broker_address = "localhost"
     broker_port = 1883
+    use_asyncio = False
+    ingest_queue_size = INGEST_QUEUE_SIZE
+    stats_interval = STATS_INTERVAL
+    deadbands = None
+    max_silence = pubfilter.DEFAULT_MAX_SILENCE
+    node_state = False
+    state_window = nodestate.STATE_WINDOW
+    publish_rate = 0
+    publish_burst = None
+    publish_queue_size = queues.TELEMETRY_LANE_SIZE
+    journal_path = None
+    topic_alias_limit = None
+    fanout_endpoints = []
+    tx_min_gap = sertx.SER_TX_MIN_GAP
+    tx_dest_gap = sertx.SER_TX_DEST_GAP
+    hsv_window = hsvmerge.HSV_WINDOW
+    ack_timeout = 0
+    ack_retries = cmdack.ACK_RETRIES
+    journal_size = journal.JOURNAL_MAX_BYTES
+    journal_age = journal.JOURNAL_MAX_AGE
 
     #CTS/RTS pins (16,17) to alt 3 mode
     cmd_status = 0
@@ -2248,7 +2252,7 @@ def main(argv):
 #        LOG(SYSLOG_ERR, "os.system('./gpio_alt -p 17 -f 3'): invalid exit status <" + str(cmd_status) + ">")
 
     try:
-        opts, args = getopt.getopt(argv,"ht:b:r:p:",["help","tty=", "baud=", "broker=", "port="])
+        opts, args = getopt.getopt(argv,"ht:b:r:p:aq:s:",["help","tty=", "baud=", "broker=", "port=", "asyncio", "queue=", "stats=", "rx-timestamp", "deadband=", "max-silence=", "state", "state-window=", "state-only", "qos-policy=", "publish-rate=", "publish-burst=", "publish-queue=", "journal=", "journal-size=", "journal-age=", "mqtt5", "topic-aliases=", "binary=", "fanout=", "tx-min-gap=", "tx-dest-gap=", "hsv-window=", "ack-timeout=", "ack-retries="])
     except getopt.GetoptError:
         usage()
         sys.exit(2)
@@ -2264,11 +2268,105 @@ def main(argv):
             broker_address = arg
         elif opt in ("-p", "--port"):
             broker_port = arg
+        elif opt in ("-a", "--asyncio"):
+            use_asyncio = True
+        elif opt in ("-q", "--queue"):
+            ingest_queue_size = int(arg)
+        elif opt in ("-s", "--stats"):
+            stats_interval = int(arg)
+        elif opt == "--rx-timestamp":
+            _rx_timestamp_topics = True
+        elif opt == "--deadband":
+            try:
+                deadbands = pubfilter.parse_deadbands(arg)
+            except ValueError:
+                usage()
+                sys.exit(2)
+        elif opt == "--max-silence":
+            max_silence = int(arg)
+        elif opt == "--state":
+            node_state = True
+        elif opt == "--state-window":
+            state_window = float(arg)
+        elif opt == "--state-only":
+            node_state = True
+            _legacy_topics = False
+        elif opt == "--qos-policy":
+            try:
+                _publish_policy = pubpolicy.PolicyTable(pubpolicy.parse_policies(arg))
+            except ValueError as e:
+                print(str(e))
+                usage()
+                sys.exit(2)
+        elif opt == "--publish-rate":
+            publish_rate = float(arg)
+        elif opt == "--publish-burst":
+            publish_burst = float(arg)
+        elif opt == "--publish-queue":
+            publish_queue_size = int(arg)
+        elif opt == "--journal":
+            journal_path = arg
+        elif opt == "--journal-size":
+            journal_size = int(arg)
+        elif opt == "--journal-age":
+            journal_age = int(arg)
+        elif opt == "--mqtt5":
+            _mqtt_protocol = mqtt.MQTTv5
+        elif opt == "--topic-aliases":
+            topic_alias_limit = int(arg)
+        elif opt == "--binary":
+            try:
+                _binary_encoder = binenc.BinaryEncoder(arg)
+            except ValueError as e:
+                print(str(e))
+                usage()
+                sys.exit(2)
+            stats_register("binary", _binary_encoder.stats)
+        elif opt == "--tx-min-gap":
+            tx_min_gap = float(arg)
+        elif opt == "--tx-dest-gap":
+            tx_dest_gap = float(arg)
+        elif opt == "--hsv-window":
+            hsv_window = float(arg)
+        elif opt == "--ack-timeout":
+            ack_timeout = float(arg)
+        elif opt == "--ack-retries":
+            ack_retries = int(arg)
+        elif opt == "--fanout":
+            try:
+                fanout_endpoints.append(fanout.parse_endpoint(arg))
+            except ValueError as e:
+                print(str(e))
+                usage()
+                sys.exit(2)
+
+
+    if use_asyncio:
+        # must exist before the first timer is created
+        _aio_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_aio_loop)
+        LOG(SYSLOG_INF, "asyncio runtime")
+
+    if deadbands is not None:
+        _report_filter = pubfilter.ReportFilter(deadbands, max_silence)
+        stats_register("report_filter", _report_filter.stats)
+        LOG(SYSLOG_INF, "change-only publishing, deadbands: " + str(deadbands))
 
+    if node_state:
+        _node_state = nodestate.NodeStateStore(state_window)
+        stats_register("node_state", _node_state.stats)
 
     # install SIGINT signal handler
     signal.signal(signal.SIGINT, sigint_handler)
 
+    if journal_path is not None:
+        _journal = journal.PublishJournal(journal_path, journal_size, journal_age)
+        stats_register("journal", _journal.stats)
+        RepeatedTimer(journal.JOURNAL_FLUSH_INTERVAL, _journal.flush)
+        # systemd stops the service with SIGTERM, flush the journal then too
+        signal.signal(signal.SIGTERM, sigint_handler)
+        LOG(SYSLOG_INF, "publish journal " + journal_path + ": " + str(len(_journal)) + " pending")
+
     led_init()
 
     _gwid = get_gwid()
@@ -2278,6 +2376,31 @@ def main(argv):
 
     #first open 115200 uart connection for SBL
     _serial_port = serial.Serial(_uart_port, baudrate=uart_baudrate, timeout=15)
+    _serial_reader = serframe.SerialFrameReader()
+    _ingest_queue = queues.BoundedQueue(ingest_queue_size)
+    stats_register("uart", _serial_reader.stats)
+    stats_register("ingest", _ingest_queue.stats)
+    stats_register("rx_latency", lambda: dict(_rx_latency))
+    _ser_tx = sertx.TxScheduler(min(tx_min_gap, SER_TX_INTERVAL), SER_TX_INTERVAL, tx_dest_gap)
+    stats_register("uart_tx", _ser_tx.stats)
+    if hsv_window > 0:
+        _hsv_merge = hsvmerge.HsvMerger(hsv_window, _transitionTime)
+        stats_register("hsv_merge", _hsv_merge.stats)
+    if ack_timeout > 0:
+        _command_acks = cmdack.CommandTracker(ack_timeout, ack_retries)
+        stats_register("command_ack", _command_acks.stats)
+        RepeatedTimer(COMMAND_ACK_CHECK_INTERVAL, command_ack_check)
+    if _aio_loop is None:
+        writer = Thread(target=_ser_tx.run, args=(ser_tx_write,), name="uart-tx")
+        writer.daemon = True
+        writer.start()
+    _command_queue = queues.BoundedQueue(COMMAND_QUEUE_SIZE)
+    stats_register("command_queue", _command_queue.stats)
+    stats_register("command_to_serial", lambda: dict(_command_latency))
+    if _aio_loop is None:
+        commands = Thread(target=command_worker, name="commands")
+        commands.daemon = True
+        commands.start()
 
     #send force run command
     cmd = b'\xef'
@@ -2287,80 +2410,81 @@ def main(argv):
     #wait a moment so bootloader can start app
     time.sleep(1)
 
-    _mqttc = mqtt.Client()
+    _mqttc = mqtt.Client(protocol=_mqtt_protocol)
     _mqttc.on_connect = on_connect
+    _mqttc.on_disconnect = on_disconnect
     _mqttc.on_message = on_message
     _mqttc.on_publish = on_publish
 
+    if _mqtt_protocol == mqtt.MQTTv5 and topic_alias_limit != 0:
+        _topic_aliases = topicalias.TopicAliases(_mqttc, topic_alias_limit)
+        stats_register("topic_aliases", _topic_aliases.stats)
+
+    if _aio_loop is not None:
+        _mqttc.on_socket_open = aio_mqtt_socket_open
+        _mqttc.on_socket_close = aio_mqtt_socket_close
+        _mqttc.on_socket_register_write = aio_mqtt_socket_register_write
+        _mqttc.on_socket_unregister_write = aio_mqtt_socket_unregister_write
+
+    if publish_rate > 0:
+        _publish_scheduler = queues.PublishScheduler(mqtt_client_publish, publish_rate, publish_burst, publish_queue_size)
+        stats_register("publish_lanes", _publish_scheduler.stats)
+        LOG(SYSLOG_INF, "publish rate limit: " + str(publish_rate) + " msgs/s")
+        if _aio_loop is None:
+            scheduler = Thread(target=_publish_scheduler.run, name="mqtt-tx")
+            scheduler.daemon = True
+            scheduler.start()
+
     _mqttc.connect(broker_address, port=broker_port, keepalive=60)
 
+    for host, port, policies in fanout_endpoints:
+        # endpoints without their own policies publish as on the primary broker
+        endpoint = fanout.BrokerEndpoint(host, port, policies, _mqtt_protocol)
+        endpoint.start()
+        _fanout.append(endpoint)
+        LOG(SYSLOG_INF, "fan-out to broker " + endpoint.name)
+    if _fanout:
+        stats_register("fanout", lambda: dict((endpoint.name, endpoint.stats()) for endpoint in _fanout))
+
     #start the background thread to handle network traffic
-    _mqttc.loop_start()
+    if _aio_loop is None:
+        _mqttc.loop_start()
 
     time.sleep(1)
     init_msg_hendler_serial()
 
     #if gw doesnt send anything for 10 sec, run sbl
-    sblTimer = Timer(10,sblCheck)
-    sblTimer.start()
+    SingleShotTimer(10, sblCheck)
 
     _ping_timer = SingleShotTimer(PING_TIMER_TIMEOUT, ping_timer_callback, 0, 0, 0)
 
-    msgStart = 0
+    if stats_interval > 0:
+        _stats_timer = RepeatedTimer(stats_interval, stats_publish)
+
+    if _aio_loop is not None:
+        aio_serial_attach()
+        _aio_loop.call_later(AIO_HOUSEKEEPING_INTERVAL, aio_housekeeping)
+        _aio_loop.run_forever()
+        return
+
+    _serial_reader_thread = current_thread()
+    publisher = Thread(target=ingest_worker, name="publisher")
+    publisher.daemon = True
+    publisher.start()
 
     while True:
+        frames = []
+        serial_port_serve()
         try:
             if _serial_port.isOpen():
-                msgStart = _serial_port.read()
+                frames = _serial_reader.read(_serial_port)
         except serial.SerialException as e:
             LOG(SYSLOG_WRN, "Serial exception: " + str(e))
         except TypeError as e:
                 LOG(SYSLOG_WRN, "UART Disconnected: " + str(e))
-                _serial_port.close()
-                _serial_port = serial.Serial(_uart_port, baudrate=uart_baudrate, timeout=15)
-
-        #MT messages
-        if msgStart == b'\xfe':
-            #print("MT_MESSAGE:")
-            try:
-                if _serial_port.isOpen():
-                    MTdataLen = _serial_port.read()
-                    MTmessage = b'\xfe' + MTdataLen + _serial_port.read(MTdataLen[0] + 3)
-            except serial.SerialException as e:
-                LOG(SYSLOG_WRN, "Serial exception: " + str(e))
-            except TypeError as e:
-                LOG(SYSLOG_WRN, "UART Disconnected:" + str(e))
-                _serial_port.close()
-                _serial_port = serial.Serial(_uart_port, baudrate=uart_baudrate, timeout=15)
-
-            s=list(MTmessage)
-            LOG(SYSLOG_DBG, "received mt message: <" + ' '.join('0x{:02x}'.format(x) for x in s) + ">")
-
-            #if _ota_allowed == 1:
-                #msg = otaserv.mt_receive_message(MTmessage)
-                #print(msg)
-                #if msg:
-                    #otaserv.mt_handle_message(msg, _serial_port)
-
-        #First terminating charactor, only once on beggining
-        elif msgStart == b'\n':
-            LOG(SYSLOG_INF, "FIRST READY MESSAGE RECEIVED")
-
-        #Regular sensor messages
-        else:
-            try:
-                if _serial_port.isOpen():
-                    message = msgStart + _serial_port.readline()
-                    led_on("1")
-                    process_serial_message(message, _mqttc)
-                    led_off("1")
-            except serial.SerialException as e:
-                LOG(SYSLOG_WRN, "Serial exception" + str(e))
-            except TypeError as e:
-                LOG(SYSLOG_WRN, "UART Disconnected:" + str(e))
-                _serial_port.close()
-                _serial_port = serial.Serial(_uart_port, baudrate=uart_baudrate, timeout=15)
+                serial_port_apply("reopen")
 
+        ingest_frames(frames)
 
 
 if __name__=="__main__":
@@ -0,0 +1,135 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import cmdack
+
+
+class CommandTrackerTest(unittest.TestCase):
+    def setUp(self):
+        self.tracker = cmdack.CommandTracker(timeout=1.0, retries=1)
+
+    def test_report_acknowledges_command(self):
+        self.assertEqual(self.tracker.sent(1, "N1", "a/p/1/sw/1", 9.5, 10.0), [])
+        # a power reading is not the switch state
+        self.assertIsNone(self.tracker.received("N1", "p", "p", "1", 10.1))
+        # nor is the switch state of another node
+        self.assertIsNone(self.tracker.received("N2", "p", "st", "1", 10.1))
+
+        outcome = self.tracker.received("N1", "p", "st", "1", 10.2)
+        self.assertEqual(outcome["outcome"], cmdack.OUTCOME_ACK)
+        self.assertEqual(outcome["seq"], 1)
+        self.assertEqual(outcome["attempts"], 1)
+        self.assertAlmostEqual(outcome["rtt_ms"], 200.0)
+        self.assertAlmostEqual(outcome["latency_ms"], 700.0)
+
+        stats = self.tracker.stats()
+        self.assertEqual(stats["pending"], 0)
+        self.assertEqual(stats["acked"], 1)
+        self.assertEqual(stats["rtt_ms"]["N1"]["le_250"], 1)
+        self.assertIsNone(self.tracker.received("N1", "p", "st", "1", 10.3))
+
+    def test_hsv_acknowledged_by_any_component(self):
+        self.tracker.sent(1, "N1", "a/cblb/set/hsv/10:20:30:0", None, 0.0)
+        outcome = self.tracker.received("N1", "cblb", "sat", "20", 0.1)
+        self.assertEqual(outcome["command"], "a/cblb/set/hsv/10:20:30:0")
+        self.assertNotIn("latency_ms", outcome)
+        self.assertIsNone(self.tracker.received("N1", "cblb", "hue", "10", 0.1))
+
+    def test_other_value_is_not_an_ack(self):
+        self.tracker.sent(1, "N1", "a/p/1/sw/1", None, 0.0)
+        self.assertIsNone(self.tracker.received("N1", "p", "st", "0", 0.1))
+        self.assertEqual(self.tracker.received("N1", "p", "st", "1", 0.2)["seq"], 1)
+
+        self.tracker.sent(2, "N1", "a/cblb/set/hsv/10:20:30:0", None, 1.0)
+        self.assertIsNone(self.tracker.received("N1", "cblb", "hue", "11", 1.1))
+        self.assertIsNone(self.tracker.received("N1", "cblb", "lv", "0", 1.1))
+        self.assertEqual(self.tracker.received("N1", "cblb", "lv", "030", 1.2)["seq"], 2)
+        self.assertEqual(self.tracker.stats()["acked"], 2)
+
+    def test_matching_command_acknowledged(self):
+        self.tracker.sent(1, "N1", "a/cblb/set/lv/5", None, 0.0)
+        self.tracker.sent(2, "N1", "a/cblb/set/hsv/1:2:3:0", None, 0.1)
+        # the hsv level, not the level command sent before it
+        self.assertEqual(self.tracker.received("N1", "cblb", "lv", "3", 0.2)["seq"], 2)
+        self.assertIsNone(self.tracker.received("N1", "cblb", "lv", "3", 0.3))
+        self.assertEqual(self.tracker.received("N1", "cblb", "lv", "5", 0.3)["seq"], 1)
+
+    def test_untracked_frames(self):
+        self.assertEqual(self.tracker.sent(1, "N0", "0/ready/ping/0/0", None, 0.0), [])
+        self.assertEqual(self.tracker.sent(2, "N1", "a/cblb/set/ctemp/300", None, 0.0), [])
+        self.assertEqual(self.tracker.stats()["pending"], 0)
+
+    def test_retry_then_ack(self):
+        self.tracker.sent(1, "N1", "a/blb/set/lv/5", None, 0.0)
+        self.assertEqual(self.tracker.expired(0.5), ([], []))
+
+        retry, finished = self.tracker.expired(1.0)
+        self.assertEqual(retry, [("a/blb/set/lv/5", None)])
+        self.assertEqual(finished, [])
+        # reported once per timeout
+        self.assertEqual(self.tracker.expired(1.5), ([], []))
+
+        self.assertEqual(self.tracker.sent(2, "N1", "a/blb/set/lv/5", None, 1.5), [])
+        outcome = self.tracker.received("N1", "blb", "lv", "5", 1.6)
+        self.assertEqual((outcome["seq"], outcome["attempts"]), (2, 2))
+        self.assertAlmostEqual(outcome["rtt_ms"], 100.0)
+        self.assertEqual(self.tracker.stats()["tracked"], 1)
+
+    def test_retry_then_supersede(self):
+        self.tracker.sent(1, "N1", "a/blb/set/lv/5", None, 0.0)
+        retry, finished = self.tracker.expired(1.0)
+        self.assertEqual(len(retry), 1)
+
+        finished = self.tracker.sent(2, "N1", "a/blb/set/lv/9", None, 1.1)
+        self.assertEqual(len(finished), 1)
+        self.assertEqual(finished[0]["outcome"], cmdack.OUTCOME_SUPERSEDED)
+        self.assertEqual(finished[0]["command"], "a/blb/set/lv/5")
+
+        outcome = self.tracker.received("N1", "blb", "lv", "9", 1.2)
+        self.assertEqual(outcome["command"], "a/blb/set/lv/9")
+        stats = self.tracker.stats()
+        self.assertEqual((stats["superseded"], stats["acked"], stats["pending"]), (1, 1, 0))
+
+    def test_timeout_after_retries(self):
+        self.tracker.sent(1, "N1", "a/p/1/sw/1", None, 0.0)
+        retry, finished = self.tracker.expired(1.0)
+        self.tracker.sent(2, "N1", retry[0][0], retry[0][1], 1.0)
+
+        retry, finished = self.tracker.expired(2.0)
+        self.assertEqual(retry, [])
+        self.assertEqual(len(finished), 1)
+        self.assertEqual(finished[0]["outcome"], cmdack.OUTCOME_TIMEOUT)
+        self.assertEqual(finished[0]["attempts"], 2)
+        self.assertNotIn("rtt_ms", finished[0])
+
+        stats = self.tracker.stats()
+        self.assertEqual((stats["timeouts"], stats["retried"], stats["pending"]), (1, 1, 0))
+        self.assertIsNone(self.tracker.received("N1", "p", "st", "1", 2.1))
+
+    def test_no_retries(self):
+        tracker = cmdack.CommandTracker(timeout=1.0, retries=0)
+        tracker.sent(1, "N1", "a/p/1/sw/1", None, 0.0)
+        retry, finished = tracker.expired(1.0)
+        self.assertEqual(retry, [])
+        self.assertEqual(finished[0]["outcome"], cmdack.OUTCOME_TIMEOUT)
+
+    def test_sequence_wrap_finishes_older_command(self):
+        self.tracker.sent(7, "N1", "a/p/1/sw/1", None, 0.0)
+        finished = self.tracker.sent(7, "N2", "b/p/1/sw/1", None, 0.5)
+        self.assertEqual([(outcome["command"], outcome["outcome"]) for outcome in finished],
+                         [("a/p/1/sw/1", cmdack.OUTCOME_TIMEOUT)])
+        self.assertIsNone(self.tracker.received("N1", "p", "st", "1", 0.6))
+        self.assertEqual(self.tracker.received("N2", "p", "st", "1", 0.6)["seq"], 7)
+
+    def test_oldest_command_acknowledged_first(self):
+        self.tracker.sent(1, "N1", "a/cblb/set/lv/5", None, 0.0)
+        self.tracker.sent(2, "N1", "a/cblb/set/hsv/1:2:3:0", None, 0.1)
+        self.assertEqual(self.tracker.received("N1", "cblb", "lv", "5", 0.2)["seq"], 1)
+        self.assertEqual(self.tracker.received("N1", "cblb", "lv", "3", 0.3)["seq"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
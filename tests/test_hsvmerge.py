@@ -0,0 +1,85 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import hsvmerge
+
+
+class HsvMergerTest(unittest.TestCase):
+    def setUp(self):
+        self.merger = hsvmerge.HsvMerger()
+
+    def test_components_merged_with_reported_values(self):
+        self.merger.report("a", "hue", "120")
+        self.merger.report("a", "saturation", "50")
+        self.merger.report("a", "level", "80")
+        self.assertTrue(self.merger.command("a", "hue", 200, rx=1.5))
+        self.assertFalse(self.merger.command("a", "sat", 90))
+        self.assertEqual(self.merger.take("a"), (["a/cblb/set/hsv/200:90:80:0"], 1.5))
+        # the merged values are the bulb's values now
+        self.merger.command("a", "lv", 10)
+        self.merger.command("a", "hue", 30)
+        self.assertEqual(self.merger.take("a"), (["a/cblb/set/hsv/30:90:10:0"], None))
+
+        stats = self.merger.stats()
+        self.assertEqual((stats["merged_frames"], stats["merged_commands"], stats["commands"]), (2, 4, 4))
+
+    def test_single_component_sent_alone(self):
+        self.merger.report("a", "hue", "120")
+        self.merger.report("a", "saturation", "50")
+        self.merger.report("a", "level", "80")
+        self.merger.command("a", "lv", 10)
+        self.merger.command("a", "lv", 20)
+        self.assertEqual(self.merger.take("a"), (["a/cblb/set/lv/20"], None))
+        self.assertEqual(self.merger.take("a"), ([], None))
+
+    def test_unknown_components_sent_as_frames(self):
+        self.merger.report("a", "hue", "120")
+        self.merger.command("a", "sat", 90)
+        self.merger.command("a", "hue", 10)
+        self.assertEqual(self.merger.take("a"), (["a/cblb/set/hue/10", "a/cblb/set/sat/90"], None))
+        self.assertEqual(self.merger.stats()["single_frames"], 2)
+
+    def test_invalid_reports_not_cached(self):
+        self.merger.report("a", "hue", "400")
+        self.merger.report("a", "saturation", "x")
+        self.merger.report("a", "level", "80")
+        self.merger.report("a", "temperature", "300")
+        self.merger.command("a", "hue", 10)
+        self.merger.command("a", "lv", 20)
+        self.assertEqual(self.merger.take("a")[0], ["a/cblb/set/hue/10", "a/cblb/set/lv/20"])
+
+    def test_hsv_command_supersedes_pending_components(self):
+        self.merger.command("a", "hue", 10)
+        self.merger.command_hsv("a", "1", "2", "300")
+        self.assertEqual(self.merger.take("a"), ([], None))
+        # valid components of the hsv command are known values, the level is not
+        self.merger.command("a", "sat", 9)
+        self.merger.command("a", "hue", 7)
+        self.assertEqual(self.merger.take("a")[0], ["a/cblb/set/hue/7", "a/cblb/set/sat/9"])
+        self.merger.command("a", "lv", 5)
+        self.merger.command("a", "hue", 8)
+        self.assertEqual(self.merger.take("a")[0], ["a/cblb/set/hsv/8:9:5:0"])
+
+    def test_bulbs_merged_separately(self):
+        for mac in ("a", "b"):
+            self.merger.report(mac, "hue", "1")
+            self.merger.report(mac, "saturation", "2")
+            self.merger.report(mac, "level", "3")
+        self.merger.command("a", "hue", 10)
+        self.merger.command("b", "sat", 20)
+        self.merger.command("a", "sat", 30)
+        self.assertEqual(self.merger.take("b")[0], ["b/cblb/set/sat/20"])
+        self.assertEqual(self.merger.take("a")[0], ["a/cblb/set/hsv/10:30:3:0"])
+
+    def test_normalise(self):
+        self.assertEqual(hsvmerge.normalise("hue", "360"), "360")
+        self.assertEqual(hsvmerge.normalise("lv", "007"), "7")
+        self.assertIsNone(hsvmerge.normalise("sat", "101"))
+        self.assertIsNone(hsvmerge.normalise("hue", None))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import journal
+
+
+class FailingJournal(journal.PublishJournal):
+    """Journal whose database writes fail while fail is set."""
+    fail = False
+
+    def _write(self, rows, events):
+        if self.fail:
+            raise sqlite3.OperationalError("disk I/O error")
+        journal.PublishJournal._write(self, rows, events)
+
+
+class PublishJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.journal = FailingJournal(os.path.join(self.dir, "journal.db"))
+
+    def tearDown(self):
+        self.journal.fail = False
+        self.journal.close()
+        shutil.rmtree(self.dir)
+
+    def test_retained_compacted_events_kept(self):
+        self.journal.record("a/value", "1", 1, 1)
+        self.journal.record("a/event", "x", 0, 0)
+        self.journal.record("a/value", "2", 1, 1)
+        self.journal.record("a/event", "y", 0, 0)
+        self.assertEqual(len(self.journal), 3)
+        self.assertTrue(self.journal.flush())
+        # compacted on disk too
+        self.journal.record("a/value", "3", 1, 1)
+        self.journal.flush()
+
+        records = self.journal.take(10)
+        self.assertEqual([(topic, payload) for topic, payload, qos, retain, expiry, unit in records],
+                         [("a/event", "x"), ("a/event", "y"), ("a/value", "3")])
+        self.assertEqual(len(self.journal), 0)
+        self.assertEqual(self.journal.stats()["compacted"], 1)
+
+    def test_reopen_keeps_records(self):
+        self.journal.record("a/value", "1", 1, 1, unit="W")
+        self.journal.close()
+        self.journal = FailingJournal(self.journal.path)
+        self.assertEqual(self.journal.take(10), [("a/value", "1", 1, 1, None, "W")])
+
+    def test_expiry(self):
+        self.journal.record("a/old", "1", 1, 1, expiry=60)
+        self.journal.record("a/new", "2", 1, 1, expiry=60)
+        self.journal.flush()
+        self.journal._db.execute("UPDATE publish SET stamp = stamp - 30 WHERE topic = 'a/new'")
+        self.journal._db.execute("UPDATE publish SET stamp = stamp - 90 WHERE topic = 'a/old'")
+
+        records = self.journal.take(10)
+        self.assertEqual(len(records), 1)
+        topic, payload, qos, retain, expiry, unit = records[0]
+        self.assertEqual(topic, "a/new")
+        self.assertLessEqual(expiry, 30)
+        self.assertEqual(self.journal.stats()["expired"], 1)
+
+    def test_max_age_and_bytes(self):
+        small = journal.PublishJournal(os.path.join(self.dir, "small.db"), max_bytes=100, max_age=3600)
+        small.record("old", "x" * 50, 0, 0)
+        small.flush()
+        small._db.execute("UPDATE publish_event SET stamp = stamp - 7200")
+        for value in range(4):
+            small.record("t" + str(value), "x" * 30, 0, 0)
+        small.flush()
+        stats = small.stats()
+        self.assertEqual((stats["expired"], stats["evicted"], stats["depth"]), (1, 1, 3))
+        self.assertEqual([record[0] for record in small.take(10)], ["t1", "t2", "t3"])
+        small.close()
+
+    def test_failed_flush_keeps_records_and_backs_off(self):
+        self.journal.fail = True
+        for value in range(journal.JOURNAL_FLUSH_RECORDS * 2):
+            self.journal.record("a/event", str(value), 0, 0)
+        # one attempt at the threshold, none while backing off
+        self.assertEqual(self.journal.errors, 1)
+        self.assertTrue(self.journal.failing)
+        self.assertEqual(len(self.journal), journal.JOURNAL_FLUSH_RECORDS * 2)
+
+        self.journal.fail = False
+        self.assertTrue(self.journal.flush())
+        self.assertFalse(self.journal.failing)
+        records = self.journal.take(journal.JOURNAL_FLUSH_RECORDS * 2)
+        self.assertEqual([record[1] for record in records], [str(value) for value in range(journal.JOURNAL_FLUSH_RECORDS * 2)])
+
+    def test_failed_flush_newer_retained_wins(self):
+        self.journal.record("a/value", "1", 1, 1)
+        self.journal.fail = True
+        self.assertFalse(self.journal.flush())
+        self.journal.record("a/value", "2", 1, 1)
+        self.journal.fail = False
+        self.journal.flush()
+        self.assertEqual([record[1] for record in self.journal.take(10)], ["2"])
+
+    def test_buffer_bounded_while_failing(self):
+        self.journal.fail = True
+        self.journal.record("a/value", "0", 1, 1)
+        total = journal.JOURNAL_BUFFER_RECORDS + 10
+        for value in range(total):
+            self.journal.record("a/event", str(value), 0, 0)
+        self.assertEqual(len(self.journal), journal.JOURNAL_BUFFER_RECORDS)
+        self.assertEqual(self.journal.evicted, 11)
+
+    def test_take_from_buffer_while_failing(self):
+        self.journal.fail = True
+        self.journal.record("a/value", "1", 1, 1)
+        self.journal.record("a/event", "x", 0, 0)
+        self.journal.record("a/value", "2", 1, 1)
+        self.assertFalse(self.journal.flush())
+        errors = self.journal.errors
+
+        self.assertEqual([record[1] for record in self.journal.take(1)], ["x"])
+        self.assertEqual([record[1] for record in self.journal.take(10)], ["2"])
+        self.assertEqual(len(self.journal), 0)
+        # backing off, take() did not write again
+        self.assertEqual(self.journal.errors, errors)
+
+
+if __name__ == "__main__":
+    unittest.main()
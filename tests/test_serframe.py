@@ -0,0 +1,105 @@
+import os
+import sys
+import unittest
+from functools import reduce
+from operator import xor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import serframe
+
+
+def mt_frame(cmd0, cmd1, data):
+    body = bytes([len(data), cmd0, cmd1]) + data
+    return bytes([serframe.SOF]) + body + bytes([reduce(xor, body)])
+
+
+def frames(reader, *chunks):
+    """(kind, data) of the frames the reader returns for the chunks fed one by one."""
+    result = []
+    for chunk in chunks:
+        result.extend((frame.kind, frame.data) for frame in reader.feed(chunk))
+    return result
+
+
+class FakePort(object):
+    def __init__(self, data):
+        self.data = data
+        self.reads = []
+
+    @property
+    def in_waiting(self):
+        return len(self.data)
+
+    def read(self, size):
+        self.reads.append(size)
+        data, self.data = self.data[:size], self.data[size:]
+        return data
+
+
+class SerialFrameReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.reader = serframe.SerialFrameReader(max_line=32)
+
+    def test_lines_and_mt_frames_interleaved(self):
+        mt = mt_frame(0x45, 0xC1, b"\x01\x02\x03")
+        self.assertEqual(frames(self.reader, b"a/p/1/st/1\n" + mt + b"b/p/1/st/0\n"),
+                         [(serframe.FRAME_LINE, b"a/p/1/st/1\n"),
+                          (serframe.FRAME_MT, mt),
+                          (serframe.FRAME_LINE, b"b/p/1/st/0\n")])
+        self.assertEqual(self.reader.stats()["lines"], 2)
+        self.assertEqual(self.reader.stats()["mt_frames"], 1)
+
+    def test_partial_frames_wait_for_the_rest(self):
+        mt = mt_frame(0x61, 0x01, b"\x00" * 4)
+        self.assertEqual(frames(self.reader, b"a/p/1/"), [])
+        self.assertEqual(frames(self.reader, b"st/1\n" + mt[:1]), [(serframe.FRAME_LINE, b"a/p/1/st/1\n")])
+        self.assertEqual(frames(self.reader, mt[1:2], mt[2:4]), [])
+        self.assertEqual(frames(self.reader, mt[4:] + b"a/p"), [(serframe.FRAME_MT, mt)])
+        self.assertEqual(frames(self.reader, b"/1/st/1\r\n"), [(serframe.FRAME_LINE, b"a/p/1/st/1\r\n")])
+        self.assertEqual(self.reader.garbage_bytes, 0)
+
+    def test_resync_after_bad_fcs(self):
+        good = mt_frame(0x41, 0x80, b"\x00")
+        bad = bytearray(good)
+        bad[-1] ^= 0xFF
+        self.assertEqual(frames(self.reader, bytes(bad) + good), [(serframe.FRAME_MT, good)])
+        stats = self.reader.stats()
+        self.assertEqual(stats["fcs_errors"], 1)
+        self.assertEqual(stats["garbage_bytes"], len(bad))
+
+    def test_sof_inside_line_drops_the_line(self):
+        mt = mt_frame(0x41, 0x80, b"")
+        self.assertEqual(frames(self.reader, b"garb" + mt + b"a/p/1/st/1\n"),
+                         [(serframe.FRAME_MT, mt), (serframe.FRAME_LINE, b"a/p/1/st/1\n")])
+        self.assertEqual(self.reader.garbage_bytes, 4)
+
+    def test_overlong_line_is_garbage(self):
+        self.assertEqual(frames(self.reader, b"x" * 40), [])
+        self.assertEqual(self.reader.garbage_bytes, 40)
+        self.assertEqual(frames(self.reader, b"a/p/1/st/1\n"), [(serframe.FRAME_LINE, b"a/p/1/st/1\n")])
+
+        # up to max_line bytes are kept waiting for the newline
+        self.assertEqual(frames(self.reader, b"y" * 32), [])
+        self.assertEqual(frames(self.reader, b"\n"), [(serframe.FRAME_LINE, b"y" * 32 + b"\n")])
+
+    def test_reset_drops_partial_frame(self):
+        frames(self.reader, b"a/p/1/st")
+        self.reader.reset()
+        self.assertEqual(frames(self.reader, b"b/p/1/st/0\n"), [(serframe.FRAME_LINE, b"b/p/1/st/0\n")])
+        self.assertEqual(self.reader.garbage_bytes, 8)
+
+    def test_read_takes_everything_pending(self):
+        port = FakePort(b"a/p/1/st/1\nb/p/1/st/0\n")
+        self.assertEqual(len(self.reader.read(port)), 2)
+        self.assertEqual(self.reader.read(port), [])
+        self.assertEqual(port.reads, [22, 1])
+
+    def test_frames_stamped_at_rx(self):
+        frame = self.reader.feed(b"a/p/1/st/1\n")[0]
+        self.assertIsInstance(frame.rx_mono, float)
+        self.assertIsInstance(frame.rx_ms, int)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import sertx
+
+
+def drain(scheduler, now):
+    """Messages take() hands out at now, in order."""
+    messages = []
+    while True:
+        frame, wait = scheduler.take(now)
+        if frame is None:
+            return messages
+        messages.append(frame[0])
+
+
+class TxSchedulerTest(unittest.TestCase):
+    def test_coalesce_keeps_order_of_last_change(self):
+        scheduler = sertx.TxScheduler(0, 0, 0)
+        scheduler.put("a/cblb/set/sw/1", now=0, coalesce=True)
+        scheduler.put("a/cblb/set/lv/5", now=0, coalesce=True)
+        scheduler.put("b/p/1/sw/1", now=0)
+        scheduler.put("a/cblb/set/sw/0", now=1, coalesce=True)
+        scheduler.put("a/cblb/set/lv/9", now=1, coalesce=True)
+
+        self.assertEqual(drain(scheduler, 2), ["b/p/1/sw/1", "a/cblb/set/sw/0", "a/cblb/set/lv/9"])
+        stats = scheduler.stats()
+        self.assertEqual(stats["coalesced"], 2)
+        self.assertEqual(stats["coalesced_by_attribute"], {"cblb/sw": 1, "cblb/lv": 1})
+
+    def test_coalesce_only_same_attribute(self):
+        scheduler = sertx.TxScheduler(0, 0, 0)
+        scheduler.put("a/cblb/set/hue/10", now=0, coalesce=True)
+        scheduler.put("a/cblb/set/sat/20", now=0, coalesce=True)
+        scheduler.put("b/cblb/set/hue/30", now=0, coalesce=True)
+        self.assertEqual(drain(scheduler, 0), ["a/cblb/set/hue/10", "a/cblb/set/sat/20", "b/cblb/set/hue/30"])
+        self.assertEqual(scheduler.coalesced, 0)
+
+    def test_uncoalesced_frames_are_all_sent(self):
+        scheduler = sertx.TxScheduler(0, 0, 0)
+        scheduler.put("a/p/1/re/1", now=0)
+        scheduler.put("a/p/1/re/1", now=0)
+        self.assertEqual(drain(scheduler, 0), ["a/p/1/re/1", "a/p/1/re/1"])
+
+    def test_coalesced_latency_counts_from_first_change(self):
+        scheduler = sertx.TxScheduler(0, 0, 0)
+        scheduler.put("a/blb/set/lv/1", now=0, coalesce=True)
+        scheduler.put("a/blb/set/lv/2", now=1, coalesce=True)
+        drain(scheduler, 2)
+        self.assertEqual(scheduler.latency_max, 2000)
+
+    def test_retry_dropped_while_newer_value_queued(self):
+        scheduler = sertx.TxScheduler(0, 0, 0)
+        scheduler.put("a/p/1/sw/0", now=0, coalesce=True)
+        self.assertFalse(scheduler.retry("a/p/1/sw/1", now=0))
+        self.assertEqual(drain(scheduler, 0), ["a/p/1/sw/0"])
+
+        self.assertTrue(scheduler.retry("a/p/1/sw/1", now=1))
+        self.assertEqual(drain(scheduler, 1), ["a/p/1/sw/1"])
+
+    def test_destination_gap_lets_other_nodes_pass(self):
+        scheduler = sertx.TxScheduler(0, 0, 0.25)
+        scheduler.put("a/p/1/sw/1", now=0)
+        scheduler.put("a/p/1/sw/0", now=0)
+        scheduler.put("b/p/1/sw/1", now=0)
+
+        self.assertEqual(drain(scheduler, 0), ["a/p/1/sw/1", "b/p/1/sw/1"])
+        frame, wait = scheduler.take(0.1)
+        self.assertIsNone(frame)
+        self.assertAlmostEqual(wait, 0.15)
+        self.assertEqual(drain(scheduler, 0.25), ["a/p/1/sw/0"])
+
+    def test_gap_adapts_to_answers_from_destination_only(self):
+        scheduler = sertx.TxScheduler(0.05, 0.5, 0)
+        now = 0.0
+        for value in range(20):
+            scheduler.put("a/p/1/sw/" + str(value % 2), now=now)
+            self.assertEqual(len(drain(scheduler, now)), 1)
+            scheduler.responded(now + 0.01, "b")
+            now += 0.6
+        self.assertEqual(scheduler.gap, 0.5)
+
+        for value in range(20):
+            scheduler.put("a/p/1/sw/" + str(value % 2), now=now)
+            self.assertEqual(len(drain(scheduler, now)), 1)
+            scheduler.responded(now + 0.01, "a")
+            now += 0.6
+        self.assertEqual(scheduler.gap, 0.05)
+
+    def test_destination(self):
+        self.assertEqual(sertx.destination("12:4b:0:7/p/1/sw/1"), "12:4b:0:7")
+        self.assertEqual(sertx.destination("0/ready/ping/0/0"), "0")
+
+    def test_command_key(self):
+        self.assertEqual(sertx.command_key("a/cblb/set/hsv/10:20:30:0"), "a/cblb/set/hsv")
+        self.assertEqual(sertx.command_key("a/p/1/sw/1"), "a/p/1/sw")
+
+
+if __name__ == "__main__":
+    unittest.main()
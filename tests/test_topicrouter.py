@@ -0,0 +1,94 @@
+import itertools
+import os
+import re
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import topicrouter
+
+NID = "([0-9A-Fa-f]{16})"
+NODE_ROUTES = ["smarthome/node/+/hw/zigbee/service", "smarthome/node/+/hw/led/+"]
+for _segment, _verb in [("power", "switch/status"), ("power", "set/switch"), ("power", "sleep"), ("power", "reset/energy"),
+                        ("temperature", "sleep"), ("humidity", "sleep"), ("motion", "arm"), ("motion", "sleep"),
+                        ("fall", "arm"), ("fall", "keepalive"), ("co2", "sleep"), ("voc", "sleep"), ("pm2_5", "sleep"),
+                        ("pm10", "sleep"), ("illuminance", "sleep"), ("pressure", "sleep"), ("bulb", "set/switch"),
+                        ("bulb", "set/level"), ("bulb", "query"), ("colorbulb", "set/switch"), ("colorbulb", "set/level"),
+                        ("colorbulb", "set/hue"), ("colorbulb", "set/saturation"), ("colorbulb", "set/hsv"),
+                        ("colorbulb", "set/temperature"), ("colorbulb", "query")]:
+    NODE_ROUTES.append("smarthome/node/+/sensor/%s/+/%s" % (_segment, _verb))
+GATEWAY_ROUTES = ["smarthome/gateway/+/hw/led/+", "smarthome/gateway/+/hw/reset/+", "smarthome/gateway/+/hw/ping/+",
+                  "smarthome/platform/diagnostic/zdo/+", "smarthome/platform/diagnostic/loglevel/zmqtt",
+                  "smarthome/gateway/+/hw/sbl/+", "smarthome/gateway/+/hw/ota/+", "smarthome/gateway/+/hw/swdl/+",
+                  "smarthome/gateway/+/hw/lqi/+"]
+
+# the regex chain process_mqtt_message() used before the router, in its order
+LEGACY = ([(re.compile("^" + pattern.replace("+", NID, 1).replace("+", "([^/]+)")), pattern) for pattern in NODE_ROUTES] +
+          [(re.compile(pattern.replace("+", "([^/]+)")), pattern) for pattern in GATEWAY_ROUTES])
+
+# what zmqtt subscribes to, the shapes inbound topics can have
+SUBSCRIPTIONS = ["smarthome/node/+/hw/zigbee/service", "smarthome/node/+/hw/led/+", "smarthome/node/+/sensor/+/+/sleep",
+                 "smarthome/node/+/sensor/+/+/reset", "smarthome/node/+/sensor/+/+/arm",
+                 "smarthome/node/+/sensor/+/+/switch/status", "smarthome/node/+/sensor/+/+/keepalive",
+                 "smarthome/node/+/sensor/+/+/set/+", "smarthome/node/+/sensor/+/+/query"] + GATEWAY_ROUTES
+
+# values tried for "+": node ids valid and not, sensors, ids and attributes
+SEGMENTS = ["67161707004B1200", "67161707004b1200", "67161707004B120", "67161707004B120G",
+            "power", "bulb", "colorbulb", "1026", "switch", "level", "hue", "x"]
+
+
+def legacy_match(topic):
+    for regex, pattern in LEGACY:
+        match = regex.search(topic)
+        if match:
+            return pattern, list(match.groups())
+    return None, None
+
+
+def topics(pattern):
+    parts = pattern.split("/")
+    wildcards = parts.count("+")
+    for values in itertools.product(SEGMENTS, repeat=wildcards):
+        values = iter(values)
+        yield "/".join(next(values) if part == "+" else part for part in parts)
+
+
+class TopicRouterTest(unittest.TestCase):
+    def setUp(self):
+        self.router = topicrouter.TopicRouter()
+        for pattern in NODE_ROUTES:
+            self.router.add(pattern, pattern, {0: topicrouter.is_node_id})
+        for pattern in GATEWAY_ROUTES:
+            self.router.add(pattern, pattern)
+
+    def test_routes_match_legacy_regex_chain(self):
+        checked = 0
+        routed = 0
+        for pattern in SUBSCRIPTIONS + NODE_ROUTES:
+            for topic in topics(pattern):
+                expected = legacy_match(topic)
+                handler, params = self.router.match(topic)
+                self.assertEqual((handler, params if handler is not None else None), expected, topic)
+                checked += 1
+                routed += expected[0] is not None
+        self.assertGreater(routed, 100)
+        self.assertLess(routed, checked)
+
+    def test_route_calls_handler_with_parameters(self):
+        calls = []
+        router = topicrouter.TopicRouter()
+        router.add("smarthome/node/+/sensor/bulb/+/set/level", lambda params, payload: calls.append((params, payload)),
+                   {0: topicrouter.is_node_id})
+        self.assertTrue(router.route("smarthome/node/67161707004B1200/sensor/bulb/1/set/level", b"50"))
+        self.assertFalse(router.route("smarthome/node/nonode/sensor/bulb/1/set/level", b"50"))
+        self.assertFalse(router.route("smarthome/node/67161707004B1200/sensor/bulb/1/set", b"50"))
+        self.assertEqual(calls, [(["67161707004B1200", "1"], b"50")])
+        self.assertEqual(router.stats(), {"routed": 1, "unknown": 2})
+
+    def test_duplicate_route(self):
+        self.assertRaises(ValueError, self.router.add, "smarthome/gateway/+/hw/lqi/+", None)
+
+
+if __name__ == "__main__":
+    unittest.main()